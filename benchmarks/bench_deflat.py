@@ -0,0 +1,202 @@
+"""
+deflat 各阶段的基准测试, 在 flatgen 生成的平坦化 CFG 上运行, 输出随块数量变化的耗时曲线
+
+用法:
+    python benchmarks/bench_deflat.py [--sizes 100,1000,5000,10000,50000] [--carrier reg] [--dispatchers 2]
+                                      [--state-vars 3] [--double-ratio 0.2] [--cond-ratio 0.1] [--csel-ratio 0.1]
+                                      [--json out.json]
+
+阶段按 Unflattener.deflat 的顺序排列: 查找分发块、VALRANGES、状态索引、指令扫描、状态转移摘要、
+自动选择级别、各级别的匹配和块拆分, 最后的 deflat_auto 是自动选择级别时完整的 deflat。
+每个阶段取多次运行中的最小值, 最后一列 slope 是 log-log 拟合的增长指数(1 为线性, 2 为平方)。
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flatgen import FlatConfig, generate_dict  # noqa: E402
+from unflat.cfgUtil import EdgeTransaction, modify_edge  # noqa: E402
+from unflat.mcmodel import mba_from_dict  # noqa: E402
+from unflat.unflattener import AUTO_LEVEL, Unflattener  # noqa: E402
+
+DEFAULT_SIZES = [100, 1000, 5000, 10000, 50000]
+
+
+def _prepared(data: dict, upto: str) -> Tuple[Unflattener, Dict[int, int]]:
+    """
+    构造一个新的 Unflattener, 按 deflat 的顺序运行到指定阶段之前
+
+    Returns:
+        (Unflattener, plan_transitions 的结果), 还没有运行到 plan_transitions 时后者为空
+    """
+    unflat = Unflattener(mba_from_dict(data))
+    summarized: Dict[int, int] = {}
+    if upto == "dispatcher":
+        return unflat, summarized
+    unflat.find_dispatchers()
+    if upto == "valranges":
+        return unflat, summarized
+    unflat.find_mblock_valranges()
+    if upto == "state_index":
+        return unflat, summarized
+    unflat.build_state_index()
+    if upto == "state_scan":
+        return unflat, summarized
+    unflat.scan_instructions()
+    if upto == "transitions":
+        return unflat, summarized
+    summarized = unflat.plan_transitions()
+    if upto == "levels":
+        return unflat, summarized
+    # 与 deflat 相同, 块拆分在级别2的匹配和摘要得到的跳转修改提交之后进行
+    with EdgeTransaction(unflat.mba) as txn:
+        unflat.deflat_level_2(txn)
+        for cur_mblock_id, next_mblock_id in summarized.items():
+            if cur_mblock_id not in unflat.redirections:
+                unflat.redirect(cur_mblock_id, next_mblock_id, txn)
+    return unflat, summarized
+
+
+def _redirect_edges(unflat: Unflattener):
+    """
+    把所有跳回分发块的边改到分发块的下一个块, 返回 (cur, new, old) 列表
+    """
+    dispatcher = unflat.mba.get_mblock(unflat.dispatcher_id)
+    return [(pred, dispatcher.serial + 1, dispatcher.serial) for pred in list(dispatcher.predset)]
+
+
+def _modify_edge_each(unflat: Unflattener, summarized: Dict[int, int]):
+    for cur, new, old in _redirect_edges(unflat):
+        modify_edge(unflat.mba, cur, new, old)
+
+
+def _modify_edge_batch(unflat: Unflattener, summarized: Dict[int, int]):
+    with EdgeTransaction(unflat.mba) as txn:
+        for cur, new, old in _redirect_edges(unflat):
+            txn.modify_edge(cur, new, old)
+
+
+# 阶段名 -> (准备到哪一步, 被计时的函数(Unflattener, plan_transitions 的结果))
+PHASES: Dict[str, tuple] = {
+    "find_dispatcher_id": ("dispatcher", lambda u, s: u.find_dispatcher_id()),
+    "find_dispatchers": ("dispatcher", lambda u, s: u.find_dispatchers()),
+    "find_mblock_valranges": ("valranges", lambda u, s: u.find_mblock_valranges()),
+    "build_state_index": ("state_index", lambda u, s: u.build_state_index()),
+    "scan_instructions": ("state_scan", lambda u, s: u.scan_instructions()),
+    "plan_transitions": ("transitions", lambda u, s: u.plan_transitions()),
+    "choose_level": ("levels", lambda u, s: u.choose_level(s)),
+    "deflat_level_1": ("levels", lambda u, s: u.deflat_level_1()),
+    "deflat_level_2": ("levels", lambda u, s: u.deflat_level_2()),
+    "deflat_level_3": ("levels", lambda u, s: u.deflat_level_3()),
+    "deflat_level_4": ("levels", lambda u, s: u.deflat_level_4()),
+    "apply_splits": ("splits", lambda u, s: u.apply_splits(u.splits)),
+    "deflat_auto": ("dispatcher", lambda u, s: u.deflat(AUTO_LEVEL)),
+    "modify_edge": ("valranges", _modify_edge_each),
+    "edge_transaction": ("valranges", _modify_edge_batch),
+}
+
+
+def time_phase(data: dict, upto: str, func: Callable[[Unflattener, Dict[int, int]], None], repeat: int) -> float:
+    best = math.inf
+    for _ in range(repeat):
+        unflat, summarized = _prepared(data, upto)
+        start = time.perf_counter()
+        func(unflat, summarized)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def slope(points: List[tuple]) -> Optional[float]:
+    """
+    log-log 最小二乘拟合的斜率
+    """
+    points = [(math.log(n), math.log(t)) for n, t in points if t and t > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if var == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+
+def run(sizes: List[int], phases: List[str], repeat: int, max_naive_edges: int, **gen_kwargs) -> dict:
+    results = {"config": gen_kwargs, "sizes": sizes, "phases": {}}
+    for phase in phases:
+        results["phases"][phase] = {}
+    for size in sizes:
+        data = generate_dict(FlatConfig(nb_blocks=size, **gen_kwargs))
+        nb_blocks = len(data["blocks"])
+        for phase in phases:
+            upto, func = PHASES[phase]
+            if phase == "modify_edge" and nb_blocks // 2 > max_naive_edges:
+                results["phases"][phase][size] = None
+                continue
+            results["phases"][phase][size] = time_phase(data, upto, func, repeat)
+        print(f"[+] {size} 块完成", file=sys.stderr)
+    return results
+
+
+def print_table(results: dict):
+    sizes = results["sizes"]
+    name_width = max(len(phase) for phase in results["phases"])
+    header = "phase".ljust(name_width) + "".join(f"{size:>12}" for size in sizes) + "     slope"
+    print(header)
+    print("-" * len(header))
+    for phase, timings in results["phases"].items():
+        row = phase.ljust(name_width)
+        for size in sizes:
+            t = timings.get(size)
+            row += f"{'-':>12}" if t is None else f"{t * 1000:>10.2f}ms"
+        k = slope([(size, timings.get(size)) for size in sizes if timings.get(size) is not None])
+        row += f"{'-':>10}" if k is None else f"{k:>10.2f}"
+        print(row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="deflat 各阶段的基准测试")
+    parser.add_argument("--sizes", default=",".join(str(x) for x in DEFAULT_SIZES), help="逗号分隔的块数量")
+    parser.add_argument("--phases", default=",".join(PHASES), help="逗号分隔的阶段名")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dispatchers", type=int, default=1)
+    parser.add_argument("--state-vars", type=int, default=1)
+    parser.add_argument("--carrier", choices=["stack", "reg"], default="stack")
+    parser.add_argument("--double-ratio", type=float, default=0.0)
+    parser.add_argument("--cond-ratio", type=float, default=0.0, help="由 setcc 选择下一个状态的 case 块比例")
+    parser.add_argument("--csel-ratio", type=float, default=0.0, help="csel 风格条件状态的 case 块比例")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--filler", type=int, default=4)
+    parser.add_argument("--max-naive-edges", type=int, default=5000,
+                        help="超过该边数时跳过逐条 modify_edge 的测试")
+    parser.add_argument("--log", action="store_true", help="保留 INFO 日志(默认关闭以只测量算法本身)")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    if not args.log:
+        logging.disable(logging.INFO)
+    sizes = [int(x) for x in args.sizes.split(",") if x]
+    phases = [x for x in args.phases.split(",") if x]
+    for phase in phases:
+        if phase not in PHASES:
+            parser.error(f"未知阶段: {phase}")
+    results = run(sizes, phases, args.repeat, args.max_naive_edges,
+                  nb_dispatchers=args.dispatchers, nb_state_vars=args.state_vars, carrier=args.carrier,
+                  double_ratio=args.double_ratio, cond_ratio=args.cond_ratio, csel_ratio=args.csel_ratio,
+                  filler=args.filler, seed=args.seed)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+VALRANGES 解析的微基准: 原先 mblock_valranges_filter + find_mblock_valranges 的实现 vs 流式 ValrangesParser
+
+用法:
+    python benchmarks/bench_valranges.py [--update] [microcode文本 ...]
+
+参数为 dump_microcode_for_debug 或快照功能保存的 microcode 文本(.mc, .mc.gz, .mc.zst), 不传参数时使用
+benchmarks/valranges 中录制的 listing 和生成的文本。每个录制的 listing 旁边的 *.expected.json 是
+parse_valranges 应该给出的 (块序号, 名字, 值) 列表, 解析结果与它或与原先的实现不一致时返回非 0;
+--update 用这次的解析结果重写 *.expected.json。
+
+glbopt1_switch.mc 是按快照格式(去掉颜色标签的 mba._print 输出)手工整理的一个小 switch 函数, 不是 IDA 直接导出的;
+把快照功能保存的 listing 放入 benchmarks/valranges 并运行 --update 即可加入检查。
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unflat.my_microcode_log import SNAPSHOT_EXTENSIONS, read_snapshot  # noqa: E402
+from unflat.valranges import parse_valranges  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "valranges")
+EXPECTED_EXTENSION = ".expected.json"
+
+# IDA 输出中的颜色标签, 原实现会把它们当作不可打印字符去掉
+COLOR_ON = "\x01"
+COLOR_OFF = "\x02"
+COLOR_REG = "\x0c"
+
+
+def calc_entroy(value: int) -> bool:
+    count = 0
+    for i in range(4):
+        if value >> (i * 8) & 0xff != 0:
+            count += 1
+    return count >= 4
+
+
+def legacy_parse(lines):
+    """原先的实现: 逐字符过滤后缓存所有匹配行, 再逐行 split"""
+    valranges = []
+    for line in lines:
+        if "VALRANGES" in line or "BLOCK" in line:
+            valranges.append("".join([c if 0x20 <= ord(c) <= 0x7e else "" for c in line]))
+    possible_states = []
+    for line in valranges:
+        if "BLOCK" in line:
+            mblock_id = int(line.split("BLOCK ")[1].split(" ")[0])
+            continue
+        valranges_value = line.split("VALRANGES: ")[1]
+        valranges_list = valranges_value.split(", ")
+        for valrange in valranges_list:
+            if ":==" in valrange:
+                valrange_name = valrange.split(":==")[0]
+                valrange_value = valrange.split(":==")[1]
+                if calc_entroy(int(valrange_value, 16)):
+                    possible_states.append({
+                        'mblock_id': mblock_id,
+                        'valrange_name': valrange_name.split(".")[0],
+                        'valrange_value': int(valrange_value, 16)
+                    })
+    return possible_states
+
+
+def streaming_parse(lines):
+    # 流式解析保留大小后缀, 和原先的实现比较时去掉
+    return [{'mblock_id': mblock_id, 'valrange_name': name.split(".")[0], 'valrange_value': value}
+            for mblock_id, name, value in parse_valranges(lines, calc_entroy)]
+
+
+def _colored(text: str) -> str:
+    return COLOR_ON + COLOR_REG + text + COLOR_OFF + COLOR_REG
+
+
+def synth_microcode(nb_blocks: int = 3000, insns_per_block: int = 12, seed: int = 0):
+    """生成和 mba._print 输出格式一致的 microcode 文本"""
+    rnd = random.Random(seed)
+    lines = []
+    for serial in range(nb_blocks):
+        lines.append(f"{serial}. 0 ; 2WAY-BLOCK {serial} INBOUNDS: {serial - 1} OUTBOUNDS: {serial + 1} "
+                     f"[START={0x401000 + serial * 0x20:X} END={0x401020 + serial * 0x20:X}] "
+                     f"MINREFS: STK=38/ARG=300, MAXBSP: 0")
+        items = []
+        for _ in range(rnd.randint(0, 3)):
+            items.append(f"{_colored('%0x{:X}'.format(rnd.randrange(0x10, 0x100, 4)))}.4:=="
+                         f"0x{rnd.getrandbits(32) | 0x01010101:X}")
+        if rnd.random() < 0.5:
+            items.append(f"{_colored('eax')}.4:[0x1..0x{rnd.randint(2, 0xff):X}]")
+        if items:
+            lines.append(f"{serial}. 0 ; VALRANGES: " + ", ".join(items))
+        for idx in range(insns_per_block):
+            lines.append(f"{serial}. {idx} mov    {_colored('#0x{:X}'.format(rnd.getrandbits(32)))}.4, "
+                         f"{_colored('%0x{:X}'.format(rnd.randrange(0x10, 0x100, 4)))}.4 "
+                         f"; {0x401000 + serial * 0x20 + idx:X} u= d=%0x1C.4")
+    return lines
+
+
+def load_microcode(path: str):
+    # 按文件行读取: str.splitlines 还会在 \x0c、\x1c 等字符处断行, 带颜色标签的文本会被切碎
+    with read_snapshot(path) as f:
+        return [line.rstrip("\r\n") for line in f]
+
+
+def fixture_paths() -> list:
+    return sorted(path for ext in SNAPSHOT_EXTENSIONS.values() for path in glob.glob(os.path.join(FIXTURE_DIR, "*" + ext)))
+
+
+def _expected_path(path: str) -> str:
+    for ext in SNAPSHOT_EXTENSIONS.values():
+        if path.endswith(ext):
+            return path[:-len(ext)] + EXPECTED_EXTENSION
+    return path + EXPECTED_EXTENSION
+
+
+def check_expected(path: str, lines, update: bool = False, required: bool = True) -> bool:
+    """
+    把 parse_valranges 的完整结果(不过滤熵值, 名字带大小后缀)与录制的 listing 旁边的期望结果比较
+
+    Args:
+        required: 没有期望结果时是否算作失败, 命令行指定的文本不要求
+    """
+    parsed = [list(entry) for entry in parse_valranges(lines)]
+    expected_path = _expected_path(path)
+    if update:
+        with open(expected_path, "w", encoding="utf-8") as f:
+            json.dump(parsed, f, separators=(",", ":"))
+            f.write("\n")
+        return True
+    if not os.path.exists(expected_path):
+        if not required:
+            return True
+        print(f"[-] {os.path.basename(path)}: 没有 {os.path.basename(expected_path)}, 使用 --update 生成")
+        return False
+    with open(expected_path, "r", encoding="utf-8") as f:
+        expected = json.load(f)
+    if parsed != expected:
+        print(f"[-] {os.path.basename(path)}: 解析结果与 {os.path.basename(expected_path)} 不一致")
+        return False
+    return True
+
+
+def bench(name: str, lines, number: int = 5):
+    legacy = legacy_parse(lines)
+    streaming = streaming_parse(lines)
+    if legacy != streaming:
+        raise AssertionError(f"{name}: 解析结果不一致 ({len(legacy)} vs {len(streaming)})")
+    # 录制的 listing 很小, 至少运行约 1000 行的量以免计时被噪声淹没
+    number = max(number, 1000 // max(1, len(lines)))
+    t_legacy = min(timeit.repeat(lambda: legacy_parse(lines), number=number, repeat=3)) / number
+    t_stream = min(timeit.repeat(lambda: streaming_parse(lines), number=number, repeat=3)) / number
+    print(f"{name}: {len(lines)} 行, {len(streaming)} 个状态, "
+          f"legacy {t_legacy * 1000:.3f} ms, streaming {t_stream * 1000:.3f} ms, "
+          f"x{t_legacy / t_stream:.2f}")
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(description="VALRANGES 解析的微基准")
+    parser.add_argument("paths", nargs="*", help="microcode 文本, 默认使用 benchmarks/valranges 中的 listing 和生成的文本")
+    parser.add_argument("--update", action="store_true", help="重写录制的 listing 旁边的 *.expected.json")
+    args = parser.parse_args(argv)
+
+    ok = True
+    for path in args.paths or fixture_paths():
+        lines = load_microcode(path)
+        ok = check_expected(path, lines, args.update, required=not args.paths) and ok
+        bench(os.path.basename(path), lines)
+    if not args.paths:
+        for nb_blocks in (100, 1000, 10000):
+            bench(f"synthetic_{nb_blocks}", synth_microcode(nb_blocks))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
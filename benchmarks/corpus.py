@@ -0,0 +1,223 @@
+"""
+反混淆的回归和性能语料, 不需要 IDA
+
+语料目录中的每个 *.model.json.gz 是一个函数在反混淆之前的 microcode 模型, 由快照功能保存
+(config.enable_microcode_snapshot 和 microcode_snapshot_model 都为 True 时, unflat/log/snapshots 下的
+*_before.model.json.gz), 旁边的 *.golden.json 是期望的结果。自带的几个条目由 flatgen 生成。
+
+对每个函数在模型上按 golden 中记录的级别运行 Unflattener.deflat, 记录:
+    blocks        反混淆后从入口可达的块数(伪代码大小的近似)
+    edges_removed 可达的边减少的数量
+    blacklisted   级别1跳过、也没有被状态转移摘要处理的多重赋值块数
+    time          deflat 耗时, 多次运行取最小值
+并把反混淆后的 CFG 与 golden 比较。CFG 不一致、blocks 或 blacklisted 增加、edges_removed 减少超过阈值时返回非 0。
+
+golden 只检查结构上的结果。耗时与机器有关, 只在指定 --check-time 时检查: 先在同一个进程中对 flatgen 生成的
+固定 CFG 运行 deflat 作为基准, 比较每个函数的耗时与基准耗时的比值(golden 的 timing.ratio), 比值增加超过阈值时返回非 0。
+
+用法:
+    python benchmarks/corpus.py [--corpus DIR] [--level N] [--update] [--check-time] [--allow-cfg-change] [名字...]
+
+不指定 --level 时使用每个条目 golden 中的级别, 没有 golden 时为自动选择; --update --level 1 名字 可以把
+指定的条目改为按级别1检查。
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from typing import List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flatgen import FlatConfig, generate_dict  # noqa: E402
+from unflat.mcmodel import mba_from_dict  # noqa: E402
+from unflat.my_microcode_log import MODEL_EXTENSION, read_model_file  # noqa: E402
+from unflat.unflattener import AUTO_LEVEL, Unflattener, _reachable  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+GOLDEN_EXTENSION = ".golden.json"
+GOLDEN_VERSION = 1
+
+BLOCK_THRESHOLD = 0.0  # blocks 允许增加的比例
+EDGE_THRESHOLD = 0.0  # edges_removed 允许减少的比例
+TIME_THRESHOLD = 1.0  # 耗时与基准的比值允许增加的比例
+TIME_SLACK = 0.005  # 秒, 换算成这次的耗时后小于这个差值的变化视为噪声
+# 计时基准: 每次运行时在同一个进程中对这个 CFG 运行 deflat
+CALIBRATION_CONFIG = FlatConfig(nb_blocks=1000, seed=0)
+
+
+def _succs(mba) -> List[List[int]]:
+    return [[x for x in mba.get_mblock(i).succset] for i in range(mba.qty)]
+
+
+def _reachable_edges(succs: List[List[int]], reachable: List[bool]) -> int:
+    return sum(len(succs[i]) for i in range(len(succs)) if reachable[i])
+
+
+def replay(data: dict, level: int, repeat: int) -> Tuple[dict, list]:
+    """
+    在模型上运行 deflat
+
+    Returns:
+        (指标, 反混淆后的 CFG: [[块类型, 后继...], ...])
+    """
+    best = None
+    for _ in range(max(1, repeat)):
+        mba = mba_from_dict(data)
+        succs = _succs(mba)
+        reachable = _reachable(succs)
+        blocks_before = sum(reachable)
+        edges_before = _reachable_edges(succs, reachable)
+        unflat = Unflattener(mba)
+        start = time.perf_counter()
+        unflat.deflat(level)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, mba, unflat, blocks_before, edges_before)
+    elapsed, mba, unflat, blocks_before, edges_before = best
+    succs = _succs(mba)
+    reachable = _reachable(succs)
+    metrics = {
+        "blocks_before": blocks_before,
+        "blocks": sum(reachable),
+        "edges_removed": edges_before - _reachable_edges(succs, reachable),
+        "patches": unflat.nb_patch,
+        "blacklisted": unflat.nb_blacklisted,
+        "level": unflat.level,
+        "time": round(elapsed, 6),
+    }
+    cfg = [[mba.get_mblock(i).type] + succs[i] for i in range(mba.qty)]
+    return metrics, cfg
+
+
+def calibrate(repeat: int) -> float:
+    """
+    Returns:
+        基准 CFG 上 deflat(自动选择级别) 的耗时, 秒
+    """
+    metrics, _ = replay(generate_dict(CALIBRATION_CONFIG), AUTO_LEVEL, repeat)
+    return metrics["time"]
+
+
+def time_ratio(metrics: dict, baseline: float) -> float:
+    return round(metrics["time"] / baseline, 4) if baseline > 0 else 0.0
+
+
+def compare(metrics: dict, cfg: list, golden: dict, args, baseline: Optional[float] = None) -> List[str]:
+    """
+    Args:
+        baseline: 这次运行的计时基准, 为None时不检查耗时
+
+    Returns:
+        回归的描述, 没有回归时为空
+    """
+    problems = []
+    expected = golden["metrics"]
+    if cfg != golden["cfg"] and not args.allow_cfg_change:
+        problems.append("CFG 与 golden 不一致")
+    if metrics["blocks"] > expected["blocks"] * (1 + args.block_threshold):
+        problems.append("blocks {0} -> {1}".format(expected["blocks"], metrics["blocks"]))
+    if metrics["blacklisted"] > expected.get("blacklisted", metrics["blacklisted"]):
+        problems.append("blacklisted {0} -> {1}".format(expected["blacklisted"], metrics["blacklisted"]))
+    if metrics["edges_removed"] < expected["edges_removed"] * (1 - args.edge_threshold):
+        problems.append("edges_removed {0} -> {1}".format(expected["edges_removed"], metrics["edges_removed"]))
+    expected_ratio = (golden.get("timing") or {}).get("ratio")
+    if baseline is not None and expected_ratio:
+        ratio = time_ratio(metrics, baseline)
+        if (ratio > expected_ratio * (1 + args.time_threshold)
+                and metrics["time"] - expected_ratio * baseline > TIME_SLACK):
+            problems.append("time/baseline {0:.3f} -> {1:.3f}".format(expected_ratio, ratio))
+    return problems
+
+
+def load_golden(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        golden = json.load(f)
+    return golden if golden.get("version") == GOLDEN_VERSION else None
+
+
+def write_golden(path: str, level: int, metrics: dict, cfg: list, ratio: float):
+    """
+    metrics 中只保存结构上的结果, 耗时以与计时基准的比值保存在 timing 中
+    """
+    structural = {name: value for name, value in metrics.items() if name != "time"}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": GOLDEN_VERSION, "level": level, "metrics": structural, "timing": {"ratio": ratio},
+                   "cfg": cfg}, f, separators=(",", ":"))
+        f.write("\n")
+
+
+def run(args) -> int:
+    paths = sorted(glob.glob(os.path.join(args.corpus, "*" + MODEL_EXTENSION)))
+    if args.names:
+        paths = [path for path in paths if os.path.basename(path)[:-len(MODEL_EXTENSION)] in args.names]
+    if not paths:
+        print(f"[-] {args.corpus} 中没有 *{MODEL_EXTENSION}")
+        return 2
+    nb_failed = 0
+    baseline = calibrate(args.repeat) if args.update or args.check_time else None
+    if baseline is not None:
+        print(f"[+] 计时基准 {baseline * 1000:.2f}ms")
+    print(f"{'function':<32}{'level':>6}{'blocks':>14}{'edges':>8}{'black':>7}{'time':>12}  status")
+    for path in paths:
+        name = os.path.basename(path)[:-len(MODEL_EXTENSION)]
+        golden_path = path[:-len(MODEL_EXTENSION)] + GOLDEN_EXTENSION
+        golden = load_golden(golden_path)
+        level = args.level
+        if level is None:
+            level = golden["level"] if golden is not None else AUTO_LEVEL
+        metrics, cfg = replay(read_model_file(path), level, args.repeat)
+        if args.update:
+            write_golden(golden_path, level, metrics, cfg, time_ratio(metrics, baseline))
+            status = "已更新"
+        elif golden is None:
+            status = "FAIL: 没有 golden, 使用 --update 生成"
+            nb_failed += 1
+        elif golden["level"] != level:
+            status = "FAIL: golden 的级别为 {0}".format(golden["level"])
+            nb_failed += 1
+        else:
+            problems = compare(metrics, cfg, golden, args, baseline)
+            status = "ok" if not problems else "FAIL: " + "; ".join(problems)
+            nb_failed += bool(problems)
+        print(f"{name:<32}{level:>6}{metrics['blocks_before']:>8} -> {metrics['blocks']:<5}{metrics['edges_removed']:>8}"
+              f"{metrics['blacklisted']:>7}{metrics['time'] * 1000:>10.2f}ms  {status}")
+    if nb_failed:
+        print(f"[-] {nb_failed}/{len(paths)} 个函数回归")
+        return 1
+    print(f"[+] {len(paths)} 个函数通过")
+    return 0
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="反混淆的回归和性能语料")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="语料目录")
+    parser.add_argument("names", nargs="*", help="只处理这些条目(不带扩展名), 默认全部")
+    parser.add_argument("--level", type=int, default=None, choices=[0, 1, 2, 3, 4],
+                        help="deflat 级别, 0 表示自动选择, 默认使用 golden 中的级别")
+    parser.add_argument("--repeat", type=int, default=3, help="每个函数运行的次数, 耗时取最小值")
+    parser.add_argument("--update", action="store_true", help="用这次的结果重写 golden")
+    parser.add_argument("--allow-cfg-change", action="store_true", help="CFG 变化时只检查指标")
+    parser.add_argument("--check-time", action="store_true", help="同时检查耗时与计时基准的比值")
+    parser.add_argument("--block-threshold", type=float, default=BLOCK_THRESHOLD)
+    parser.add_argument("--edge-threshold", type=float, default=EDGE_THRESHOLD)
+    parser.add_argument("--time-threshold", type=float, default=TIME_THRESHOLD)
+    parser.add_argument("--log", action="store_true", help="保留 INFO 日志")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if not args.log:
+        logging.disable(logging.INFO)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
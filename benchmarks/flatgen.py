@@ -0,0 +1,273 @@
+"""
+生成 OLLVM 风格的平坦化 CFG(mcmodel), 用于基准测试
+
+布局(每一层分发器):
+    分发块   jz carrier, #s_1, @case_1    所有 case 块都跳回这里, 入度最高
+    比较块   jz carrier, #s_i, @case_i    依次比较其余状态值
+    默认块   goto @分发块
+    case 块  若干填充指令; mov #s_next, carrier; goto @分发块
+    条件 case 块(cond_ratio)
+             setz scratch, #k, bool; carrier = xdu(bool) * (s_a - s_b) + s_b; goto @分发块
+    csel case 块(csel_ratio, OLLVM 的 select 经过 cmov/csel 之后的形式, 块中有两次状态赋值)
+             mov #s_a, tmp; mov #s_b, carrier; setz scratch, #k, bool;
+             carrier = xdu(bool) * (tmp - carrier) + carrier; goto @分发块
+
+case 块的 VALRANGES 为 carrier.4:==s_i(与 IDA 一样带大小后缀)。嵌套分发器由外层的一个 case 块进入,
+内层的最后一个 case 把外层状态写回外层 carrier 后跳回外层分发块。
+"""
+import os
+import random
+import sys
+from dataclasses import dataclass
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unflat import mcmodel as mc  # noqa: E402
+
+ENTRY_EA = 0x401000
+REG_NAMES = ["eax", "ecx", "edx", "ebx", "esi", "edi", "r8d", "r9d", "r10d", "r11d", "r12d", "r13d"]
+SCRATCH_REG = 0x60
+COND_REG = 0x64
+CSEL_REG = 0x68
+
+
+@dataclass
+class FlatConfig:
+    nb_blocks: int = 1000           # 大致的块数量
+    nb_dispatchers: int = 1         # 分发器层数, 大于1时生成嵌套分发器
+    nb_state_vars: int = 1          # 接收高熵常量的变量数, 超过分发器层数的部分是干扰变量
+    carrier: str = "stack"          # "stack" 或 "reg"
+    double_ratio: float = 0.0       # 含两次状态赋值的 case 块比例
+    cond_ratio: float = 0.0         # 由 setcc 选择下一个状态的 case 块比例
+    csel_ratio: float = 0.0         # 先把两个状态值分别赋给临时寄存器和 carrier, 再由 setcc 选择的 case 块比例
+    filler: int = 4                 # 每个 case 块的填充指令数
+    seed: int = 0
+
+
+class _Builder:
+    def __init__(self, cfg: FlatConfig):
+        self.cfg = cfg
+        self.rnd = random.Random(cfg.seed)
+        self.mba = mc.mba_t(ENTRY_EA, mc.MMAT_GLBOPT1)
+        self.used_states = set()
+        self.state_vars = [self._make_var(i) for i in range(max(cfg.nb_state_vars, cfg.nb_dispatchers))]
+
+    def _make_var(self, index: int):
+        if self.cfg.carrier == "reg":
+            reg = 8 * (index + 1)
+            mc.MREG_NAMES[(reg, 4)] = REG_NAMES[index % len(REG_NAMES)] + ("" if index < len(REG_NAMES) else str(index))
+            return ("r", reg, mc.MREG_NAMES[(reg, 4)])
+        off = 0x1C + 4 * index
+        return ("S", off, "%0x{:X}".format(off))
+
+    def var_op(self, var) -> mc.mop_t:
+        op = mc.mop_t()
+        if var[0] == "r":
+            op.make_reg(var[1], 4)
+        else:
+            op.make_stkvar(var[1], 4)
+        return op
+
+    @staticmethod
+    def num_op(value: int) -> mc.mop_t:
+        op = mc.mop_t()
+        op.make_number(value, 4)
+        return op
+
+    @staticmethod
+    def blk_op(serial: int) -> mc.mop_t:
+        op = mc.mop_t()
+        op.make_blkref(serial)
+        return op
+
+    def new_state(self) -> int:
+        while True:
+            value = self.rnd.getrandbits(32) | 0x01010101
+            if value not in self.used_states:
+                self.used_states.add(value)
+                return value
+
+    def block(self, blt: int = mc.BLT_1WAY) -> mc.mblock_t:
+        mblock = self.mba.add_block()
+        mblock.start = ENTRY_EA + mblock.serial * 0x10
+        mblock.end = mblock.start + 0x10
+        mblock.type = blt
+        return mblock
+
+    def insn(self, mblock: mc.mblock_t, opcode: int, l=None, r=None, d=None):
+        minsn = mc.minsn_t(mblock.start + 4 * sum(1 for _ in mblock.insns()))
+        minsn.opcode = opcode
+        if l is not None:
+            minsn.l = l
+        if r is not None:
+            minsn.r = r
+        if d is not None:
+            minsn.d = d
+        mblock.append(minsn)
+
+    def fill(self, mblock: mc.mblock_t):
+        scratch = mc.mop_t()
+        scratch.make_reg(SCRATCH_REG, 4)
+        for _ in range(self.cfg.filler):
+            dst = mc.mop_t()
+            dst.make_reg(SCRATCH_REG, 4)
+            self.insn(mblock, mc.m_add, scratch, self.num_op(self.rnd.randint(1, 0xff)), dst)
+        decoys = self.state_vars[self.cfg.nb_dispatchers:]
+        if decoys and self.rnd.random() < 0.5:
+            self.insn(mblock, mc.m_mov, self.num_op(self.rnd.getrandbits(32) | 0x01010101), None,
+                      self.var_op(self.rnd.choice(decoys)))
+
+    def assign(self, mblock: mc.mblock_t, var, value: int):
+        self.insn(mblock, mc.m_mov, self.num_op(value), None, self.var_op(var))
+
+    def select(self, mblock: mc.mblock_t, var, true_value: int, false_value: int):
+        """
+        var = (scratch == k) ? true_value : false_value, 用嵌套的 mul/add 计算
+        """
+        scratch = mc.mop_t()
+        scratch.make_reg(SCRATCH_REG, 4)
+        cond = mc.mop_t()
+        cond.make_reg(COND_REG, 1)
+        self.insn(mblock, mc.m_setz, scratch, self.num_op(self.rnd.randint(1, 0xff)), cond)
+        ext = mc.minsn_t(mblock.start)
+        ext.opcode = mc.m_xdu
+        ext.l = mc.mop_t(cond)
+        ext.d.size = 4
+        mul = mc.minsn_t(mblock.start)
+        mul.opcode = mc.m_mul
+        mul.l.make_insn(ext, 4)
+        mul.r = self.num_op((true_value - false_value) & 0xFFFFFFFF)
+        mul.d.size = 4
+        value = mc.mop_t()
+        value.make_insn(mul, 4)
+        self.insn(mblock, mc.m_add, value, self.num_op(false_value), self.var_op(var))
+
+    def csel(self, mblock: mc.mblock_t, var, true_value: int, false_value: int):
+        """
+        tmp = true_value; var = false_value; var = (scratch == k) ? tmp : var
+        """
+        tmp = mc.mop_t()
+        tmp.make_reg(CSEL_REG, 4)
+        self.insn(mblock, mc.m_mov, self.num_op(true_value), None, mc.mop_t(tmp))
+        self.assign(mblock, var, false_value)
+        scratch = mc.mop_t()
+        scratch.make_reg(SCRATCH_REG, 4)
+        cond = mc.mop_t()
+        cond.make_reg(COND_REG, 1)
+        self.insn(mblock, mc.m_setz, scratch, self.num_op(self.rnd.randint(1, 0xff)), cond)
+        ext = mc.minsn_t(mblock.start)
+        ext.opcode = mc.m_xdu
+        ext.l = mc.mop_t(cond)
+        ext.d.size = 4
+        diff = mc.minsn_t(mblock.start)
+        diff.opcode = mc.m_sub
+        diff.l = mc.mop_t(tmp)
+        diff.r = self.var_op(var)
+        diff.d.size = 4
+        mul = mc.minsn_t(mblock.start)
+        mul.opcode = mc.m_mul
+        mul.l.make_insn(ext, 4)
+        mul.r.make_insn(diff, 4)
+        mul.d.size = 4
+        value = mc.mop_t()
+        value.make_insn(mul, 4)
+        self.insn(mblock, mc.m_add, value, self.var_op(var), self.var_op(var))
+
+    def goto(self, mblock: mc.mblock_t, target: int):
+        self.insn(mblock, mc.m_goto, self.blk_op(target))
+
+
+def _edge(mba: mc.mba_t, src: int, dst: int):
+    mba.get_mblock(src).succset.push_back(dst)
+    mba.get_mblock(dst).predset.push_back(src)
+
+
+def generate(cfg: FlatConfig) -> mc.mba_t:
+    """
+    按配置生成平坦化的 mba
+
+    Returns:
+        可以直接交给 Unflattener 的 mcmodel.mba_t
+    """
+    b = _Builder(cfg)
+    mba = b.mba
+    nb_disp = max(1, cfg.nb_dispatchers)
+    # 每层分发器的 case 数: 每个 case 约占 2 个块(比较块 + case 块)
+    cases_per_disp = max(3, (cfg.nb_blocks - 4) // (2 * nb_disp))
+
+    entry = b.block(mc.BLT_1WAY)
+    prologue = b.block(mc.BLT_1WAY)
+    _edge(mba, entry.serial, prologue.serial)
+
+    layers = []
+    for layer in range(nb_disp):
+        var = b.state_vars[layer]
+        states = [b.new_state() for _ in range(cases_per_disp)]
+        cmp_blocks = [b.block(mc.BLT_2WAY) for _ in range(cases_per_disp)]
+        default = b.block(mc.BLT_1WAY)
+        case_blocks = [b.block(mc.BLT_1WAY) for _ in range(cases_per_disp)]
+        for i, cmp_block in enumerate(cmp_blocks):
+            b.insn(cmp_block, mc.m_jz, b.var_op(var), b.num_op(states[i]), b.blk_op(case_blocks[i].serial))
+            _edge(mba, cmp_block.serial, cmp_block.serial + 1)
+            _edge(mba, cmp_block.serial, case_blocks[i].serial)
+        b.goto(default, cmp_blocks[0].serial)
+        _edge(mba, default.serial, cmp_blocks[0].serial)
+        for i, case_block in enumerate(case_blocks):
+            case_block.valranges.append(("{0}.4".format(var[2]), states[i]))
+        layers.append((var, states, cmp_blocks, case_blocks))
+
+    exit_block = b.block(mc.BLT_1WAY)
+    stop = b.block(mc.BLT_STOP)
+    _edge(mba, exit_block.serial, stop.serial)
+
+    # 每一层按随机顺序串起所有 case; 第 L 层由第 L-1 层顺序中的第 2 个 case 进入,
+    # 结束后回到第 L-1 层顺序中的第 3 个 case; 最外层的最后一个 case 跳到出口
+    orders = []
+    for _ in range(nb_disp):
+        order = list(range(cases_per_disp))
+        b.rnd.shuffle(order)
+        orders.append(order)
+
+    outer_var, outer_states, outer_cmp, _ = layers[0]
+    b.assign(prologue, outer_var, outer_states[orders[0][0]])
+    b.goto(prologue, outer_cmp[0].serial)
+    _edge(mba, prologue.serial, outer_cmp[0].serial)
+
+    for layer, (var, states, cmp_blocks, case_blocks) in enumerate(layers):
+        order = orders[layer]
+        for pos, case_index in enumerate(order):
+            case_block = case_blocks[case_index]
+            b.fill(case_block)
+            if pos == 1 and layer + 1 < nb_disp:
+                inner_var, inner_states, inner_cmp, _ = layers[layer + 1]
+                b.assign(case_block, inner_var, inner_states[orders[layer + 1][0]])
+                target = inner_cmp[0].serial
+            elif pos + 1 < len(order):
+                if cfg.cond_ratio and b.rnd.random() < cfg.cond_ratio:
+                    # 条件为假时走正常顺序, 为真时回到之前的某个 case
+                    b.select(case_block, var, states[order[b.rnd.randrange(pos + 1)]], states[order[pos + 1]])
+                elif cfg.csel_ratio and b.rnd.random() < cfg.csel_ratio:
+                    b.csel(case_block, var, states[order[b.rnd.randrange(pos + 1)]], states[order[pos + 1]])
+                else:
+                    if b.rnd.random() < cfg.double_ratio:
+                        b.assign(case_block, var, b.rnd.choice(states))
+                    b.assign(case_block, var, states[order[pos + 1]])
+                target = cmp_blocks[0].serial
+            elif layer == 0:
+                target = exit_block.serial
+            else:
+                parent_var, parent_states, parent_cmp, _ = layers[layer - 1]
+                b.assign(case_block, parent_var, parent_states[orders[layer - 1][2]])
+                target = parent_cmp[0].serial
+            b.goto(case_block, target)
+            _edge(mba, case_block.serial, target)
+    return mba
+
+
+def generate_dict(cfg: FlatConfig) -> dict:
+    return mc.mba_to_dict(generate(cfg))
+
+
+def configs_for_sizes(sizes: List[int], **kwargs) -> List[FlatConfig]:
+    return [FlatConfig(nb_blocks=size, **kwargs) for size in sizes]
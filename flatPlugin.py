@@ -1,34 +1,247 @@
+import sys
+
 import idaapi
 import ida_kernwin
 import ida_hexrays
-import unflat.config as config
 
 UNOLLVM_ACTION_NAME = "unflat:toggle_ollvm"
 UNBCF_ACTION_NAME = "unflat:toggle_bcf"
+CLEAR_CACHE_ACTION_NAME = "unflat:clear_cache"
+CLEAR_ALL_CACHE_ACTION_NAME = "unflat:clear_all_cache"
+SET_LEVEL_ACTION_NAME = "unflat:set_level"
+SET_DISPATCHER_ACTION_NAME = "unflat:set_dispatcher"
+SET_CARRIER_ACTION_NAME = "unflat:set_carrier"
+RESET_FUNC_CONFIG_ACTION_NAME = "unflat:reset_func_config"
+RELOAD_ACTION_NAME = "unflat:reload"
+SHOW_METRICS_ACTION_NAME = "unflat:show_metrics"
+LOAD_METRICS_REPORT_ACTION_NAME = "unflat:load_metrics_report"
+EXPORT_METRICS_ACTION_NAME = "unflat:export_metrics_csv"
+
+METRICS_WINDOW_TITLE = "反混淆统计"
+
+POPUP_ACTION_NAMES = [
+    UNOLLVM_ACTION_NAME,
+    UNBCF_ACTION_NAME,
+    SET_LEVEL_ACTION_NAME,
+    SET_DISPATCHER_ACTION_NAME,
+    SET_CARRIER_ACTION_NAME,
+    RESET_FUNC_CONFIG_ACTION_NAME,
+    CLEAR_CACHE_ACTION_NAME,
+    CLEAR_ALL_CACHE_ACTION_NAME,
+    SHOW_METRICS_ACTION_NAME,
+]
+
+# 统计窗口的右键菜单
+METRICS_POPUP_ACTION_NAMES = [
+    EXPORT_METRICS_ACTION_NAME,
+    LOAD_METRICS_REPORT_ACTION_NAME,
+]
+
+def get_current_func_ea():
+    """
+    获取当前窗口所在函数的入口地址, 找不到时返回None
+    """
+    import ida_funcs
+    vdui = ida_hexrays.get_widget_vdui(ida_kernwin.get_current_widget())
+    if vdui and vdui.cfunc:
+        return vdui.cfunc.entry_ea
+    func = ida_funcs.get_func(ida_kernwin.get_screen_ea())
+    return func.start_ea if func else None
+
+def loaded_unflattener():
+    """
+    已经导入的 unflat.new_unflattener, 还没有反编译过任何函数时为None
+    """
+    return sys.modules.get("unflat.new_unflattener")
+
+class LazyDecompileHook(ida_hexrays.Hexrays_Hooks):
+    """
+    启用反混淆时只安装这个轻量的钩子, 第一次反编译时才导入 unflat 的模块并取得共用的钩子
+
+    共用的钩子被直接安装时(例如批量处理)不再转发, 避免同一个函数被处理两次
+    """
+
+    def __init__(self):
+        ida_hexrays.Hexrays_Hooks.__init__(self)
+        self.target = None
+        self.active = False
+
+    def _load(self):
+        if self.target is None:
+            import unflat.new_unflattener as new_unflattener
+            self.target = new_unflattener.get_hook()
+        return self.target
+
+    def microcode(self, mba):
+        target = self._load()
+        if target.installed:
+            return ida_hexrays.MERR_OK
+        return target.microcode(mba)
+
+    def glbopt(self, mba):
+        target = self._load()
+        if target.installed:
+            return ida_hexrays.MERR_OK
+        return target.glbopt(mba)
+
+def unload_unflat_modules() -> int:
+    """
+    卸载反混淆的所有模块(unflat.config 除外, 保留运行时修改的全局设置), 下一次反编译时重新导入
+
+    Returns:
+        卸载的模块数
+    """
+    new_unflattener = loaded_unflattener()
+    if new_unflattener is not None:
+        new_unflattener.unload()
+    names = [name for name in sys.modules if name.startswith("unflat.") and name != "unflat.config"]
+    for name in names:
+        del sys.modules[name]
+    return len(names)
+
+def redecompile_function(func_ea):
+    """
+    只让指定函数的反编译结果失效, 当前窗口正在显示该函数时重新反编译
+    """
+    ida_hexrays.mark_cfunc_dirty(func_ea)
+    vdui = ida_hexrays.get_widget_vdui(ida_kernwin.get_current_widget())
+    if vdui and vdui.cfunc and vdui.cfunc.entry_ea == func_ea:
+        vdui.refresh_view(True)
+
+def is_dev_reload_enabled() -> bool:
+    import unflat.config as config
+    return getattr(config, "enable_dev_reload", False)
+
+def is_enabled_on_startup() -> bool:
+    import unflat.config as config
+    return getattr(config, "enable_on_startup", False)
 
 class PopupHook(ida_kernwin.UI_Hooks):
     def finish_populating_widget_popup(self, widget, popup):
+        if (idaapi.get_widget_type(widget) == idaapi.BWN_CHOOSER
+                and ida_kernwin.get_widget_title(widget).startswith(METRICS_WINDOW_TITLE)):
+            for action_name in METRICS_POPUP_ACTION_NAMES:
+                ida_kernwin.attach_action_to_popup(widget, popup, action_name, None)
+            return
         if idaapi.get_widget_type(widget) == idaapi.BWN_PSEUDOCODE or idaapi.get_widget_type(widget) == idaapi.BWN_DISASM:
-            ida_kernwin.attach_action_to_popup(
-                widget,
-                popup,
-                UNOLLVM_ACTION_NAME,
-                None
-            )
-            ida_kernwin.attach_action_to_popup(
-                widget,
-                popup,
-                UNBCF_ACTION_NAME,
-                None
-            )
+            action_names = POPUP_ACTION_NAMES + ([RELOAD_ACTION_NAME] if is_dev_reload_enabled() else [])
+            for action_name in action_names:
+                ida_kernwin.attach_action_to_popup(
+                    widget,
+                    popup,
+                    action_name,
+                    None
+                )
 
-class ToggleOllvmHandler(idaapi.action_handler_t):
+class FuncConfigHandler(idaapi.action_handler_t):
+    """
+    修改当前函数的设置, 只重新反编译当前函数
+    """
 
     def activate(self, ctx):
-        config.enable_ollvm_unflatten = not config.enable_ollvm_unflatten
+        from unflat.func_config import func_config
+        func_ea = get_current_func_ea()
+        if func_ea is None:
+            print("[-] 当前位置不在函数中")
+            return 1
+        if self.edit(func_config, func_ea):
+            redecompile_function(func_ea)
+        return 1
+
+    def edit(self, func_config, func_ea) -> bool:
+        """
+        Returns:
+            设置是否发生了变化
+        """
+        raise NotImplementedError
+
+    def update(self, ctx):
+        return idaapi.AST_ENABLE_ALWAYS
+
+class ToggleOllvmHandler(FuncConfigHandler):
+    def edit(self, func_config, func_ea):
+        enabled = not func_config.resolve(func_ea)["enable_ollvm_unflatten"]
+        func_config.set(func_ea, "enable_ollvm_unflatten", enabled)
+        state = "开启" if enabled else "关闭"
+        print(f"[+] 函数 0x{func_ea:x} 的 OLLVM 反混淆已{state}")
+        return True
+
+class ToggleBCFHandler(FuncConfigHandler):
+    def edit(self, func_config, func_ea):
+        enabled = not func_config.resolve(func_ea)["enable_remove_dead_code"]
+        func_config.set(func_ea, "enable_remove_dead_code", enabled)
+        state = "开启" if enabled else "关闭"
+        print(f"[+] 函数 0x{func_ea:x} 的死代码消除已{state}")
+        return True
+
+class SetLevelHandler(FuncConfigHandler):
+    def edit(self, func_config, func_ea):
+        level = ida_kernwin.ask_long(func_config.resolve(func_ea)["deflat_level"],
+                                     "deflat 级别(0 自动选择, 1~4)")
+        if level is None:
+            return False
+        if level not in (0, 1, 2, 3, 4):
+            print("[-] deflat 级别只能是 0~4")
+            return False
+        func_config.set(func_ea, "deflat_level", level)
+        print(f"[+] 函数 0x{func_ea:x} 的 deflat 级别设置为 {level}")
+        return True
 
-        state = "开启" if config.enable_ollvm_unflatten else "关闭"
-        print(f"[+] OLLVM 反混淆已{state}")
+class SetDispatcherHandler(FuncConfigHandler):
+    def edit(self, func_config, func_ea):
+        dispatcher_id = ida_kernwin.ask_long(func_config.resolve(func_ea)["dispatcher_id"],
+                                             "分发块序号(0 自动查找)")
+        if dispatcher_id is None:
+            return False
+        if dispatcher_id == 0:
+            func_config.unset(func_ea, "dispatcher_id")
+        else:
+            func_config.set(func_ea, "dispatcher_id", dispatcher_id)
+        print(f"[+] 函数 0x{func_ea:x} 的分发块序号设置为 {dispatcher_id}")
+        return True
+
+class SetCarrierHandler(FuncConfigHandler):
+    def edit(self, func_config, func_ea):
+        carrier = ida_kernwin.ask_str(func_config.resolve(func_ea)["storage_carrier"] or "", 0,
+                                      "状态变量(寄存器名或 %0x栈偏移, 可以带 .大小 后缀, 留空自动查找)")
+        if carrier is None:
+            return False
+        carrier = carrier.strip()
+        if carrier:
+            func_config.set(func_ea, "storage_carrier", carrier)
+        else:
+            func_config.unset(func_ea, "storage_carrier")
+        print(f"[+] 函数 0x{func_ea:x} 的状态变量设置为 {carrier or '自动'}")
+        return True
+
+class ResetFuncConfigHandler(FuncConfigHandler):
+    def edit(self, func_config, func_ea):
+        func_config.unset(func_ea)
+        print(f"[+] 函数 0x{func_ea:x} 已恢复默认设置")
+        return True
+
+class ClearCacheHandler(idaapi.action_handler_t):
+    def __init__(self, clear_all=False):
+        idaapi.action_handler_t.__init__(self)
+        self.clear_all = clear_all
+
+    def activate(self, ctx):
+        from unflat.deflat_cache import deflat_cache
+        from unflat.prefetch import prefetch_scheduler
+        if self.clear_all:
+            deflat_cache.invalidate()
+            prefetch_scheduler.forget()
+            print("[+] 已清除所有反混淆缓存")
+        else:
+            func_ea = get_current_func_ea()
+            if func_ea is None:
+                print("[-] 当前位置不在函数中")
+                return 1
+            deflat_cache.invalidate(func_ea)
+            prefetch_scheduler.forget(func_ea)
+            print(f"[+] 已清除函数 0x{func_ea:x} 的反混淆缓存")
+            redecompile_function(func_ea)
+            return 1
         vdui = ida_hexrays.get_widget_vdui(ida_kernwin.get_current_widget())
         if vdui:
             vdui.refresh_view(True)
@@ -37,12 +250,78 @@ class ToggleOllvmHandler(idaapi.action_handler_t):
     def update(self, ctx):
         return idaapi.AST_ENABLE_ALWAYS
 
-class ToggleBCFHandler(idaapi.action_handler_t):
+class ShowMetricsHandler(idaapi.action_handler_t):
+    """
+    打开当前会话中每个反混淆过的函数的统计窗口
+    """
+    def activate(self, ctx):
+        new_unflattener = loaded_unflattener()
+        hook = new_unflattener.hook_instance if new_unflattener is not None else None
+        if hook is None or not hook.func_results:
+            print("[-] 还没有反混淆过的函数")
+            return 1
+        import ida_funcs
+        from unflat.metrics import rows_from_results
+        from unflat.metrics_view import show_metrics
+        source = lambda: rows_from_results(hook.func_results, ida_funcs.get_func_name)
+        show_metrics(METRICS_WINDOW_TITLE, source(), source)
+        return 1
+
+    def update(self, ctx):
+        return idaapi.AST_ENABLE_ALWAYS
+
+class LoadMetricsReportHandler(idaapi.action_handler_t):
+    """
+    在统计窗口中查看 batch.py 输出的报告
+    """
+    def activate(self, ctx):
+        import json
+        import os
+        from unflat.metrics import rows_from_report
+        from unflat.metrics_view import show_metrics
+        path = ida_kernwin.ask_file(0, "*.json", "批量处理的报告")
+        if not path:
+            return 1
+        with open(path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+        rows = rows_from_report(report)
+        show_metrics(f"{METRICS_WINDOW_TITLE} - {os.path.basename(path)}", rows)
+        print(f"[+] 已加载 {len(rows)} 个函数的统计: {path}")
+        return 1
+
+    def update(self, ctx):
+        return idaapi.AST_ENABLE_ALWAYS
+
+class ExportMetricsHandler(idaapi.action_handler_t):
+    """
+    导出右键菜单所在的统计窗口
+    """
     def activate(self, ctx):
-        config.enable_remove_dead_code = not config.enable_remove_dead_code
+        from unflat.metrics_view import export_metrics, metrics_choosers
+        title = ida_kernwin.get_widget_title(ctx.widget) if ctx.widget else None
+        if title not in metrics_choosers:
+            print("[-] 请在统计窗口的右键菜单中导出")
+            return 1
+        path = ida_kernwin.ask_file(1, "*.csv", "导出统计")
+        if not path:
+            return 1
+        nb_rows = export_metrics(title, path)
+        print(f"[+] 已导出 {nb_rows} 个函数的统计: {path}")
+        return 1
+
+    def update(self, ctx):
+        return idaapi.AST_ENABLE_ALWAYS
 
-        state = "开启" if config.enable_remove_dead_code else "关闭"
-        print(f"[+] 死代码消除已{state}")
+class ReloadHandler(idaapi.action_handler_t):
+    """
+    开发用: 热重载反混淆模块
+    """
+    def __init__(self, plugin):
+        idaapi.action_handler_t.__init__(self)
+        self.plugin = plugin
+
+    def activate(self, ctx):
+        self.plugin.reload()
         vdui = ida_hexrays.get_widget_vdui(ida_kernwin.get_current_widget())
         if vdui:
             vdui.refresh_view(True)
@@ -53,63 +332,196 @@ class ToggleBCFHandler(idaapi.action_handler_t):
 
 class MicroPlugin(idaapi.plugin_t):
     flags = idaapi.PLUGIN_KEEP
-    comment = "Hot reload microcode plugin"
+    comment = "OLLVM unflatten microcode plugin"
     help = ""
     wanted_name = "OLLVM反混淆"
     wanted_hotkey = ""
 
     def init(self):
+        # 启动时只注册动作, 运行插件(或者打开 enable_on_startup)之后才安装钩子, 反混淆的模块在第一次反编译时才导入
+        self.decompile_hook = LazyDecompileHook()
         idaapi.register_action(
                 idaapi.action_desc_t(
                     UNOLLVM_ACTION_NAME,
-                    "启用/关闭 OLLVM 反混淆",
+                    "启用/关闭 当前函数的 OLLVM 反混淆",
                     ToggleOllvmHandler(),
                     None,
-                    "Toggle OLLVM unflatten",
+                    "Toggle OLLVM unflatten for current function",
                     0
                 )
             )
         idaapi.register_action(
                 idaapi.action_desc_t(
                     UNBCF_ACTION_NAME,
-                    "启用/关闭 死代码消除",
+                    "启用/关闭 当前函数的死代码消除",
                     ToggleBCFHandler(),
                     None,
-                    "Toggle BCF remove",
+                    "Toggle BCF remove for current function",
+                    0
+                )
+            )
+        idaapi.register_action(
+                idaapi.action_desc_t(
+                    SET_LEVEL_ACTION_NAME,
+                    "设置当前函数的 deflat 级别",
+                    SetLevelHandler(),
+                    None,
+                    "Set deflat level for current function",
+                    0
+                )
+            )
+        idaapi.register_action(
+                idaapi.action_desc_t(
+                    SET_DISPATCHER_ACTION_NAME,
+                    "设置当前函数的分发块序号",
+                    SetDispatcherHandler(),
+                    None,
+                    "Set dispatcher block for current function",
                     0
                 )
             )
+        idaapi.register_action(
+                idaapi.action_desc_t(
+                    SET_CARRIER_ACTION_NAME,
+                    "设置当前函数的状态变量",
+                    SetCarrierHandler(),
+                    None,
+                    "Set state variable for current function",
+                    0
+                )
+            )
+        idaapi.register_action(
+                idaapi.action_desc_t(
+                    RESET_FUNC_CONFIG_ACTION_NAME,
+                    "恢复当前函数的默认设置",
+                    ResetFuncConfigHandler(),
+                    None,
+                    "Reset settings of current function",
+                    0
+                )
+            )
+        idaapi.register_action(
+                idaapi.action_desc_t(
+                    CLEAR_CACHE_ACTION_NAME,
+                    "清除当前函数的反混淆缓存",
+                    ClearCacheHandler(),
+                    None,
+                    "Clear deflat cache of current function",
+                    0
+                )
+            )
+        idaapi.register_action(
+                idaapi.action_desc_t(
+                    CLEAR_ALL_CACHE_ACTION_NAME,
+                    "清除所有反混淆缓存",
+                    ClearCacheHandler(clear_all=True),
+                    None,
+                    "Clear all deflat cache",
+                    0
+                )
+            )
+        idaapi.register_action(
+                idaapi.action_desc_t(
+                    SHOW_METRICS_ACTION_NAME,
+                    "反混淆统计",
+                    ShowMetricsHandler(),
+                    None,
+                    "Show deflattening metrics of processed functions",
+                    0
+                )
+            )
+        idaapi.register_action(
+                idaapi.action_desc_t(
+                    LOAD_METRICS_REPORT_ACTION_NAME,
+                    "打开批量处理的报告",
+                    LoadMetricsReportHandler(),
+                    None,
+                    "Load deflattening metrics from a batch report",
+                    0
+                )
+            )
+        idaapi.register_action(
+                idaapi.action_desc_t(
+                    EXPORT_METRICS_ACTION_NAME,
+                    "导出为 CSV",
+                    ExportMetricsHandler(),
+                    None,
+                    "Export deflattening metrics to CSV",
+                    0
+                )
+            )
+        ida_kernwin.attach_action_to_menu("View/Open subviews/", SHOW_METRICS_ACTION_NAME, ida_kernwin.SETMENU_APP)
+        self.dev_reload = is_dev_reload_enabled()
+        if self.dev_reload:
+            idaapi.register_action(
+                    idaapi.action_desc_t(
+                        RELOAD_ACTION_NAME,
+                        "热重载反混淆模块(开发)",
+                        ReloadHandler(self),
+                        None,
+                        "Reload unflat modules",
+                        0
+                    )
+                )
         self.menu_handler = PopupHook()
         self.menu_handler.hook()
-        print("[+] Loader initialized")
+        if is_enabled_on_startup():
+            self.enable()
         return idaapi.PLUGIN_KEEP
 
-    def run(self, arg):
-        try:
-            import importlib
-
-            import unflat.cfgUtil as cfgUtil
-            importlib.reload(cfgUtil)
-            print("cfgUtil重载成功")
-               
-            import unflat.remove_dead_code as remove_dead_code
-            importlib.reload(remove_dead_code)
-            print("remove_dead_code重载成功")
-            
-            import unflat.new_unflattener as new_unflattener
-            importlib.reload(new_unflattener)
-            print("new_unflattener重载成功")
+    def enable(self) -> bool:
+        """
+        安装转发钩子, 之后的反编译都会经过反混淆
+
+        Returns:
+            是否已经启用
+        """
+        if self.decompile_hook.active:
+            return True
+        if not ida_hexrays.init_hexrays_plugin():
+            print("[-] 没有可用的反编译器, ollvm反混淆未启用")
+            return False
+        self.decompile_hook.active = self.decompile_hook.hook()
+        if self.decompile_hook.active:
+            print("[+] ollvm反混淆已启用, 将在第一次反编译时加载")
+        return self.decompile_hook.active
 
-            new_unflattener.main()
-        except Exception as e:
+    def reload(self):
+        """
+        开发用: 卸载所有模块, 下一次反编译时重新导入修改后的代码
+        """
+        try:
+            nb_modules = unload_unflat_modules()
+            self.decompile_hook.target = None
+            print(f"[+] 已卸载 {nb_modules} 个模块, 下次反编译时重新加载")
+        except Exception:
             import traceback
             traceback.print_exc()
 
+    def run(self, arg):
+        if not self.decompile_hook.active:
+            self.enable()
+            return
+        if self.dev_reload:
+            self.reload()
+            return
+        state = "已加载" if loaded_unflattener() is not None else "将在第一次反编译时加载"
+        print(f"[+] ollvm反混淆{state}")
+
     def term(self):
         if self.menu_handler:
             self.menu_handler.unhook()
-        idaapi.unregister_action(UNOLLVM_ACTION_NAME)
-        idaapi.unregister_action(UNBCF_ACTION_NAME)
+        if self.decompile_hook.active:
+            self.decompile_hook.unhook()
+            self.decompile_hook.active = False
+        ida_kernwin.detach_action_from_menu("View/Open subviews/", SHOW_METRICS_ACTION_NAME)
+        for action_name in POPUP_ACTION_NAMES + METRICS_POPUP_ACTION_NAMES:
+            idaapi.unregister_action(action_name)
+        if self.dev_reload:
+            idaapi.unregister_action(RELOAD_ACTION_NAME)
+        new_unflattener = loaded_unflattener()
+        if new_unflattener is not None:
+            new_unflattener.unload()
         print("[+] Plugin terminated")
 
 
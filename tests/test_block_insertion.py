@@ -0,0 +1,146 @@
+"""
+BlockInsertionPlan 在 mcmodel 上的块布局和边关系
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unflat import mcmodel as mc  # noqa: E402
+from unflat.cfgUtil import (CONDITIONAL_JUMP_LIST, BlockInsertionPlan, EdgeTransaction,  # noqa: E402
+                            change_jmp_target)
+
+COND_REG = 8
+
+
+def _goto(target: int) -> mc.minsn_t:
+    minsn = mc.minsn_t()
+    minsn.opcode = mc.m_goto
+    minsn.l.make_blkref(target)
+    return minsn
+
+
+def _jz(target: int) -> mc.minsn_t:
+    minsn = mc.minsn_t()
+    minsn.opcode = mc.m_jz
+    minsn.l.make_reg(COND_REG, 4)
+    minsn.r.make_number(1, 4)
+    minsn.d.make_blkref(target)
+    return minsn
+
+
+def _mov() -> mc.minsn_t:
+    minsn = mc.minsn_t()
+    minsn.opcode = mc.m_mov
+    minsn.l.make_number(1, 4)
+    minsn.d.make_reg(16, 4)
+    return minsn
+
+
+def _build(blocks) -> mc.mba_t:
+    """
+    blocks: 每个块的 (指令列表, 后继列表), 前驱由后继得到
+    """
+    mba = mc.mba_t(0x1000)
+    for insns, succs in blocks:
+        mblock = mba.add_block(0x1000 + mba.qty * 0x10, 0x1010 + mba.qty * 0x10)
+        for minsn in insns:
+            mblock.append(minsn)
+        mblock.succset.extend(succs)
+    for mblock in mba.blocks:
+        for succ in mblock.succset:
+            mba.get_mblock(succ).predset.append(mblock.serial)
+    return mba
+
+
+def _expected_succs(mba: mc.mba_t, mblock: mc.mblock_t) -> list:
+    tail = mblock.tail
+    if mblock.serial == mba.qty - 1:
+        return []
+    if tail is not None and tail.opcode == mc.m_goto:
+        return [tail.l.b]
+    if tail is not None and tail.opcode in CONDITIONAL_JUMP_LIST:
+        return sorted({mblock.serial + 1, tail.d.b})
+    return [mblock.serial + 1]
+
+
+def _check_cfg(mba: mc.mba_t):
+    """
+    后继集合与尾指令一致, 前驱集合与后继集合互为反向
+    """
+    for mblock in mba.blocks:
+        assert sorted(mblock.succset) == _expected_succs(mba, mblock), mblock.serial
+        for succ in mblock.succset:
+            assert mblock.serial in mba.get_mblock(succ).predset, (mblock.serial, succ)
+        for pred in mblock.predset:
+            assert mblock.serial in mba.get_mblock(pred).succset, (pred, mblock.serial)
+
+
+def _split(mba: mc.mba_t, mblock_id: int, true_id: int, false_id: int) -> BlockInsertionPlan:
+    """
+    与 Unflattener.apply_splits 相同: 插入 jcc 和 goto 两个块后把块跳到 jcc 块
+    """
+    plan = BlockInsertionPlan(mba)
+    cond = _jz(0)
+    jcc_block = plan.add_jcc_block(mblock_id, true_id, mc.m_jz, cond.l, cond.r)
+    plan.add_goto_block(mblock_id, false_id)
+    with EdgeTransaction(mba) as txn:
+        plan.commit(txn)
+        change_jmp_target(mba.get_mblock(plan.remap(mblock_id)), jcc_block.serial, txn)
+    return plan
+
+
+def test_fall_through_anchor_when_last_block_jcc_falls_into_stop():
+    # 块3是倒数第二个块, 以条件跳转结尾并落到出口块, 新块只能插在块1之后
+    mba = _build([
+        ([], [1]),
+        ([_mov()], [2]),
+        ([_mov(), _goto(3)], [3]),
+        ([_jz(2)], [2, 4]),
+        ([], []),
+    ])
+    plan = _split(mba, 1, 3, 2)
+    assert not plan._appended
+    assert mba.qty == 7
+    anchor = mba.get_mblock(1)
+    assert list(anchor.succset) == [2]
+    assert list(mba.get_mblock(2).predset) == [1]
+    assert mba.get_mblock(2).tail.d.b == 5
+    assert mba.get_mblock(3).tail.l.b == 4
+    _check_cfg(mba)
+
+
+def test_jcc_anchor_keeps_jump_to_next_block():
+    # 块1的条件跳转目标和顺序执行都是块2
+    mba = _build([
+        ([], [1]),
+        ([_jz(2)], [2]),
+        ([_mov(), _goto(3)], [3]),
+        ([_jz(2)], [2, 4]),
+        ([], []),
+    ])
+    plan = BlockInsertionPlan(mba)
+    plan.add_goto_block(1, 3)
+    with EdgeTransaction(mba) as txn:
+        plan.commit(txn)
+    assert sorted(mba.get_mblock(1).succset) == [2, 3]
+    _check_cfg(mba)
+
+
+def test_append_when_last_block_falls_into_stop():
+    # 块3没有跳转指令并落到出口块, 补一条goto之后新块放在出口块之前
+    mba = _build([
+        ([], [1]),
+        ([_mov()], [2]),
+        ([_mov(), _goto(3)], [3]),
+        ([_mov()], [4]),
+        ([], []),
+    ])
+    plan = _split(mba, 1, 3, 2)
+    assert plan._appended
+    assert mba.qty == 7
+    assert mba.get_mblock(3).tail.opcode == mc.m_goto
+    assert mba.get_mblock(3).tail.l.b == 6
+    assert list(mba.get_mblock(1).succset) == [4]
+    assert list(mba.get_mblock(4).predset) == [1]
+    _check_cfg(mba)
@@ -0,0 +1,249 @@
+"""
+无界面批量反混淆整个数据库, 输出 JSON 报告
+
+在 IDA 中作为脚本运行(单进程, 处理全部函数或其中一个分片):
+    idat -A -S"unflat/batch.py --out report.json" target.i64
+
+在普通 Python 中运行时作为调度器, 把数据库复制多份, 每份启动一个 idat 进程处理一个分片, 最后合并报告:
+    python unflat/batch.py target.i64 --out report.json --jobs 8 --idat /opt/ida/idat
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+try:
+    import idc
+    IN_IDA = True
+except ImportError:
+    IN_IDA = False
+
+REPORT_VERSION = 1
+
+
+def summarize(functions: List[dict]) -> dict:
+    summary = {"functions": len(functions), "ok": 0, "failed": 0, "error": 0,
+               "deflattened": 0, "patches": 0, "time": 0.0}
+    for func in functions:
+        summary[func["status"]] = summary.get(func["status"], 0) + 1
+        summary["patches"] += func.get("patches", 0)
+        summary["time"] += func.get("time", 0.0)
+        if func.get("patches", 0):
+            summary["deflattened"] += 1
+    summary["time"] = round(summary["time"], 6)
+    return summary
+
+
+def write_report(out_path: str, report: dict):
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, out_path)
+
+
+def run_worker(out_path: str, shard_index: int = 0, shard_count: int = 1, level: Optional[int] = None,
+               include_lib: bool = False) -> int:
+    """
+    在 IDA 中逐个反编译函数, 通过 HexraysDecompilationHook 反混淆并记录结果
+
+    Args:
+        out_path: 报告输出路径
+        shard_index: 当前分片序号
+        shard_count: 分片总数, 第 i 个函数分配给 i % shard_count 号分片
+        level: 所有函数使用的 deflat 级别, None 表示与插件相同, 使用每个函数的设置和 config.deflat_level
+        include_lib: 是否处理库函数和 thunk 函数
+    """
+    import ida_auto
+    import ida_funcs
+    import ida_hexrays
+    import ida_nalt
+    import idautils
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from unflat import new_unflattener
+    from unflat.logger_config import setup_logging
+
+    setup_logging()
+    ida_auto.auto_wait()
+    if not ida_hexrays.init_hexrays_plugin():
+        print("[-] 没有可用的反编译器")
+        return 2
+
+    # 使用插件共用的钩子, 直接安装期间插件的转发钩子不再转发, 同一个函数不会被处理两次
+    hook = new_unflattener.get_hook()
+    previous_level = hook.level
+    hook.level = level
+    was_installed = hook.installed
+    if not was_installed:
+        hook.hook()
+    functions = []
+    try:
+        for index, func_ea in enumerate(idautils.Functions()):
+            if index % shard_count != shard_index:
+                continue
+            func = ida_funcs.get_func(func_ea)
+            if not include_lib and func.flags & (ida_funcs.FUNC_LIB | ida_funcs.FUNC_THUNK):
+                continue
+            result = {"ea": func_ea, "name": ida_funcs.get_func_name(func_ea), "status": "ok",
+                      "patches": 0, "cached": False, "lines": 0, "time": 0.0}
+            hf = ida_hexrays.hexrays_failure_t()
+            start = time.perf_counter()
+            try:
+                cfunc = ida_hexrays.decompile(func_ea, hf, ida_hexrays.DECOMP_NO_WAIT | ida_hexrays.DECOMP_NO_CACHE)
+                if cfunc is None:
+                    result["status"] = "failed"
+                    result["error"] = hf.desc()
+                else:
+                    result["lines"] = len(cfunc.get_pseudocode())
+            except Exception as e:
+                result["status"] = "error"
+                result["error"] = repr(e)
+            result["time"] = round(time.perf_counter() - start, 6)
+            func_result = hook.func_results.pop(func_ea, None)
+            if func_result is not None:
+                result["dispatcher_id"] = func_result["dispatcher_id"]
+                result["level"] = func_result["level"]
+                result["patches"] = func_result["patches"]
+                result["blacklisted"] = func_result["blacklisted"]
+                result["replaced"] = func_result["replaced"]
+                result["cached"] = func_result["cached"]
+                result["deflat_time"] = round(func_result["time"], 6)
+                if func_result["stats"] is not None:
+                    result["stats"] = func_result["stats"]
+            functions.append(result)
+    finally:
+        if not was_installed:
+            hook.unhook()
+        hook.level = previous_level
+
+    write_report(out_path, {
+        "version": REPORT_VERSION,
+        "input": ida_nalt.get_input_file_path(),
+        "shard": shard_index,
+        "shards": shard_count,
+        "level": level,
+        "functions": functions,
+        "summary": summarize(functions),
+    })
+    print(f"[+] 已处理 {len(functions)} 个函数, 报告: {out_path}")
+    return 0
+
+
+def merge_reports(parts: List[Optional[dict]], input_path: str, level: Optional[int]) -> dict:
+    functions = []
+    missing = []
+    for shard_index, part in enumerate(parts):
+        if part is None:
+            missing.append(shard_index)
+            continue
+        functions.extend(part["functions"])
+    functions.sort(key=lambda func: func["ea"])
+    return {
+        "version": REPORT_VERSION,
+        "input": input_path,
+        "shards": len(parts),
+        "missing_shards": missing,
+        "level": level,
+        "functions": functions,
+        "summary": summarize(functions),
+    }
+
+
+def run_coordinator(input_path: str, out_path: str, jobs: int, idat: str, level: Optional[int] = None,
+                    include_lib: bool = False, timeout: Optional[float] = None, keep: bool = False) -> int:
+    """
+    把数据库复制 jobs 份, 每份由一个 idat 进程处理一个分片, 等待全部完成后合并报告
+    """
+    work_dir = tempfile.mkdtemp(prefix="unflat_batch_")
+    script = os.path.abspath(__file__)
+    ext = os.path.splitext(input_path)[1]
+    procs = []
+    start = time.perf_counter()
+    try:
+        for shard_index in range(jobs):
+            db_copy = os.path.join(work_dir, f"shard_{shard_index}{ext}")
+            shutil.copyfile(input_path, db_copy)
+            part_path = os.path.join(work_dir, f"shard_{shard_index}.json")
+            script_args = [script, "--out", part_path, "--shard", str(shard_index),
+                           "--shards", str(jobs)]
+            if level is not None:
+                script_args += ["--level", str(level)]
+            if include_lib:
+                script_args.append("--include-lib")
+            cmd = [idat, "-A", "-S" + subprocess.list2cmdline(script_args),
+                   "-L" + os.path.join(work_dir, f"shard_{shard_index}.log"), db_copy]
+            procs.append((subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL), part_path))
+
+        parts = []
+        for shard_index, (proc, part_path) in enumerate(procs):
+            try:
+                proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+            if os.path.exists(part_path):
+                with open(part_path, "r", encoding="utf-8") as f:
+                    parts.append(json.load(f))
+            else:
+                print(f"[-] 分片 {shard_index} 没有生成报告, 返回值 {proc.returncode}")
+                parts.append(None)
+
+        report = merge_reports(parts, os.path.abspath(input_path), level)
+        report["wall_time"] = round(time.perf_counter() - start, 6)
+        write_report(out_path, report)
+        summary = report["summary"]
+        print(f"[+] {summary['functions']} 个函数, {summary['deflattened']} 个被反混淆, "
+              f"{summary['patches']} 处跳转修改, 耗时 {report['wall_time']:.1f}s, 报告: {out_path}")
+        return 1 if report["missing_shards"] else 0
+    finally:
+        for proc, _ in procs:
+            if proc.poll() is None:
+                proc.kill()
+        if keep:
+            print(f"[+] 保留工作目录: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="批量反混淆整个数据库")
+    if not IN_IDA:
+        parser.add_argument("input", help="IDA 数据库或二进制文件")
+        parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="并行的 idat 进程数")
+        parser.add_argument("--idat", default=os.environ.get("IDAT", "idat"), help="idat 可执行文件路径")
+        parser.add_argument("--timeout", type=float, default=None, help="每个分片的超时时间(秒)")
+        parser.add_argument("--keep", action="store_true", help="保留数据库副本和分片报告")
+    parser.add_argument("--out", required=True, help="JSON 报告路径")
+    parser.add_argument("--shard", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--shards", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--level", type=int, default=None, choices=[0, 1, 2, 3, 4],
+                        help="所有函数使用的 deflat 级别, 0 表示按函数自动选择; 默认使用每个函数的设置和 config.deflat_level")
+    parser.add_argument("--include-lib", action="store_true", help="同时处理库函数和 thunk 函数")
+    return parser.parse_args(argv)
+
+
+def main():
+    if IN_IDA:
+        import ida_pro
+        code = 1
+        try:
+            args = parse_args(idc.ARGV[1:])
+            code = run_worker(args.out, args.shard, args.shards, args.level, args.include_lib)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+        finally:
+            ida_pro.qexit(code)
+    else:
+        args = parse_args(sys.argv[1:])
+        sys.exit(run_coordinator(args.input, args.out, max(1, args.jobs), args.idat, args.level,
+                                 args.include_lib, args.timeout, args.keep))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
-from ida_hexrays import *
+from .mcapi import *
+import bisect
 import logging
+from .trace import edge_event
 
 logger = logging.getLogger(__name__)
 
@@ -24,33 +26,46 @@ def insert_goto(mblock:mblock_t, target_mblock_serial:int):
         mblock.head = new_goto
         mblock.tail = new_goto
 
-def insert_jz(mblock:mblock_t, target_mblock_serial:int, cmp_value:int, cmp_mreg:int, cmp_value_size:int, cmp_mreg_size:int):
-    new_jz = minsn_t(mblock.end)
-    new_jz.opcode = m_jz
-    new_jz.l = mop_t()
-    new_jz.l.make_reg(cmp_mreg, cmp_mreg_size)
-    new_jz.r = mop_t()
-    new_jz.r.make_number(cmp_value, cmp_value_size)
-    new_jz.d = mop_t()
-    new_jz.d.make_blkref(target_mblock_serial)
+def insert_jcc(mblock:mblock_t, target_mblock_serial:int, opcode:int, mop_l:mop_t, mop_r:mop_t):
+    """
+    在微代码块末尾插入条件跳转指令 "opcode mop_l, mop_r, @target", 操作数会被复制
+    """
+    new_jcc = minsn_t(mblock.end)
+    new_jcc.opcode = opcode
+    new_jcc.l = mop_t(mop_l)
+    new_jcc.r = mop_t(mop_r)
+    new_jcc.d = mop_t()
+    new_jcc.d.make_blkref(target_mblock_serial)
     if mblock.tail:
-        mblock.insert_into_block(new_jz, mblock.tail)
+        mblock.insert_into_block(new_jcc, mblock.tail)
     else:
-        mblock.head = new_jz
-        mblock.tail = new_jz
+        mblock.head = new_jcc
+        mblock.tail = new_jcc
 
-def change_jmp_target(mblock:mblock_t, target_mblock_serial:int):
+def insert_jz(mblock:mblock_t, target_mblock_serial:int, cmp_value:int, cmp_mreg:int, cmp_value_size:int, cmp_mreg_size:int):
+    mop_l = mop_t()
+    mop_l.make_reg(cmp_mreg, cmp_mreg_size)
+    mop_r = mop_t()
+    mop_r.make_number(cmp_value, cmp_value_size)
+    insert_jcc(mblock, target_mblock_serial, m_jz, mop_l, mop_r)
+
+def change_jmp_target(mblock:mblock_t, target_mblock_serial:int, txn:"EdgeTransaction" = None):
     """
     修改微代码块的跳转目标
     
     Args:
         mblock: 要修改的微代码块
         target_mblock_serial: 新的跳转目标块序列号
+        txn: 边修改事务, 传入时只记录边的修改, 在事务提交时统一写回
+
+    Returns:
+        是否修改了微代码(跳转目标或新插入的goto)
     """
     minsn:minsn_t = mblock.tail
     ori_mblock_serial = 0
+    inserted = False
     if not minsn:
-        return
+        return False
     if minsn.opcode == m_goto:
         ori_mblock_serial = minsn.l.b
         minsn.l.b = target_mblock_serial
@@ -60,9 +75,15 @@ def change_jmp_target(mblock:mblock_t, target_mblock_serial:int):
     else:
         ori_mblock_serial = mblock.serial + 1
         insert_goto(mblock, target_mblock_serial)
+        inserted = True
     if ori_mblock_serial != 0 and ori_mblock_serial != target_mblock_serial:
-        logger.info(f"改变块关系:{mblock.serial}->{ori_mblock_serial}, {mblock.serial}->{target_mblock_serial}")
-        modify_edge(mblock.mba, mblock.serial, target_mblock_serial, ori_mblock_serial)
+        logger.info("改变块关系:%d->%d, %d->%d", mblock.serial, ori_mblock_serial, mblock.serial, target_mblock_serial)
+        if txn is not None:
+            txn.modify_edge(mblock.serial, target_mblock_serial, ori_mblock_serial)
+        else:
+            modify_edge(mblock.mba, mblock.serial, target_mblock_serial, ori_mblock_serial)
+        return True
+    return inserted
 
 def create_mblock(mblock:mblock_t, mblock_serial:int) -> mblock_t:
     """
@@ -81,22 +102,132 @@ def create_mblock(mblock:mblock_t, mblock_serial:int) -> mblock_t:
     new_mblock.end = mba.alloc_fict_ea(mblock.end + 4)
     return new_mblock
 
-def clear_edge(mba:mba_t, mblock_id: int):
+def clear_edge(mba:mba_t, mblock_id: int, txn:"EdgeTransaction" = None):
     """
     清除指定微代码块的所有后继边
     
     Args:
         mba: 微代码块数组
         mblock_id: 要清除边的微代码块ID
+        txn: 边修改事务, 为None时立即提交
+    """
+    own_txn = txn is None
+    if own_txn:
+        txn = EdgeTransaction(mba)
+    for succset_mblock_id in list(txn.succs(mblock_id)):
+        txn.modify_edge(mblock_id, old_block_id=succset_mblock_id)
+    if own_txn:
+        txn.commit()
+
+class EdgeTransaction:
     """
-    mblock:mblock_t = mba.get_mblock(mblock_id)
-    mblock_succset = [x for x in mblock.succset]
-    for succset_mblock_id in mblock_succset:
-        modify_edge(mba, mblock_id, old_block_id=succset_mblock_id)
+    批量修改微代码块之间的边关系
+
+    所有修改先记录在每个块的前驱/后继副本上(每个块只从原生集合复制一次),
+    commit 时每个受影响的块只清空并重建一次 succset/predset。
+    前驱集合使用 dict 保存, 删除和插入都是 O(1) 并保持原有顺序。
+
+    用法:
+        with EdgeTransaction(mba) as txn:
+            change_jmp_target(mblock, target, txn)
+    """
+
+    def __init__(self, mba:mba_t):
+        self.mba = mba
+        self._succs: dict = {}  # 块ID -> 后继列表
+        self._preds: dict = {}  # 块ID -> {前驱ID: None}
+        self.nb_edges = 0  # 已记录的边修改次数
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def succs(self, block_id: int) -> list:
+        succ = self._succs.get(block_id)
+        if succ is None:
+            succ = [x for x in self.mba.get_mblock(block_id).succset]
+            self._succs[block_id] = succ
+        return succ
+
+    def preds(self, block_id: int) -> dict:
+        pred = self._preds.get(block_id)
+        if pred is None:
+            pred = dict.fromkeys(self.mba.get_mblock(block_id).predset)
+            self._preds[block_id] = pred
+        return pred
+
+    def modify_edge(self, cur_block_id: int, new_block_id: int = 0, old_block_id: int = 0):
+        """
+        记录一次边修改, 语义与 modify_edge 相同
+
+        Args:
+            cur_block_id: 当前微代码块ID
+            new_block_id: 新的后继块ID（为0表示不添加新边）
+            old_block_id: 要移除的旧后继块ID（为0表示不移除）
+        """
+        cur_block_succset = self.succs(cur_block_id)
+        old_block_index = len(cur_block_succset)
+
+        # 移除旧边
+        if old_block_id != 0 and old_block_id in cur_block_succset:
+            old_block_index = cur_block_succset.index(old_block_id)
+            del cur_block_succset[old_block_index]
+            self.preds(old_block_id).pop(cur_block_id, None)
+
+        # 添加新边
+        if new_block_id != 0 and new_block_id not in cur_block_succset:
+            cur_block_succset.insert(old_block_index, new_block_id)
+            self.preds(new_block_id).setdefault(cur_block_id)
+        self.nb_edges += 1
+        edge_event("edge", cur_block_id, old_block_id, new_block_id)
+
+    def remap(self, serial_map):
+        """
+        插入块改变了块序号后, 把未提交的修改一次性改为新的序号
+
+        Args:
+            serial_map: 旧序号 -> 新序号的函数
+        """
+        if not self._succs and not self._preds:
+            return
+        self._succs = {serial_map(block_id): [serial_map(x) for x in succ] for block_id, succ in self._succs.items()}
+        self._preds = {serial_map(block_id): dict.fromkeys(serial_map(x) for x in pred)
+                       for block_id, pred in self._preds.items()}
+
+    def commit(self):
+        """
+        把所有记录的修改写回原生的 succset/predset, 每个块只重建一次
+        """
+        if not self._succs and not self._preds:
+            return
+        debug = logger.isEnabledFor(logging.DEBUG)
+        mba = self.mba
+        for block_id, succ in self._succs.items():
+            succset = mba.get_mblock(block_id).succset
+            if debug:
+                logger.debug("修改块关系:%d succset %s -> %s", block_id, [x for x in succset], succ)
+            succset.clear()
+            for i in succ:
+                succset.push_back(i)
+        for block_id, pred in self._preds.items():
+            predset = mba.get_mblock(block_id).predset
+            if debug:
+                logger.debug("修改块关系:%d predset %s -> %s", block_id, [x for x in predset], list(pred))
+            predset.clear()
+            for i in pred:
+                predset.push_back(i)
+        logger.debug("边修改事务提交: %d 次修改, %d 个块", self.nb_edges, len(self._succs.keys() | self._preds.keys()))
+        self._succs.clear()
+        self._preds.clear()
+        self.nb_edges = 0
 
 def modify_edge(mba:mba_t, cur_block_id: int, new_block_id: int = 0, old_block_id: int = 0):
     """
-    修改微代码块之间的边关系（控制流边）
+    修改微代码块之间的边关系（控制流边）, 立即提交
 
     Args:
         mba: 微代码块数组
@@ -109,44 +240,9 @@ def modify_edge(mba:mba_t, cur_block_id: int, new_block_id: int = 0, old_block_i
         - 添加从cur_block到new_block的边
         - 更新相关块的前驱和后继集合
     """
-    cur_block: mblock_t = mba.get_mblock(cur_block_id)
-
-    # 只在需要时获取块
-    new_block = mba.get_mblock(new_block_id) if new_block_id != 0 else None
-    old_block = mba.get_mblock(old_block_id) if old_block_id != 0 else None
-
-    cur_block_succset = [x for x in cur_block.succset]
-    new_block_predset = [x for x in new_block.predset] if new_block else []
-    old_block_predset = [x for x in old_block.predset] if old_block else []
-    old_block_index = len(cur_block_succset)
-
-    logger.debug(f"修改块关系前:cur_block_succset:{cur_block_succset}, new_block_predset:{new_block_predset}, old_block_predset:{old_block_predset}")
-
-    # 移除旧边
-    if old_block_id != 0 and old_block_id in cur_block_succset and old_block:
-        old_block_index = cur_block_succset.index(old_block_id)
-        cur_block_succset.remove(old_block_id)
-        if cur_block_id in old_block_predset:
-            old_block_predset.remove(cur_block_id)
-            old_block.predset.clear()
-            for i in old_block_predset:
-                old_block.predset.push_back(i)
-
-    # 添加新边
-    if new_block_id != 0 and new_block_id not in cur_block_succset and new_block:
-        cur_block_succset.insert(old_block_index, new_block_id)
-        if cur_block_id not in new_block_predset:
-            new_block_predset.append(cur_block_id)
-            new_block.predset.clear()
-            for i in new_block_predset:
-                new_block.predset.push_back(i)
-
-    # 更新当前块的后继集合
-    cur_block.succset.clear()
-    for i in cur_block_succset:
-        cur_block.succset.push_back(i)
-
-    logger.debug(f"修改块关系后:cur_block_succset:{cur_block_succset}, new_block_predset:{new_block_predset}, old_block_predset:{old_block_predset}")
+    txn = EdgeTransaction(mba)
+    txn.modify_edge(cur_block_id, new_block_id, old_block_id)
+    txn.commit()
     
 def check_mblock_tail_opcode_is_goto(mblock:mblock_t):
     """
@@ -164,63 +260,278 @@ def check_mblock_tail_opcode_is_goto(mblock:mblock_t):
     else:
         return False
     
-def create_goto_mblock(cur_mblock:mblock_t, target_mblock_serial:int) -> mblock_t:
+def create_goto_mblock(cur_mblock:mblock_t, target_mblock_serial:int, txn:EdgeTransaction = None) -> mblock_t:
     """
     创建一个包含无条件跳转指令的微代码块
     
     Args:
         cur_mblock: 当前微代码块（用于确定新块的位置）
         target_mblock_serial: 跳转目标块的序列号
+        txn: 边修改事务, 插入新块会改变后续块的序号, 所以事务中未提交的修改会先被提交
         
     Returns:
         新创建的包含goto指令的微代码块
     """
     mba:mba_t = cur_mblock.mba
+    own_txn = txn is None
+    if own_txn:
+        txn = EdgeTransaction(mba)
+    else:
+        txn.commit()
     new_mblock = create_mblock(cur_mblock, cur_mblock.serial + 1)
     insert_goto(new_mblock, target_mblock_serial)
     new_mblock.type = BLT_1WAY
     new_mblock.flags |= MBL_GOTO
     if not check_mblock_tail_opcode_is_goto(cur_mblock):
-        modify_edge(mba, cur_mblock.serial, new_mblock.serial, new_mblock.serial + 1)
+        txn.modify_edge(cur_mblock.serial, new_mblock.serial, new_mblock.serial + 1)
     else:
-        modify_edge(mba, cur_mblock.serial, new_mblock.serial)
-    modify_edge(mba, new_mblock.serial, target_mblock_serial)
+        txn.modify_edge(cur_mblock.serial, new_mblock.serial)
+    txn.modify_edge(new_mblock.serial, target_mblock_serial)
+    if own_txn:
+        txn.commit()
     new_mblock.make_lists_ready()
     new_mblock.mark_lists_dirty()
     mba.mark_chains_dirty()
     return new_mblock
 
-def create_jz_mblock(cur_mblock:mblock_t, target_mblock_serial:int, cmp_value: int, cmp_mreg: int, cmp_value_size: int = 4, cmp_mreg_size: int = 4) -> mblock_t:
+def create_jcc_mblock(cur_mblock:mblock_t, target_mblock_serial:int, opcode:int, mop_l:mop_t, mop_r:mop_t, txn:EdgeTransaction = None) -> mblock_t:
     """
-    创建一个包含条件跳转指令（等于则跳转）的微代码块
-    
+    在当前块之后创建一个只包含条件跳转指令的微代码块, 条件不成立时落到下一个块
+
     Args:
         cur_mblock: 当前微代码块（用于确定新块的位置）
-        target_mblock_serial: 跳转目标块的序列号
-        cmp_value: 比较的值
-        cmp_mreg: 比较的寄存器
-        cmp_value_size: 比较值的大小（字节数），默认为4
-        cmp_mreg_size: 比较寄存器的大小（字节数），默认为4
-        
+        target_mblock_serial: 条件成立时的跳转目标块序列号(插入新块之后的序号)
+        opcode: 条件跳转的操作码, 例如 m_jz
+        mop_l, mop_r: 比较的两个操作数, 会被复制
+        txn: 边修改事务, 插入新块会改变后续块的序号, 所以事务中未提交的修改会先被提交
+
     Returns:
-        新创建的包含jz指令的微代码块
+        新创建的包含条件跳转指令的微代码块
     """
     mba:mba_t = cur_mblock.mba
+    own_txn = txn is None
+    if own_txn:
+        txn = EdgeTransaction(mba)
+    else:
+        txn.commit()
     new_mblock = create_mblock(cur_mblock, cur_mblock.serial + 1)
-    insert_jz(new_mblock, target_mblock_serial, cmp_value, cmp_mreg, cmp_value_size, cmp_mreg_size)
+    insert_jcc(new_mblock, target_mblock_serial, opcode, mop_l, mop_r)
     new_mblock.type = BLT_2WAY
     new_mblock.flags |= MBL_GOTO
     if not check_mblock_tail_opcode_is_goto(cur_mblock):
-        modify_edge(mba, cur_mblock.serial, new_mblock.serial, new_mblock.serial + 1)
+        txn.modify_edge(cur_mblock.serial, new_mblock.serial, new_mblock.serial + 1)
     else:
-        modify_edge(mba, cur_mblock.serial, new_mblock.serial)
-    modify_edge(mba, new_mblock.serial, new_mblock.serial + 1)
-    modify_edge(mba, new_mblock.serial, target_mblock_serial)
+        txn.modify_edge(cur_mblock.serial, new_mblock.serial)
+    txn.modify_edge(new_mblock.serial, new_mblock.serial + 1)
+    txn.modify_edge(new_mblock.serial, target_mblock_serial)
+    if own_txn:
+        txn.commit()
     new_mblock.make_lists_ready()
     new_mblock.mark_lists_dirty()
     mba.mark_chains_dirty()
     return new_mblock
 
+def create_jz_mblock(cur_mblock:mblock_t, target_mblock_serial:int, cmp_value: int, cmp_mreg: int, cmp_value_size: int = 4, cmp_mreg_size: int = 4, txn:EdgeTransaction = None) -> mblock_t:
+    """
+    创建一个包含条件跳转指令（等于则跳转）的微代码块
+    
+    Args:
+        cur_mblock: 当前微代码块（用于确定新块的位置）
+        target_mblock_serial: 跳转目标块的序列号
+        cmp_value: 比较的值
+        cmp_mreg: 比较的寄存器
+        cmp_value_size: 比较值的大小（字节数），默认为4
+        cmp_mreg_size: 比较寄存器的大小（字节数），默认为4
+        txn: 边修改事务, 插入新块会改变后续块的序号, 所以事务中未提交的修改会先被提交
+        
+    Returns:
+        新创建的包含jz指令的微代码块
+    """
+    mop_l = mop_t()
+    mop_l.make_reg(cmp_mreg, cmp_mreg_size)
+    mop_r = mop_t()
+    mop_r.make_number(cmp_value, cmp_value_size)
+    return create_jcc_mblock(cur_mblock, target_mblock_serial, m_jz, mop_l, mop_r, txn)
+
+class PlannedBlock:
+    """
+    BlockInsertionPlan 中计划插入的块, 布局确定后 serial 为最终序号
+    """
+    __slots__ = ("after", "target", "opcode", "mop_l", "mop_r", "serial")
+
+    def __init__(self, after: int, target, opcode: int, mop_l: mop_t = None, mop_r: mop_t = None):
+        self.after = after
+        self.target = target
+        self.opcode = opcode
+        self.mop_l = mop_l
+        self.mop_r = mop_r
+        self.serial = -1
+
+class BlockInsertionPlan:
+    """
+    批量插入只包含一条跳转指令的新块
+
+    先收集所有要插入的块, 一次计算出所有块的最终序号, 再按位置从后往前插入, 之前插入的块不会改变
+    还没有处理的位置; 事务中未提交的边修改只重新编号一次, 链和列表也只在最后标记一次。
+
+    - append 为 True 时所有新块都放在出口块之前, 原有块中只有出口块的序号会变化;
+      倒数第二个块落到出口块且无法补一条goto时, 退回到插在 after 之后
+    - 插在 after 之后时, after 原来落到下一个块的边改为落到第一个新块(与 create_goto_mblock 相同)
+    - 跳转目标可以是修改前的块序号, 也可以是同一计划中的 PlannedBlock
+    - 条件跳转块不成立时落到下一个块, 所以紧跟在它后面添加的块(after相同)就是它的假分支
+    - 新块不一定紧跟在 after 之后, 调用者需要用 change_jmp_target 显式跳到新块
+
+    用法:
+        plan = BlockInsertionPlan(mba)
+        jcc = plan.add_jcc_block(cur, true_target, m_jz, mop_l, mop_r)
+        plan.add_goto_block(cur, false_target)
+        with EdgeTransaction(mba) as txn:
+            plan.commit(txn)
+            change_jmp_target(mba.get_mblock(plan.remap(cur)), jcc.serial, txn)
+    """
+
+    def __init__(self, mba:mba_t, append: bool = True):
+        self.mba = mba
+        self.append = append
+        self.blocks: list = []
+        self._anchors: list = None  # 排好序的插入位置, 布局确定后不能再添加块
+        self._fix_last = False  # 倒数第二个块落到出口块, 需要补一条goto
+        self._appended = False  # 新块是否都放在出口块之前
+
+    def add_goto_block(self, after: int, target) -> PlannedBlock:
+        """
+        计划插入 "goto @target"
+        """
+        return self._add(PlannedBlock(after, target, m_goto))
+
+    def add_jcc_block(self, after: int, target, opcode: int, mop_l: mop_t, mop_r: mop_t) -> PlannedBlock:
+        """
+        计划插入 "opcode mop_l, mop_r, @target", 操作数会被复制
+        """
+        return self._add(PlannedBlock(after, target, opcode, mop_t(mop_l), mop_t(mop_r)))
+
+    def _add(self, block: PlannedBlock) -> PlannedBlock:
+        if self._anchors is not None:
+            raise RuntimeError("块的布局已经确定, 不能再添加新块")
+        self.blocks.append(block)
+        return block
+
+    def _can_append(self, last_id: int) -> bool:
+        mba = self.mba
+        last: mblock_t = mba.get_mblock(last_id)
+        stop_id = mba.qty - 1
+        tail: minsn_t = last.tail
+        if (tail is not None and tail.opcode == m_goto) or stop_id not in last.succset:
+            return True
+        if last.nsucc() == 1 and (tail is None or tail.opcode not in CONDITIONAL_JUMP_LIST):
+            self._fix_last = True
+            return True
+        return False
+
+    def layout(self):
+        """
+        确定所有新块的最终序号, 之后可以用 remap 换算原有块的序号
+        """
+        if self._anchors is not None:
+            return
+        if self.append and self.blocks and self._can_append(self.mba.qty - 2):
+            for block in self.blocks:
+                block.after = self.mba.qty - 2
+            self._appended = True
+        self._anchors = sorted(block.after for block in self.blocks)
+        offsets = {}
+        for block in self.blocks:
+            offset = offsets.get(block.after, 0)
+            offsets[block.after] = offset + 1
+            block.serial = self.remap(block.after) + 1 + offset
+
+    def remap(self, serial: int) -> int:
+        """
+        原有块插入新块之后的序号
+        """
+        self.layout()
+        return serial + bisect.bisect_left(self._anchors, serial)
+
+    def _redirect_fall_through(self, txn: EdgeTransaction, anchor_id: int, first_id: int, old_next_id: int):
+        """
+        把 anchor 落到原来下一个块(插入后为 old_next_id)的边改为落到 first_id
+        """
+        tail: minsn_t = self.mba.get_mblock(anchor_id).tail
+        if tail is not None and tail.opcode in (m_goto, m_ijmp, m_jtbl):
+            return
+        if old_next_id not in txn.succs(anchor_id):
+            return
+        if tail is not None and tail.opcode in CONDITIONAL_JUMP_LIST and tail.d.b == old_next_id:
+            # 条件跳转的目标也是原来的下一个块, 这条边保留
+            txn.modify_edge(anchor_id, first_id)
+        else:
+            txn.modify_edge(anchor_id, first_id, old_next_id)
+
+    def _target(self, block: PlannedBlock) -> int:
+        if isinstance(block.target, PlannedBlock):
+            return block.target.serial
+        return self.remap(block.target)
+
+    def commit(self, txn: EdgeTransaction = None) -> list:
+        """
+        插入所有计划的块并记录它们的边
+
+        Args:
+            txn: 边修改事务, 其中未提交的修改会被重新编号; 为None时立即提交
+
+        Returns:
+            按添加顺序排列的 PlannedBlock
+        """
+        self.layout()
+        if not self.blocks:
+            return self.blocks
+        mba = self.mba
+        stop_id = mba.qty - 1
+        own_txn = txn is None
+        if own_txn:
+            txn = EdgeTransaction(mba)
+        else:
+            txn.remap(self.remap)
+
+        # 从后往前插入, 较大位置的插入不会影响较小的位置
+        groups = {}
+        for block in self.blocks:
+            groups.setdefault(block.after, []).append(block)
+        for after in sorted(groups, reverse=True):
+            ref_mblock = mba.get_mblock(after)
+            for _ in groups[after]:
+                create_mblock(ref_mblock, after + 1)
+
+        if not self._appended:
+            # 新块紧跟在 after 之后, after 顺序执行时现在落到第一个新块
+            for after, group in groups.items():
+                self._redirect_fall_through(txn, self.remap(after), group[0].serial, group[-1].serial + 1)
+
+        for block in self.blocks:
+            new_mblock: mblock_t = mba.get_mblock(block.serial)
+            target = self._target(block)
+            if block.opcode == m_goto:
+                insert_goto(new_mblock, target)
+                new_mblock.type = BLT_1WAY
+            else:
+                insert_jcc(new_mblock, target, block.opcode, block.mop_l, block.mop_r)
+                new_mblock.type = BLT_2WAY
+                txn.modify_edge(block.serial, block.serial + 1)
+            new_mblock.flags |= MBL_GOTO
+            txn.modify_edge(block.serial, target)
+        if self._fix_last:
+            insert_goto(mba.get_mblock(self.remap(stop_id - 1)), self.remap(stop_id))
+
+        if own_txn:
+            txn.commit()
+        for block in self.blocks:
+            new_mblock = mba.get_mblock(block.serial)
+            new_mblock.make_lists_ready()
+            new_mblock.mark_lists_dirty()
+        mba.mark_chains_dirty()
+        logger.debug("批量插入 %d 个块", len(self.blocks))
+        return self.blocks
+
 def optimize_block(mba:mba_t):
     """
     优化微代码块数组中的所有块
@@ -238,4 +549,4 @@ def optimize_block(mba:mba_t):
         while minsn:
             mblock.optimize_insn(minsn)
             minsn = minsn.prev
-        mblock.optimize_block()
\ No newline at end of file
+        mblock.optimize_block()
@@ -1,2 +1,14 @@
 enable_ollvm_unflatten = True
-enable_remove_dead_code = True
\ No newline at end of file
+enable_remove_dead_code = True
+enable_deflat_cache = True
+enable_deflat_stats = False  # 记录每个函数 deflat 各阶段的耗时和计数, 写入日志文件和统计窗口的最慢阶段列
+enable_trace = False
+enable_trace_edges = False
+enable_microcode_snapshot = False
+microcode_snapshot_format = "gzip"
+microcode_snapshot_model = False  # 开启快照时同时保存可以在 IDA 外重放的模型, 用于 benchmarks/corpus.py
+deflat_level = 0  # 0 表示在所有级别中自动选择, 选择结果按函数保存
+enable_on_startup = False  # IDA 启动时自动启用反混淆, 否则在 edit->plugin 中运行插件后才启用
+enable_dev_reload = False  # 开发用: 在右键菜单中添加热重载动作, 运行插件时也会热重载
+enable_prefetch = False  # 空闲时在后台预先反编译光标附近的函数, 会写入反混淆缓存等 IDB 数据, 默认关闭
+enable_prefilter = True  # 先用廉价特征判断函数是否像被平坦化, 没有平坦化特征的函数跳过反混淆
\ No newline at end of file
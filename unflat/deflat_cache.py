@@ -0,0 +1,243 @@
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, TypedDict
+
+import ida_bytes
+import ida_funcs
+import ida_idp
+import ida_netnode
+
+logger = logging.getLogger(__name__)
+
+# 缓存保存在 IDB 的 netnode 中, 每个函数一个 blob, 另有一个 blob 记录使用顺序用于淘汰(内存中维护, 保存数据库时写回)
+CACHE_NETNODE_NAME = "$ unflat.deflat_cache"
+ENTRY_TAG = "U"
+LEVEL_TAG = "L"  # 自动选择的 deflat 级别, 不参与淘汰
+VERDICT_TAG = "V"  # 平坦化预判的结论, 不参与淘汰
+ORDER_TAG = "O"
+ORDER_INDEX = 0
+DEFAULT_MAX_ENTRIES = 1024
+CACHE_VERSION = 4
+
+
+class DeflatCacheEntry(TypedDict):
+    version: int
+    func_hash: str
+    settings: str
+    qty: int
+    cfg_hash: str  # 反混淆之前的 CFG 指纹, 见 cfg_fingerprint
+    dispatcher_id: int
+    storage_carrier: Optional[int]  # 状态变量的操作数键(opkey)
+    redirections: Dict[int, int]
+    splits: List[dict]  # Unflattener.splits, 拆分为条件跳转的块
+
+
+def function_hash(entry_ea: int) -> Optional[str]:
+    """
+    计算函数所有 chunk 的字节哈希, 函数字节被修改后缓存自动失效
+
+    Returns:
+        十六进制哈希值, 找不到函数时返回None
+    """
+    func = ida_funcs.get_func(entry_ea)
+    if func is None:
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    fci = ida_funcs.func_tail_iterator_t(func)
+    ok = fci.main()
+    while ok:
+        chunk = fci.chunk()
+        h.update(chunk.start_ea.to_bytes(8, "little"))
+        h.update(chunk.end_ea.to_bytes(8, "little"))
+        data = ida_bytes.get_bytes(chunk.start_ea, chunk.end_ea - chunk.start_ea)
+        if data:
+            h.update(data)
+        ok = fci.next()
+    return h.hexdigest()
+
+
+def cfg_fingerprint(mba) -> str:
+    """
+    计算反混淆之前的 CFG 指纹: 每个块的起始地址、类型和后继
+
+    函数字节不变时 microcode 仍然可能因为被调用函数的原型、noreturn 标志、用户类型等变化而不同,
+    缓存的跳转修改按块序号保存, 块布局变化后不能重放。
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for i in range(mba.qty):
+        mblock = mba.get_mblock(i)
+        h.update("{0:x}:{1}:{2};".format(
+            mblock.start, mblock.type, ",".join(str(x) for x in mblock.succset)).encode())
+    return h.hexdigest()
+
+
+class _CacheIdbHooks(ida_idp.IDB_Hooks):
+    """
+    保存或关闭数据库时把使用顺序写回 IDB
+    """
+    def __init__(self, cache: "DeflatCache"):
+        ida_idp.IDB_Hooks.__init__(self)
+        self.cache = cache
+
+    def savebase(self, *args):
+        self.cache.flush()
+        return 0
+
+    def closebase(self, *args):
+        self.cache.close()
+        return 0
+
+
+class DeflatCache:
+    """
+    按函数保存 deflat 的结果(分发块, 状态变量, 跳转修改), 保存在 IDB 中
+
+    键为函数入口地址, 条目中记录函数字节哈希、影响结果的设置、块数量和 CFG 指纹,
+    任何一项不一致都视为未命中。超过 max_entries 时淘汰最久未使用的条目。
+
+    使用顺序第一次使用时从 IDB 读入内存, 命中时只在内存中调整, 保存或关闭数据库时写回。
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._order: Optional[OrderedDict] = None  # 函数入口地址 -> None, 最久未使用的在前
+        self.modified = False
+        self._idb_hooks: Optional[_CacheIdbHooks] = None
+
+    def _node(self) -> ida_netnode.netnode:
+        return ida_netnode.netnode(CACHE_NETNODE_NAME, 0, True)
+
+    def _load_order(self, node: ida_netnode.netnode) -> OrderedDict:
+        if self._order is None:
+            blob = node.getblob(ORDER_INDEX, ORDER_TAG)
+            self._order = OrderedDict.fromkeys(json.loads(blob) if blob else [])
+            self.modified = False
+            if self._idb_hooks is None:
+                self._idb_hooks = _CacheIdbHooks(self)
+                self._idb_hooks.hook()
+        return self._order
+
+    def _touch(self, node: ida_netnode.netnode, entry_ea: int):
+        order = self._load_order(node)
+        if entry_ea in order:
+            order.move_to_end(entry_ea)
+        else:
+            order[entry_ea] = None
+        self.modified = True
+        while len(order) > self.max_entries:
+            evicted, _ = order.popitem(last=False)
+            node.delblob(evicted, ENTRY_TAG)
+            logger.debug("淘汰缓存: 0x%x", evicted)
+
+    def flush(self):
+        """
+        使用顺序有修改时写回 IDB
+        """
+        if self._order is None or not self.modified:
+            return
+        self._node().setblob(json.dumps(list(self._order)).encode(), ORDER_INDEX, ORDER_TAG)
+        self.modified = False
+
+    def close(self):
+        self.flush()
+        if self._idb_hooks is not None:
+            self._idb_hooks.unhook()
+            self._idb_hooks = None
+        self._order = None
+
+    def lookup(self, entry_ea: int, func_hash: str, settings: str, qty: int,
+               cfg_hash: str) -> Optional[DeflatCacheEntry]:
+        """
+        查找缓存, 哈希、设置、块数量或 CFG 指纹不一致时删除旧条目并返回None
+        """
+        node = self._node()
+        blob = node.getblob(entry_ea, ENTRY_TAG)
+        if not blob:
+            return None
+        try:
+            raw = json.loads(blob)
+        except ValueError:
+            raw = None
+        if (not raw or raw.get("version") != CACHE_VERSION or raw.get("func_hash") != func_hash
+                or raw.get("settings") != settings or raw.get("qty") != qty
+                or raw.get("cfg_hash") != cfg_hash):
+            logger.debug("缓存失效: 0x%x", entry_ea)
+            self._delete_entry(node, entry_ea)
+            return None
+        raw["redirections"] = {int(k): v for k, v in raw["redirections"]}
+        self._touch(node, entry_ea)
+        return raw
+
+    def store(self, entry_ea: int, entry: DeflatCacheEntry):
+        node = self._node()
+        raw = dict(entry)
+        raw["redirections"] = list(entry["redirections"].items())
+        node.setblob(json.dumps(raw).encode(), entry_ea, ENTRY_TAG)
+        self._touch(node, entry_ea)
+
+    def _lookup_tagged(self, entry_ea: int, func_hash: str, tag: str, name: str):
+        blob = self._node().getblob(entry_ea, tag)
+        if not blob:
+            return None
+        try:
+            raw = json.loads(blob)
+        except ValueError:
+            return None
+        if raw.get("func_hash") != func_hash:
+            return None
+        return raw.get(name)
+
+    def _store_tagged(self, entry_ea: int, func_hash: str, tag: str, name: str, value):
+        self._node().setblob(json.dumps({"func_hash": func_hash, name: value}).encode(), entry_ea, tag)
+
+    def lookup_level(self, entry_ea: int, func_hash: str) -> Optional[int]:
+        """
+        查找自动选择的 deflat 级别, 函数字节变化后失效
+        """
+        return self._lookup_tagged(entry_ea, func_hash, LEVEL_TAG, "level")
+
+    def store_level(self, entry_ea: int, func_hash: str, level: int):
+        self._store_tagged(entry_ea, func_hash, LEVEL_TAG, "level", level)
+
+    def lookup_verdict(self, entry_ea: int, func_hash: str) -> Optional[bool]:
+        """
+        查找平坦化预判的结论, 函数字节变化后失效
+
+        Returns:
+            是否像被平坦化, 还没有预判过时返回None
+        """
+        return self._lookup_tagged(entry_ea, func_hash, VERDICT_TAG, "flattened")
+
+    def store_verdict(self, entry_ea: int, func_hash: str, flattened: bool):
+        self._store_tagged(entry_ea, func_hash, VERDICT_TAG, "flattened", flattened)
+
+    def invalidate(self, entry_ea: Optional[int] = None):
+        """
+        删除指定函数的缓存、自动选择的级别和预判结论, entry_ea为None时清空所有缓存
+        """
+        node = self._node()
+        if entry_ea is None:
+            node.kill()
+            if self._order is not None:
+                self._order.clear()
+            self.modified = False
+            logger.info("已清空所有反混淆缓存")
+            return
+        node.delblob(entry_ea, LEVEL_TAG)
+        node.delblob(entry_ea, VERDICT_TAG)
+        self._delete_entry(node, entry_ea)
+
+    def _delete_entry(self, node: ida_netnode.netnode, entry_ea: int):
+        node.delblob(entry_ea, ENTRY_TAG)
+        order = self._load_order(node)
+        if entry_ea in order:
+            del order[entry_ea]
+            self.modified = True
+
+    def __len__(self):
+        return len(self._load_order(self._node()))
+
+
+deflat_cache = DeflatCache()
@@ -0,0 +1,248 @@
+from .mcapi import *
+from .opkey import format_key, operand_key
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+JMP_OPCODE_HANDLED = [m_jnz, m_jz, m_jae, m_jb, m_ja, m_jbe, m_jge, m_jg, m_jl, m_jle]
+
+# 从循环头走到第一个比较块时最多经过的单后继块数量
+MAX_HEADER_STEPS = 4
+# 比较链至少包含的比较块数量
+MIN_COMPARES = 2
+
+
+class CfgAnalysis:
+    """
+    对 mba 的控制流做一次性分析: 前驱/后继、逆后序、支配树和回边
+
+    支配关系使用 Lengauer-Tarjan 算法计算, 再对支配树编号,
+    dominates 查询为 O(1)。多个分发块的检测共享同一个分析结果。
+    """
+    __slots__ = ("qty", "succs", "preds", "rpo", "idom", "_tin", "_tout", "back_edges")
+
+    def __init__(self, mba: mba_t):
+        qty = mba.qty
+        self.qty = qty
+        self.succs: List[List[int]] = [list(mba.get_mblock(i).succset) for i in range(qty)]
+        self.preds: List[List[int]] = [list(mba.get_mblock(i).predset) for i in range(qty)]
+        self.rpo = self._reverse_postorder()
+        self.idom = self._dominators()
+        self._tin, self._tout = self._number_dom_tree()
+        self.back_edges: List[Tuple[int, int]] = [
+            (src, dst) for src in self.rpo for dst in self.succs[src] if self.dominates(dst, src)]
+
+    def _reverse_postorder(self) -> List[int]:
+        if self.qty == 0:
+            return []
+        succs = self.succs
+        visited = [False] * self.qty
+        visited[0] = True
+        postorder = []
+        stack = [(0, iter(succs[0]))]
+        while stack:
+            block, it = stack[-1]
+            for succ in it:
+                if 0 <= succ < self.qty and not visited[succ]:
+                    visited[succ] = True
+                    stack.append((succ, iter(succs[succ])))
+                    break
+            else:
+                stack.pop()
+                postorder.append(block)
+        postorder.reverse()
+        return postorder
+
+    def _dominators(self) -> List[int]:
+        """
+        Lengauer-Tarjan(路径压缩版本), 返回每个块的直接支配块, 入口块为自身, 不可达的块为-1
+        """
+        qty = self.qty
+        idom_blocks = [-1] * qty
+        if qty == 0:
+            return idom_blocks
+        succs = self.succs
+        # 深度优先前序编号, 之后的计算都在编号空间中进行
+        num = [-1] * qty
+        vertex: List[int] = []
+        parent: List[int] = []
+        stack = [(0, -1)]
+        while stack:
+            block, parent_num = stack.pop()
+            if num[block] != -1:
+                continue
+            num[block] = len(vertex)
+            vertex.append(block)
+            parent.append(parent_num)
+            for succ in reversed(succs[block]):
+                if 0 <= succ < qty and num[succ] == -1:
+                    stack.append((succ, num[block]))
+
+        n = len(vertex)
+        semi = list(range(n))
+        label = list(range(n))
+        ancestor = [-1] * n
+        idom = [0] * n
+        bucket: List[List[int]] = [[] for _ in range(n)]
+
+        def evaluate(v: int) -> int:
+            if ancestor[v] == -1:
+                return v
+            path = []
+            u = v
+            while ancestor[ancestor[u]] != -1:
+                path.append(u)
+                u = ancestor[u]
+            for u in reversed(path):
+                a = ancestor[u]
+                if semi[label[a]] < semi[label[u]]:
+                    label[u] = label[a]
+                ancestor[u] = ancestor[a]
+            return label[v]
+
+        for w in range(n - 1, 0, -1):
+            for pred in self.preds[vertex[w]]:
+                v = num[pred] if 0 <= pred < qty else -1
+                if v == -1:
+                    continue
+                u = evaluate(v)
+                if semi[u] < semi[w]:
+                    semi[w] = semi[u]
+            bucket[semi[w]].append(w)
+            p = parent[w]
+            ancestor[w] = p
+            for v in bucket[p]:
+                u = evaluate(v)
+                idom[v] = u if semi[u] < semi[v] else p
+            bucket[p] = []
+        for w in range(1, n):
+            if idom[w] != semi[w]:
+                idom[w] = idom[idom[w]]
+
+        for w in range(n):
+            idom_blocks[vertex[w]] = vertex[idom[w]]
+        return idom_blocks
+
+    def _number_dom_tree(self) -> Tuple[List[int], List[int]]:
+        children: List[List[int]] = [[] for _ in range(self.qty)]
+        for block in self.rpo[1:]:
+            children[self.idom[block]].append(block)
+        tin = [-1] * self.qty
+        tout = [-1] * self.qty
+        if not self.rpo:
+            return tin, tout
+        counter = 0
+        stack = [(self.rpo[0], False)]
+        while stack:
+            block, done = stack.pop()
+            if done:
+                tout[block] = counter
+                counter += 1
+                continue
+            tin[block] = counter
+            counter += 1
+            stack.append((block, True))
+            for child in children[block]:
+                stack.append((child, False))
+        return tin, tout
+
+    def reachable(self, block: int) -> bool:
+        return self._tin[block] != -1
+
+    def dominates(self, a: int, b: int) -> bool:
+        """
+        a 是否支配 b, 不可达的块不被任何块支配
+        """
+        tin = self._tin
+        return tin[a] != -1 and tin[b] != -1 and tin[a] <= tin[b] and self._tout[b] <= self._tout[a]
+
+
+class DispatcherCandidate:
+    __slots__ = ("header", "mblock_id", "carrier", "compare_blocks", "latch_degree", "score")
+
+    def __init__(self, header: int, mblock_id: int, carrier: int, compare_blocks: List[int], latch_degree: int):
+        self.header = header  # 回边指向的循环头
+        self.mblock_id = mblock_id  # 比较链的第一个块, 作为分发块
+        self.carrier = carrier  # 比较链使用的状态变量(操作数键)
+        self.compare_blocks = compare_blocks
+        self.latch_degree = latch_degree  # 经由回边回到循环头的入度
+        self.score = len(compare_blocks) + latch_degree
+
+    def __repr__(self):
+        return "DispatcherCandidate(mblock_id={0}, carrier={1}, compares={2}, latch_degree={3})".format(
+            self.mblock_id, format_key(self.carrier), len(self.compare_blocks), self.latch_degree)
+
+
+def _compare_carrier(mblock: mblock_t, accept_value: Callable[[int], bool]) -> Optional[int]:
+    """
+    块的最后一条指令是否为 "状态变量 与 高熵常量" 的比较跳转, 是则返回状态变量的操作数键
+    """
+    minsn: minsn_t = mblock.tail
+    if not minsn or minsn.opcode not in JMP_OPCODE_HANDLED or minsn.r.t != mop_n:
+        return None
+    if not accept_value(minsn.r.nnn.value):
+        return None
+    return operand_key(minsn.l)
+
+
+def find_dispatchers(mba: mba_t, accept_value: Callable[[int], bool],
+                     analysis: CfgAnalysis = None) -> List[DispatcherCandidate]:
+    """
+    查找所有分发块, 按结构特征打分后从高到低排序
+
+    候选为回边指向的循环头: 从循环头出发能走到一条比较同一个状态变量的比较链,
+    且比较链上的块都被循环头支配。分数为比较块数量加上回到循环头的入度(回边来自只有
+    goto 的预分发块时, 计入预分发块的入度)。
+
+    Args:
+        mba: 微代码块数组
+        accept_value: 状态值过滤函数, 例如熵值判断
+        analysis: 已经计算好的控制流分析, 为None时重新计算
+    """
+    if analysis is None:
+        analysis = CfgAnalysis(mba)
+    latches: Dict[int, List[int]] = {}
+    for src, header in analysis.back_edges:
+        latches.setdefault(header, []).append(src)
+
+    candidates: Dict[int, DispatcherCandidate] = {}
+    for header, sources in latches.items():
+        block_id = header
+        carrier = None
+        for _ in range(MAX_HEADER_STEPS + 1):
+            carrier = _compare_carrier(mba.get_mblock(block_id), accept_value)
+            if carrier is not None or len(analysis.succs[block_id]) != 1:
+                break
+            block_id = analysis.succs[block_id][0]
+        if carrier is None or block_id in candidates:
+            continue
+
+        compare_blocks = []
+        seen = {block_id}
+        queue = [block_id]
+        while queue:
+            cur = queue.pop()
+            compare_blocks.append(cur)
+            for succ in analysis.succs[cur]:
+                if succ in seen or not analysis.dominates(header, succ):
+                    continue
+                seen.add(succ)
+                if _compare_carrier(mba.get_mblock(succ), accept_value) == carrier:
+                    queue.append(succ)
+        if len(compare_blocks) < MIN_COMPARES:
+            continue
+
+        latch_degree = 0
+        for src in sources:
+            mblock: mblock_t = mba.get_mblock(src)
+            tail: minsn_t = mblock.tail
+            if tail and tail.opcode == m_goto and tail.prev is None:
+                latch_degree += len(analysis.preds[src])
+            else:
+                latch_degree += 1
+        candidates[block_id] = DispatcherCandidate(header, block_id, carrier, sorted(compare_blocks), latch_degree)
+
+    result = sorted(candidates.values(), key=lambda c: (-c.score, c.mblock_id))
+    logger.debug("找到 %d 个分发块: %s", len(result), result)
+    return result
@@ -0,0 +1,129 @@
+import json
+import logging
+from typing import Any, Dict, Optional, TypedDict
+
+import ida_idp
+import ida_netnode
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# 每个函数一个 blob, 只保存覆盖了全局设置的项
+FUNC_CONFIG_NETNODE_NAME = "$ unflat.func_config"
+SETTINGS_TAG = "F"
+
+# 可以按函数覆盖的设置 -> config 中对应的全局设置, None 表示没有全局设置, 使用 _DEFAULTS
+OVERRIDABLE = {
+    "enable_ollvm_unflatten": "enable_ollvm_unflatten",
+    "enable_remove_dead_code": "enable_remove_dead_code",
+    "deflat_level": "deflat_level",
+    "dispatcher_id": None,
+    "storage_carrier": None,
+}
+_DEFAULTS = {
+    "dispatcher_id": 0,  # 0 表示自动查找分发块
+    "storage_carrier": None,  # None 表示使用分发块比较的变量
+}
+
+
+class FuncSettings(TypedDict):
+    enable_ollvm_unflatten: bool
+    enable_remove_dead_code: bool
+    deflat_level: int
+    dispatcher_id: int
+    storage_carrier: Optional[str]
+
+
+class _FuncConfigIdbHooks(ida_idp.IDB_Hooks):
+    """
+    关闭数据库时丢弃内存中的设置, 下一个数据库重新从 IDB 读取
+    """
+    def __init__(self, store: "FuncConfigStore"):
+        ida_idp.IDB_Hooks.__init__(self)
+        self.store = store
+
+    def closebase(self, *args):
+        self.store.close()
+        return 0
+
+
+class FuncConfigStore:
+    """
+    按函数覆盖全局设置, 保存在 IDB 中
+
+    每个函数的覆盖项第一次使用时从 netnode 读取并缓存在以 entry_ea 为键的字典中(没有覆盖时缓存空字典),
+    之后的查找都是 O(1) 的字典查找。没有被覆盖的项每次都从 config 读取, 全局设置的修改立即生效。
+    """
+
+    def __init__(self):
+        self._overrides: Dict[int, Dict[str, Any]] = {}  # 函数入口地址 -> 覆盖的设置
+        self._hooks: Optional[_FuncConfigIdbHooks] = None
+
+    def _node(self) -> ida_netnode.netnode:
+        return ida_netnode.netnode(FUNC_CONFIG_NETNODE_NAME, 0, True)
+
+    def overrides(self, entry_ea: int) -> Dict[str, Any]:
+        """
+        获取函数覆盖的设置, 不要直接修改返回的字典
+        """
+        overrides = self._overrides.get(entry_ea)
+        if overrides is None:
+            if self._hooks is None:
+                self._hooks = _FuncConfigIdbHooks(self)
+                self._hooks.hook()
+            blob = self._node().getblob(entry_ea, SETTINGS_TAG)
+            try:
+                overrides = json.loads(blob) if blob else {}
+            except ValueError:
+                overrides = {}
+            self._overrides[entry_ea] = overrides
+        return overrides
+
+    def resolve(self, entry_ea: int) -> FuncSettings:
+        """
+        获取函数实际使用的设置: 函数覆盖的项优先, 其余使用全局设置
+        """
+        settings = {name: getattr(config, global_name) if global_name else _DEFAULTS[name]
+                    for name, global_name in OVERRIDABLE.items()}
+        settings.update(self.overrides(entry_ea))
+        return settings
+
+    def set(self, entry_ea: int, name: str, value):
+        """
+        覆盖函数的一项设置
+        """
+        if name not in OVERRIDABLE:
+            raise KeyError("不能按函数设置: {0}".format(name))
+        overrides = dict(self.overrides(entry_ea))
+        overrides[name] = value
+        self._write(entry_ea, overrides)
+        logger.info("0x%x 的设置 %s = %r", entry_ea, name, value)
+
+    def unset(self, entry_ea: int, name: Optional[str] = None):
+        """
+        删除函数覆盖的一项设置, name为None时恢复函数的所有设置
+        """
+        if name is None:
+            overrides = {}
+        else:
+            overrides = dict(self.overrides(entry_ea))
+            overrides.pop(name, None)
+        self._write(entry_ea, overrides)
+
+    def _write(self, entry_ea: int, overrides: Dict[str, Any]):
+        node = self._node()
+        if overrides:
+            node.setblob(json.dumps(overrides).encode(), entry_ea, SETTINGS_TAG)
+        else:
+            node.delblob(entry_ea, SETTINGS_TAG)
+        self._overrides[entry_ea] = overrides
+
+    def close(self):
+        if self._hooks is not None:
+            self._hooks.unhook()
+            self._hooks = None
+        self._overrides.clear()
+
+
+func_config = FuncConfigStore()
@@ -0,0 +1,271 @@
+import bisect
+import json
+import logging
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import ida_bytes
+import ida_idaapi
+import ida_idp
+import ida_netnode
+import ida_segment
+import ida_xref
+
+logger = logging.getLogger(__name__)
+
+# 索引保存在 IDB 的 netnode 中, 只有一个 blob
+INDEX_NETNODE_NAME = "$ unflat.global_index"
+INDEX_TAG = "G"
+INDEX_BLOB_INDEX = 0
+INDEX_VERSION = 1
+
+
+def is_bss_segment(seg: ida_segment.segment_t) -> bool:
+    """
+    判断段是否为未初始化数据段(.bss 或 SEG_BSS 类型)
+    """
+    return seg.type == ida_segment.SEG_BSS or ida_segment.get_segm_name(seg) == ".bss"
+
+
+def _has_write_xref(ea: int) -> bool:
+    xb = ida_xref.xrefblk_t()
+    ok = xb.first_to(ea, ida_xref.XREF_DATA)
+    while ok:
+        if xb.type == ida_xref.dr_W:
+            return True
+        ok = xb.next_to()
+    return False
+
+
+def _xref_addresses(start_ea: int, end_ea: int) -> Iterator[int]:
+    """
+    [start_ea, end_ea) 中有引用的地址
+    """
+    ea = start_ea
+    if not ida_bytes.has_xref(ida_bytes.get_flags(ea)):
+        ea = ida_bytes.next_that(ea, end_ea, ida_bytes.has_xref)
+    while ea != ida_idaapi.BADADDR and ea < end_ea:
+        yield ea
+        ea = ida_bytes.next_that(ea, end_ea, ida_bytes.has_xref)
+
+
+def _item_has_write_xref(head: int) -> bool:
+    """
+    数据项中是否有任何地址存在写引用
+    """
+    return any(_has_write_xref(ea) for ea in _xref_addresses(head, ida_bytes.get_item_end(head)))
+
+
+class _IndexIdpHooks(ida_idp.IDP_Hooks):
+    """
+    数据引用的增删同步到索引
+    """
+    def __init__(self, index: "GlobalWriteIndex"):
+        ida_idp.IDP_Hooks.__init__(self)
+        self.index = index
+
+    def ev_add_dref(self, _from, to, type):
+        if type == ida_xref.dr_W:
+            self.index.mark_written(to)
+        return 0
+
+    def ev_del_dref(self, _from, to):
+        self.index.mark_dirty(to)
+        return 0
+
+
+class _IndexIdbHooks(ida_idp.IDB_Hooks):
+    """
+    段变化时让索引失效, 保存或关闭数据库时写回 IDB
+    """
+    def __init__(self, index: "GlobalWriteIndex"):
+        ida_idp.IDB_Hooks.__init__(self)
+        self.index = index
+
+    def _segments_changed(self, *args):
+        self.index.reset()
+        return 0
+
+    segm_added = _segments_changed
+    segm_deleted = _segments_changed
+    segm_start_changed = _segments_changed
+    segm_end_changed = _segments_changed
+    segm_name_changed = _segments_changed
+    segm_moved = _segments_changed
+
+    def savebase(self, *args):
+        self.index.flush()
+        return 0
+
+    def closebase(self, *args):
+        self.index.close()
+        return 0
+
+
+class GlobalWriteIndex:
+    """
+    整个数据库的全局变量写入索引, 供 RemoveDeadCode 判断 .bss 变量是否在任何地方被写入
+
+    - 段缓存: 按起始地址排序的段列表, 加上按地址记忆的分类结果
+    - written: 存在写引用(dr_W)的地址及其所在数据项的起始地址
+
+    第一次使用时扫描所有 .bss 段并保存到 IDB, 之后通过 IDP/IDB 钩子增量更新,
+    段布局变化时重新构建。所有查询都是 O(1) 的集合/字典查找。
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.modified = False
+        self.segments: List[Tuple[int, int, bool]] = []  # (起始地址, 结束地址, 是否为.bss)
+        self._segment_starts: List[int] = []
+        self._bss_cache: Dict[int, bool] = {}  # 地址 -> 是否在.bss段
+        self.written: Set[int] = set()
+        self.dirty: Set[int] = set()  # 删除过写引用、需要重新检查的地址
+        self._idp_hooks: Optional[_IndexIdpHooks] = None
+        self._idb_hooks: Optional[_IndexIdbHooks] = None
+
+    def _node(self) -> ida_netnode.netnode:
+        return ida_netnode.netnode(INDEX_NETNODE_NAME, 0, True)
+
+    def _scan_segments(self) -> List[Tuple[int, int, bool]]:
+        segments = []
+        for i in range(ida_segment.get_segm_qty()):
+            seg = ida_segment.getnseg(i)
+            if seg is not None:
+                segments.append((seg.start_ea, seg.end_ea, is_bss_segment(seg)))
+        segments.sort()
+        return segments
+
+    def _scan_written(self, segments: List[Tuple[int, int, bool]]) -> Set[int]:
+        written = set()
+        for start_ea, end_ea, is_bss in segments:
+            if not is_bss:
+                continue
+            for ea in _xref_addresses(start_ea, end_ea):
+                if _has_write_xref(ea):
+                    written.add(ea)
+                    written.add(ida_bytes.get_item_head(ea))
+        return written
+
+    def _load(self, segments: List[Tuple[int, int, bool]]) -> bool:
+        blob = self._node().getblob(INDEX_BLOB_INDEX, INDEX_TAG)
+        if not blob:
+            return False
+        try:
+            raw = json.loads(blob)
+        except ValueError:
+            return False
+        if raw.get("version") != INDEX_VERSION or [tuple(x) for x in raw.get("segments", [])] != segments:
+            logger.debug("全局写入索引与当前段布局不一致, 重新构建")
+            return False
+        self.written = set(raw["written"])
+        return True
+
+    def ensure(self) -> "GlobalWriteIndex":
+        """
+        保证索引可用: 优先从 IDB 读取, 段布局不一致时重新扫描; 同时安装增量更新的钩子
+        """
+        if self.loaded:
+            return self
+        segments = self._scan_segments()
+        self.segments = segments
+        self._segment_starts = [start_ea for start_ea, _, _ in segments]
+        self._bss_cache.clear()
+        self.dirty.clear()
+        if not self._load(segments):
+            self.written = self._scan_written(segments)
+            self.modified = True
+            logger.info("已构建全局写入索引: %d 个段, %d 个被写入的地址", len(segments), len(self.written))
+        self.loaded = True
+        self._install_hooks()
+        self.flush()
+        return self
+
+    def _install_hooks(self):
+        if self._idp_hooks is None:
+            self._idp_hooks = _IndexIdpHooks(self)
+            self._idp_hooks.hook()
+        if self._idb_hooks is None:
+            self._idb_hooks = _IndexIdbHooks(self)
+            self._idb_hooks.hook()
+
+    def is_bss(self, ea: int) -> bool:
+        """
+        地址是否位于.bss段, 结果按地址缓存
+        """
+        cached = self._bss_cache.get(ea)
+        if cached is not None:
+            return cached
+        index = bisect.bisect_right(self._segment_starts, ea) - 1
+        result = index >= 0 and ea < self.segments[index][1] and self.segments[index][2]
+        self._bss_cache[ea] = result
+        return result
+
+    def is_written(self, ea: int) -> bool:
+        """
+        数据库中是否存在写入该地址(或其所在数据项)的引用
+        """
+        if self.dirty:
+            self._recheck_dirty()
+        if ea in self.written:
+            return True
+        return ida_bytes.get_item_head(ea) in self.written
+
+    def is_never_written_bss(self, ea: int) -> bool:
+        return self.is_bss(ea) and not self.is_written(ea)
+
+    def mark_written(self, ea: int):
+        if not self.loaded or not self.is_bss(ea) or ea in self.written:
+            return
+        self.written.add(ea)
+        self.written.add(ida_bytes.get_item_head(ea))
+        self.modified = True
+
+    def mark_dirty(self, ea: int):
+        if self.loaded and ea in self.written:
+            self.dirty.add(ea)
+
+    def _recheck_dirty(self):
+        # 数据项的起始地址代表整个数据项, 只有数据项中不再有任何写引用时才删除
+        for ea in self.dirty:
+            if _has_write_xref(ea):
+                continue
+            head = ida_bytes.get_item_head(ea)
+            if head != ea:
+                self.written.discard(ea)
+            if head in self.written and not _item_has_write_xref(head):
+                self.written.discard(head)
+            self.modified = True
+        self.dirty.clear()
+
+    def flush(self):
+        """
+        索引有修改时写回 IDB
+        """
+        if not self.loaded or not self.modified:
+            return
+        if self.dirty:
+            self._recheck_dirty()
+        raw = {"version": INDEX_VERSION, "segments": self.segments, "written": sorted(self.written)}
+        self._node().setblob(json.dumps(raw).encode(), INDEX_BLOB_INDEX, INDEX_TAG)
+        self.modified = False
+
+    def reset(self):
+        """
+        丢弃内存中的索引, 下次使用时重新构建
+        """
+        if self.loaded:
+            self.loaded = False
+            self.modified = False
+            self._node().delblob(INDEX_BLOB_INDEX, INDEX_TAG)
+
+    def close(self):
+        self.flush()
+        for hooks in (self._idp_hooks, self._idb_hooks):
+            if hooks is not None:
+                hooks.unhook()
+        self._idp_hooks = None
+        self._idb_hooks = None
+        self.loaded = False
+
+
+global_index = GlobalWriteIndex()
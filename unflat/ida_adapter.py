@@ -0,0 +1,88 @@
+"""
+ida_hexrays 对象与 mcmodel 之间的转换
+
+- mba_from_ida: 把 IDA 的 mba 转成纯 Python 模型(包括 VALRANGES), 可以保存下来在 IDA 外用 deflat_model 处理
+- apply_redirections: 把在模型上得到的跳转修改重放到 IDA 的 mba 上
+"""
+import ida_hexrays
+
+from . import mcmodel
+from .unflattener import Unflattener
+from .valranges import ValrangesParser
+
+
+class _ValrangesCollector(ida_hexrays.vd_printer_t):
+    def __init__(self, model: mcmodel.mba_t):
+        ida_hexrays.vd_printer_t.__init__(self)
+        blocks = model.blocks
+        self.feed = ValrangesParser(lambda mblock_id, name, value: blocks[mblock_id].valranges.append((name, value))).feed
+
+    def _print(self, indent, line):
+        self.feed(line)
+        return 1
+
+
+def mop_from_ida(op: ida_hexrays.mop_t) -> mcmodel.mop_t:
+    model_op = mcmodel.mop_t()
+    t = op.t
+    if t == ida_hexrays.mop_z:
+        return model_op
+    if t == ida_hexrays.mop_r:
+        model_op.make_reg(op.r, op.size)
+        mcmodel.MREG_NAMES.setdefault((op.r, op.size), ida_hexrays.get_mreg_name(op.r, op.size))
+    elif t == ida_hexrays.mop_n:
+        model_op.make_number(op.nnn.value, op.size)
+    elif t == ida_hexrays.mop_S:
+        model_op.make_stkvar(op.s.off, op.size)
+    elif t == ida_hexrays.mop_b:
+        model_op.make_blkref(op.b)
+    elif t == ida_hexrays.mop_v:
+        model_op.make_gvar(op.g, op.size)
+    elif t == ida_hexrays.mop_d:
+        model_op.make_insn(minsn_from_ida(op.d), op.size)
+    else:
+        model_op.t, model_op.size, model_op.text = t, op.size, op.dstr()
+    return model_op
+
+
+def minsn_from_ida(minsn: ida_hexrays.minsn_t) -> mcmodel.minsn_t:
+    model_insn = mcmodel.minsn_t(minsn.ea)
+    model_insn.opcode = minsn.opcode
+    model_insn.l = mop_from_ida(minsn.l)
+    model_insn.r = mop_from_ida(minsn.r)
+    model_insn.d = mop_from_ida(minsn.d)
+    return model_insn
+
+
+def mba_from_ida(mba: ida_hexrays.mba_t, with_valranges: bool = True) -> mcmodel.mba_t:
+    """
+    把 IDA 的 mba 转成模型
+
+    Args:
+        mba: IDA 的 mba
+        with_valranges: 是否打印 mba 收集 VALRANGES
+    """
+    model = mcmodel.mba_t(mba.entry_ea, mba.maturity)
+    for i in range(mba.qty):
+        mblock: ida_hexrays.mblock_t = mba.get_mblock(i)
+        model_block = model.add_block(mblock.start, mblock.end)
+        model_block.type = mblock.type
+        model_block.flags = mblock.flags
+        model_block.succset.extend(mblock.succset)
+        model_block.predset.extend(mblock.predset)
+        minsn = mblock.head
+        while minsn:
+            model_block.append(minsn_from_ida(minsn))
+            minsn = minsn.next
+    if with_valranges:
+        mba._print(_ValrangesCollector(model))
+    return model
+
+
+def apply_redirections(mba: ida_hexrays.mba_t, dispatcher_id: int, storage_carrier, redirections, splits=None) -> Unflattener:
+    """
+    把模型上 Unflattener 得到的跳转修改和块拆分应用到 IDA 的 mba
+    """
+    unflat = Unflattener(mba)
+    unflat.replay(dispatcher_id, storage_carrier, dict(redirections), splits)
+    return unflat
@@ -1,7 +1,13 @@
+import atexit
 import logging
+import logging.handlers
 import os
 import datetime
-from typing import Optional
+import queue
+from typing import List, Optional
+
+from . import config
+from . import trace
 
 # 日志目录（使用当前脚本所在目录）
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -10,58 +16,123 @@ LOG_DIR = os.path.join(CURRENT_DIR, "log")
 # 日志级别
 LOG_LEVEL = logging.INFO
 
+# 输出窗口只显示警告以上的日志, 其他日志只写入文件
+CONSOLE_LEVEL = logging.WARNING
+
 # 日志格式
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
-# 全局日志配置标志
-_logging_configured = False
+# 插件所有模块共用的父日志记录器, 只在它上面挂处理器, 不修改 root
+PACKAGE_LOGGER_NAME = __name__.rpartition(".")[0] or "unflat"
+
+
+def _package_logger() -> logging.Logger:
+    return logging.getLogger(PACKAGE_LOGGER_NAME)
 
 
-def setup_logging(log_dir: str = LOG_DIR, 
+def is_logging_configured() -> bool:
+    # 状态保存在日志记录器上而不是模块变量中, 热重载本模块后依然有效
+    return getattr(_package_logger(), "_unflat_listener", None) is not None
+
+
+def shutdown_logging():
+    """
+    停止后台写日志的线程(会先写完队列中的记录), 并移除插件添加的处理器
+    """
+    logger = _package_logger()
+    listener = getattr(logger, "_unflat_listener", None)
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        logger._unflat_listener = None
+    for handler in list(logger.handlers):
+        if getattr(handler, "_unflat_handler", False):
+            logger.removeHandler(handler)
+            handler.close()
+
+
+def setup_logging(log_dir: str = LOG_DIR,
                  log_level: int = LOG_LEVEL,
                  log_format: str = LOG_FORMAT,
-                 force: bool = True) -> bool:
+                 force: bool = False,
+                 trace_mode: Optional[bool] = None,
+                 trace_edges: Optional[bool] = None) -> bool:
     """
-    配置全局日志系统
-    
+    配置插件的日志系统, 需要显式调用, 导入模块时不会产生任何副作用
+
+    调用线程只把未格式化的记录放入队列, 由 QueueListener 的后台线程格式化并写文件;
+    输出窗口只同步显示警告以上的日志。
+
     Args:
         log_dir: 日志文件目录
-        log_level: 日志级别
+        log_level: 写入文件的日志级别
         log_format: 日志格式
-        force: 是否强制重新配置
-        
+        force: 已经配置过时是否重新配置(会新建日志文件)
+        trace_mode: 是否开启跟踪模式(记录DEBUG日志到每个函数的环形缓冲区), None表示使用config.enable_trace
+        trace_edges: 是否把边修改事件写入 JSON lines 文件, None表示使用config.enable_trace_edges
+
     Returns:
         配置是否成功
     """
-    global _logging_configured
-    
-    if _logging_configured and not force:
+    if is_logging_configured() and not force:
         return True
-    
+    shutdown_logging()
+    if trace_mode is None:
+        trace_mode = config.enable_trace
+    if trace_edges is None:
+        trace_edges = config.enable_trace_edges
+
+    logger = _package_logger()
     try:
         # 确保日志目录存在
         os.makedirs(log_dir, exist_ok=True)
-        
+
         # 获取当前时间用于日志文件名
         current_time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_filename = f"unflattener_{current_time}.log"
-        log_file_path = os.path.join(log_dir, log_filename)
-        
-        # 配置日志
-        logging.basicConfig(
-            level=log_level,
-            format=log_format,
-            handlers=[
-                logging.FileHandler(log_file_path, encoding='utf-8'),
-                logging.StreamHandler()
-            ],
-            force=force
-        )
-        
-        _logging_configured = True
+        log_file_path = os.path.join(log_dir, f"unflattener_{current_time}.log")
+
+        file_handler = logging.FileHandler(log_file_path, encoding='utf-8', delay=True)
+        file_handler.setLevel(log_level)
+        file_handler.setFormatter(logging.Formatter(log_format))
+        file_handler.addFilter(trace.is_text_record)
+        writers: List[logging.Handler] = [file_handler]
+        if trace_edges:
+            edge_handler = logging.FileHandler(os.path.join(log_dir, f"edges_{current_time}.jsonl"),
+                                               encoding='utf-8', delay=True)
+            edge_handler.setFormatter(trace.JsonLinesFormatter())
+            edge_handler.addFilter(trace.is_edge_record)
+            writers.append(edge_handler)
+
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, *writers, respect_handler_level=True)
+        queue_handler = trace.LazyQueueHandler(log_queue)
+        queue_handler.addFilter(trace.FunctionContextFilter())
+
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(CONSOLE_LEVEL)
+        console_handler.setFormatter(logging.Formatter(log_format))
+
+        handlers: List[logging.Handler] = [queue_handler, console_handler]
+        if trace_mode:
+            ring_handler = trace.RingBufferHandler()
+            ring_handler.setFormatter(logging.Formatter(log_format))
+            handlers.append(ring_handler)
+        for handler in handlers:
+            handler._unflat_handler = True
+            logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG if trace_mode else log_level)
+        logger.propagate = False
+        trace.edge_logger.setLevel(logging.DEBUG if trace_edges else logging.INFO)
+
+        listener.start()
+        logger._unflat_listener = listener
+        if not getattr(logger, "_unflat_atexit", False):
+            atexit.register(shutdown_logging)
+            logger._unflat_atexit = True
         print(f"日志配置完成，日志文件路径: {log_file_path}")
         return True
-        
+
     except Exception as e:
         print(f"日志配置失败: {e}")
         return False
@@ -69,20 +140,19 @@ def setup_logging(log_dir: str = LOG_DIR,
 
 def get_logger(name: Optional[str] = None) -> logging.Logger:
     """
-    获取日志记录器
-    
+    获取日志记录器, 不会触发日志配置
+
     Args:
         name: 日志记录器名称，通常使用 __name__
-        
+
     Returns:
         日志记录器实例
     """
-    # 确保日志已配置
-    if not _logging_configured:
-        setup_logging()
-    
     return logging.getLogger(name)
 
 
-# 初始化日志配置
-setup_logging()
\ No newline at end of file
+def dump_function_trace(entry_ea: int, path: Optional[str] = None) -> List[str]:
+    """
+    获取跟踪模式下指定函数最近的日志, 传入path时同时写入文件
+    """
+    return trace.dump_function(_package_logger(), entry_ea, path)
@@ -0,0 +1,9 @@
+"""
+microcode 接口: 在 IDA 中使用 ida_hexrays, 在 IDA 外使用 mcmodel 中的纯 Python 模型
+"""
+try:
+    from ida_hexrays import *
+    HAVE_IDA = True
+except ImportError:
+    from .mcmodel import *
+    HAVE_IDA = False
@@ -0,0 +1,476 @@
+"""
+不依赖 IDA 的 microcode 模型
+
+提供 Unflattener 和 cfgUtil 用到的 ida_hexrays 接口子集(块、指令、操作数、前驱/后继集合),
+名字和用法与 ida_hexrays 相同。Unflattener 和 cfgUtil 通过 mcapi 在导入时绑定后端: 在 IDA 中是 ida_hexrays,
+在 IDA 外才是这个模型, 所以只能在 IDA 外的 Python 进程(基准测试、回归语料或其中的进程池)中在模型上运行引擎。
+所有对象都使用 __slots__, 整个 mba 可以转成 dict(to_dict/from_dict) 或 pickle 后传给这样的进程。
+
+在 IDA 中运行时常量直接取自 ida_hexrays, 与 ida_adapter 转换出的模型保持一致;
+在 IDA 外使用 IDA 9 的取值。
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_OPCODE_NAMES = (
+    "m_nop", "m_stx", "m_ldx", "m_ldc", "m_mov", "m_neg", "m_lnot", "m_bnot", "m_xds", "m_xdu",
+    "m_low", "m_high", "m_add", "m_sub", "m_mul", "m_udiv", "m_sdiv", "m_umod", "m_smod", "m_or",
+    "m_and", "m_xor", "m_shl", "m_shr", "m_sar", "m_cfadd", "m_ofadd", "m_cfshl", "m_cfshr", "m_sets",
+    "m_seto", "m_setp", "m_setnz", "m_setz", "m_setae", "m_setb", "m_seta", "m_setbe", "m_setg", "m_setge",
+    "m_setl", "m_setle", "m_jcnd", "m_jnz", "m_jz", "m_jae", "m_jb", "m_ja", "m_jbe", "m_jg",
+    "m_jge", "m_jl", "m_jle", "m_jtbl", "m_ijmp", "m_goto", "m_call", "m_icall", "m_ret", "m_push",
+    "m_pop", "m_und", "m_ext", "m_f2i", "m_f2u", "m_i2f", "m_u2f", "m_f2f", "m_fneg", "m_fadd",
+    "m_fsub", "m_fmul", "m_fdiv",
+)
+_MOP_NAMES = (
+    "mop_z", "mop_r", "mop_n", "mop_str", "mop_d", "mop_S", "mop_v", "mop_b", "mop_f", "mop_l",
+    "mop_a", "mop_h", "mop_c", "mop_fn", "mop_p", "mop_sc",
+)
+_BLT_NAMES = ("BLT_NONE", "BLT_STOP", "BLT_0WAY", "BLT_1WAY", "BLT_2WAY", "BLT_NWAY", "BLT_XTRN")
+_MBL_FLAGS = {
+    "MBL_PRIV": 0x0001, "MBL_FAKE": 0x0002, "MBL_GOTO": 0x0004, "MBL_TCAL": 0x0008,
+    "MBL_PUSH": 0x0010, "MBL_DMT64": 0x0020, "MBL_COMB": 0x0040, "MBL_PROP": 0x0080,
+    "MBL_DEAD": 0x0100, "MBL_LIST": 0x0200, "MBL_INBOUNDS": 0x0400,
+}
+_MBA_FLAGS = {"MBA_SHORT": 0x00200000, "MBA_NUMADDR": 0x08000000, "MBA_VALNUM": 0x10000000}
+_MATURITY_NAMES = (
+    "MMAT_ZERO", "MMAT_GENERATED", "MMAT_PREOPTIMIZED", "MMAT_LOCOPT", "MMAT_CALLS",
+    "MMAT_GLBOPT1", "MMAT_GLBOPT2", "MMAT_GLBOPT3", "MMAT_LVARS",
+)
+
+try:
+    import ida_hexrays as _ida
+except ImportError:
+    _ida = None
+
+
+def _define_constants():
+    values = {}
+    for table in (_OPCODE_NAMES, _MOP_NAMES, _BLT_NAMES, _MATURITY_NAMES):
+        for index, name in enumerate(table):
+            values[name] = index
+    values.update(_MBL_FLAGS)
+    values.update(_MBA_FLAGS)
+    if _ida is not None:
+        for name in values:
+            if hasattr(_ida, name):
+                values[name] = getattr(_ida, name)
+    globals().update(values)
+    return values
+
+
+_CONSTANTS = _define_constants()
+OPCODE_BY_NAME: Dict[str, int] = {name: _CONSTANTS[name] for name in _OPCODE_NAMES}
+OPCODE_NAMES: Dict[int, str] = {value: name for name, value in OPCODE_BY_NAME.items()}
+
+# 寄存器编号和大小 -> 名字, 由 ida_adapter 或 from_dict 填充
+MREG_NAMES: Dict[Tuple[int, int], str] = {}
+
+
+def get_mreg_name(reg: int, size: int) -> str:
+    name = MREG_NAMES.get((reg, size))
+    if name is None:
+        name = MREG_NAMES.get((reg, 0), "mreg{0}".format(reg))
+    return name
+
+
+class mnumber_t:
+    __slots__ = ("value",)
+
+    def __init__(self, value: int = 0):
+        self.value = value
+
+
+class stkvar_ref_t:
+    __slots__ = ("off",)
+
+    def __init__(self, off: int = 0):
+        self.off = off
+
+
+class mop_t:
+    """
+    操作数, 只保存与类型对应的字段; 不认识的类型保留原始文本用于打印
+    """
+    __slots__ = ("t", "size", "r", "nnn", "s", "b", "g", "d", "text")
+
+    def __init__(self, t=0, size: int = -1):
+        if isinstance(t, mop_t):
+            # 与 IDA 的 mop_t(const mop_t &) 一样复制操作数, 嵌套的指令共享
+            for name in mop_t.__slots__:
+                setattr(self, name, getattr(t, name))
+            return
+        self.t = t
+        self.size = size
+        self.r = 0
+        self.nnn: Optional[mnumber_t] = None
+        self.s: Optional[stkvar_ref_t] = None
+        self.b = 0
+        self.g = 0
+        self.d: Optional["minsn_t"] = None
+        self.text: Optional[str] = None
+
+    def make_reg(self, reg: int, size: int):
+        self.t, self.size, self.r = mop_r, size, reg
+
+    def make_number(self, value: int, size: int):
+        self.t, self.size, self.nnn = mop_n, size, mnumber_t(value)
+
+    def make_stkvar(self, off: int, size: int):
+        self.t, self.size, self.s = mop_S, size, stkvar_ref_t(off)
+
+    def make_blkref(self, serial: int):
+        self.t, self.size, self.b = mop_b, -1, serial
+
+    def make_gvar(self, ea: int, size: int):
+        self.t, self.size, self.g = mop_v, size, ea
+
+    def make_insn(self, insn: "minsn_t", size: int):
+        self.t, self.size, self.d = mop_d, size, insn
+
+    def dstr(self) -> str:
+        t = self.t
+        if t == mop_z:
+            return ""
+        if t == mop_r:
+            return "{0}.{1}".format(get_mreg_name(self.r, self.size), self.size)
+        if t == mop_n:
+            return "#0x{0:X}.{1}".format(self.nnn.value, self.size)
+        if t == mop_S:
+            return "%0x{0:X}.{1}".format(self.s.off, self.size)
+        if t == mop_b:
+            return "@{0}".format(self.b)
+        if t == mop_v:
+            return "$0x{0:X}.{1}".format(self.g, self.size)
+        if t == mop_d:
+            return "({0}).{1}".format(self.d.dstr(), self.size)
+        return self.text or "?"
+
+
+class minsn_t:
+    """
+    指令, 与 IDA 一样通过 prev/next 组成块内的双向链表
+    """
+    __slots__ = ("opcode", "ea", "l", "r", "d", "prev", "next")
+
+    def __init__(self, ea: int = 0):
+        self.opcode = m_nop
+        self.ea = ea
+        self.l = mop_t()
+        self.r = mop_t()
+        self.d = mop_t()
+        self.prev: Optional[minsn_t] = None
+        self.next: Optional[minsn_t] = None
+
+    def dstr(self) -> str:
+        ops = [op.dstr() for op in (self.l, self.r, self.d) if op.t != mop_z]
+        return "{0:<6} {1}".format(OPCODE_NAMES.get(self.opcode, str(self.opcode))[2:], ", ".join(ops))
+
+
+class mblock_set_t(list):
+    """
+    前驱/后继集合, 提供 intvec_t 的 push_back
+    """
+    __slots__ = ()
+
+    def push_back(self, value: int):
+        self.append(value)
+
+
+class mblock_t:
+    __slots__ = ("mba", "serial", "type", "flags", "start", "end", "head", "tail",
+                 "succset", "predset", "valranges")
+
+    def __init__(self, mba: "mba_t", serial: int, start: int = 0, end: int = 0):
+        self.mba = mba
+        self.serial = serial
+        self.type = BLT_NONE
+        self.flags = 0
+        self.start = start
+        self.end = end
+        self.head: Optional[minsn_t] = None
+        self.tail: Optional[minsn_t] = None
+        self.succset = mblock_set_t()
+        self.predset = mblock_set_t()
+        # (名字, 值) 列表, 打印时作为 VALRANGES 输出
+        self.valranges: List[Tuple[str, int]] = []
+
+    def npred(self) -> int:
+        return len(self.predset)
+
+    def nsucc(self) -> int:
+        return len(self.succset)
+
+    def pred(self, n: int) -> int:
+        return self.predset[n]
+
+    def succ(self, n: int) -> int:
+        return self.succset[n]
+
+    def insns(self) -> Iterator[minsn_t]:
+        minsn = self.head
+        while minsn:
+            yield minsn
+            minsn = minsn.next
+
+    def insert_into_block(self, nm: minsn_t, om: Optional[minsn_t]) -> minsn_t:
+        """
+        把 nm 插入到 om 之后, om 为 None 时插入到块首
+        """
+        if om is None:
+            nm.prev, nm.next = None, self.head
+            if self.head:
+                self.head.prev = nm
+            self.head = nm
+        else:
+            nm.prev, nm.next = om, om.next
+            if om.next:
+                om.next.prev = nm
+            om.next = nm
+        if nm.next is None:
+            self.tail = nm
+        return nm
+
+    def append(self, nm: minsn_t) -> minsn_t:
+        return self.insert_into_block(nm, self.tail)
+
+    def make_lists_ready(self):
+        pass
+
+    def mark_lists_dirty(self):
+        pass
+
+    def optimize_insn(self, minsn: minsn_t) -> int:
+        return 0
+
+    def optimize_block(self) -> int:
+        return 0
+
+
+class minsn_visitor_t:
+    def __init__(self):
+        self.mba: Optional[mba_t] = None
+        self.blk: Optional[mblock_t] = None
+        self.curins: Optional[minsn_t] = None
+
+    def visit_minsn(self) -> int:
+        return 0
+
+
+class vd_printer_t:
+    def __init__(self):
+        pass
+
+    def _print(self, indent: int, line: str) -> int:
+        return 0
+
+
+def _shift_serial(serial: int, start: int) -> int:
+    return serial + 1 if serial >= start else serial
+
+
+class mba_t:
+    __slots__ = ("blocks", "entry_ea", "maturity", "flags", "_fict_ea", "__weakref__")
+
+    def __init__(self, entry_ea: int = 0, maturity: int = 0):
+        self.blocks: List[mblock_t] = []
+        self.entry_ea = entry_ea
+        self.maturity = maturity
+        self.flags = 0
+        self._fict_ea = 0xFF00000000000000
+
+    @property
+    def qty(self) -> int:
+        return len(self.blocks)
+
+    def get_mblock(self, n: int) -> mblock_t:
+        return self.blocks[n]
+
+    def add_block(self, start: int = 0, end: int = 0) -> mblock_t:
+        mblock = mblock_t(self, len(self.blocks), start, end)
+        self.blocks.append(mblock)
+        return mblock
+
+    def insert_block(self, bblk: int) -> mblock_t:
+        """
+        在 bblk 处插入新块, 之后的块序号、前驱/后继集合以及跳转目标都会加一
+
+        前驱/后继集合只有 bblk 之后的块和它们的前驱/后继会引用变化的序号, 只更新这些块;
+        跳转目标可能在未提交的边修改中与集合不一致, 所以检查所有块的尾指令
+        """
+        blocks = self.blocks
+        moved = blocks[bblk:]
+        affected = {id(mblock): mblock for mblock in moved}
+        for mblock in moved:
+            for serial in mblock.predset:
+                affected.setdefault(id(blocks[serial]), blocks[serial])
+            for serial in mblock.succset:
+                affected.setdefault(id(blocks[serial]), blocks[serial])
+        for mblock in moved:
+            mblock.serial += 1
+        for mblock in affected.values():
+            mblock.succset[:] = [_shift_serial(x, bblk) for x in mblock.succset]
+            mblock.predset[:] = [_shift_serial(x, bblk) for x in mblock.predset]
+        for mblock in blocks:
+            tail = mblock.tail
+            if tail is None:
+                continue
+            for op in (tail.l, tail.d):
+                if op.t == mop_b and op.b >= bblk:
+                    op.b += 1
+        mblock = mblock_t(self, bblk)
+        self.blocks.insert(bblk, mblock)
+        return mblock
+
+    def alloc_fict_ea(self, real_ea: int) -> int:
+        self._fict_ea += 1
+        return self._fict_ea
+
+    def get_mba_flags(self) -> int:
+        return self.flags
+
+    def set_mba_flags(self, f: int):
+        self.flags |= f
+
+    def clr_mba_flags(self, f: int):
+        self.flags &= ~f
+
+    def mark_chains_dirty(self):
+        pass
+
+    def for_all_topinsns(self, mv: minsn_visitor_t) -> int:
+        mv.mba = self
+        for mblock in self.blocks:
+            mv.blk = mblock
+            minsn = mblock.head
+            while minsn:
+                mv.curins = minsn
+                code = mv.visit_minsn()
+                if code:
+                    return code
+                minsn = minsn.next
+        return 0
+
+    def _print(self, vp: vd_printer_t):
+        """
+        按 mba._print 的格式输出块头、VALRANGES 和指令
+        """
+        for mblock in self.blocks:
+            serial = mblock.serial
+            vp._print(0, "{0}. 0 ; {1}-BLOCK {0} INBOUNDS: {2} OUTBOUNDS: {3} [START={4:X} END={5:X}]".format(
+                serial, _BLT_NAMES[mblock.type][4:] if 0 <= mblock.type < len(_BLT_NAMES) else mblock.type,
+                " ".join(str(x) for x in mblock.predset), " ".join(str(x) for x in mblock.succset),
+                mblock.start, mblock.end))
+            if mblock.valranges:
+                vp._print(0, "{0}. 0 ; VALRANGES: {1}".format(
+                    serial, ", ".join("{0}:==0x{1:X}".format(name, value) for name, value in mblock.valranges)))
+            for index, minsn in enumerate(mblock.insns()):
+                vp._print(0, "{0}.{1:>2} {2}".format(serial, index, minsn.dstr()))
+
+    def __reduce__(self):
+        return (mba_from_dict, (mba_to_dict(self),))
+
+
+mbl_array_t = mba_t
+
+
+# ---- 序列化: 操作数编码为短列表, 操作码使用名字以兼容不同版本的 IDA ----
+
+def _mop_to_obj(op: mop_t):
+    t = op.t
+    if t == mop_z:
+        return None
+    if t == mop_r:
+        return ["r", op.r, op.size]
+    if t == mop_n:
+        return ["n", op.nnn.value, op.size]
+    if t == mop_S:
+        return ["S", op.s.off, op.size]
+    if t == mop_b:
+        return ["b", op.b]
+    if t == mop_v:
+        return ["v", op.g, op.size]
+    if t == mop_d:
+        return ["d", _minsn_to_obj(op.d), op.size]
+    return ["?", t, op.size, op.text]
+
+
+def _mop_from_obj(obj) -> mop_t:
+    op = mop_t()
+    if obj is None:
+        return op
+    kind = obj[0]
+    if kind == "r":
+        op.make_reg(obj[1], obj[2])
+    elif kind == "n":
+        op.make_number(obj[1], obj[2])
+    elif kind == "S":
+        op.make_stkvar(obj[1], obj[2])
+    elif kind == "b":
+        op.make_blkref(obj[1])
+    elif kind == "v":
+        op.make_gvar(obj[1], obj[2])
+    elif kind == "d":
+        op.make_insn(_minsn_from_obj(obj[1]), obj[2])
+    else:
+        op.t, op.size, op.text = obj[1], obj[2], obj[3]
+    return op
+
+
+def _minsn_to_obj(minsn: minsn_t) -> list:
+    return [OPCODE_NAMES.get(minsn.opcode, minsn.opcode), minsn.ea,
+            _mop_to_obj(minsn.l), _mop_to_obj(minsn.r), _mop_to_obj(minsn.d)]
+
+
+def _minsn_from_obj(obj: list) -> minsn_t:
+    minsn = minsn_t(obj[1])
+    opcode = obj[0]
+    minsn.opcode = OPCODE_BY_NAME[opcode] if isinstance(opcode, str) else opcode
+    minsn.l = _mop_from_obj(obj[2])
+    minsn.r = _mop_from_obj(obj[3])
+    minsn.d = _mop_from_obj(obj[4])
+    return minsn
+
+
+def mba_to_dict(mba: mba_t) -> dict:
+    mregs = set()
+    blocks = []
+    for mblock in mba.blocks:
+        insns = []
+        for minsn in mblock.insns():
+            insns.append(_minsn_to_obj(minsn))
+            for op in (minsn.l, minsn.r, minsn.d):
+                if op.t == mop_r:
+                    mregs.add((op.r, op.size))
+        blocks.append({
+            "serial": mblock.serial,
+            "type": mblock.type,
+            "flags": mblock.flags,
+            "start": mblock.start,
+            "end": mblock.end,
+            "succ": list(mblock.succset),
+            "pred": list(mblock.predset),
+            "valranges": [list(v) for v in mblock.valranges],
+            "insns": insns,
+        })
+    return {
+        "entry_ea": mba.entry_ea,
+        "maturity": mba.maturity,
+        "mregs": [[r, size, get_mreg_name(r, size)] for r, size in sorted(mregs)],
+        "blocks": blocks,
+    }
+
+
+def mba_from_dict(data: dict) -> mba_t:
+    for r, size, name in data.get("mregs", ()):
+        MREG_NAMES[(r, size)] = name
+    mba = mba_t(data.get("entry_ea", 0), data.get("maturity", 0))
+    for obj in data["blocks"]:
+        mblock = mba.add_block(obj.get("start", 0), obj.get("end", 0))
+        mblock.type = obj.get("type", BLT_NONE)
+        mblock.flags = obj.get("flags", 0)
+        mblock.succset.extend(obj.get("succ", ()))
+        mblock.predset.extend(obj.get("pred", ()))
+        mblock.valranges = [(name, value) for name, value in obj.get("valranges", ())]
+        for insn in obj.get("insns", ()):
+            mblock.append(_minsn_from_obj(insn))
+    return mba
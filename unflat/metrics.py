@@ -0,0 +1,124 @@
+"""
+按函数汇总反混淆的统计, 供统计窗口显示和导出 CSV
+
+数据来源有两种, 字段相同:
+- 当前会话: HexraysDecompilationHook.func_results, 由 Unflattener、RemoveDeadCode 和 DeflatStats 的计数得到
+- 批量处理的报告: batch.py 输出的 JSON
+"""
+import csv
+from typing import Callable, Dict, Iterable, List, Optional, TypedDict
+
+
+class MetricsRow(TypedDict):
+    ea: int
+    name: str
+    level: Optional[int]
+    dispatcher_id: Optional[int]
+    patches: int  # change_jmp_target 实际修改的边数
+    blacklisted: int
+    replaced: int
+    cached: bool
+    time: float  # 秒
+    slowest_phase: str  # 耗时最多的阶段, 没有统计时为空
+    slowest_time: float
+
+
+# (字段, 标题), 统计窗口和 CSV 使用相同的列
+COLUMNS = (
+    ("ea", "地址"),
+    ("name", "函数"),
+    ("time", "耗时(ms)"),
+    ("patches", "修改的边"),
+    ("blacklisted", "黑名单块"),
+    ("replaced", "替换的全局变量"),
+    ("level", "级别"),
+    ("dispatcher_id", "分发块"),
+    ("cached", "缓存"),
+    ("slowest_phase", "最慢阶段"),
+    ("slowest_time", "最慢阶段耗时(ms)"),
+)
+
+
+def _slowest_phase(stats: Optional[dict]):
+    timings = (stats or {}).get("timings") or {}
+    if not timings:
+        return "", 0.0
+    return max(timings.items(), key=lambda x: x[1])
+
+
+def _counter(result: dict, name: str) -> int:
+    if name in result:
+        return result[name]
+    return ((result.get("stats") or {}).get("counters") or {}).get(name, 0)
+
+
+def make_row(ea: int, name: str, result: dict, total_time: Optional[float] = None) -> MetricsRow:
+    phase, phase_time = _slowest_phase(result.get("stats"))
+    return {
+        "ea": ea,
+        "name": name,
+        "level": result.get("level"),
+        "dispatcher_id": result.get("dispatcher_id"),
+        "patches": result.get("patches", 0),
+        "blacklisted": _counter(result, "blacklisted"),
+        "replaced": result.get("replaced", 0),
+        "cached": bool(result.get("cached", False)),
+        "time": result.get("time", 0.0) if total_time is None else total_time,
+        "slowest_phase": phase,
+        "slowest_time": phase_time,
+    }
+
+
+def rows_from_results(func_results: Dict[int, dict], get_name: Callable[[int], str]) -> List[MetricsRow]:
+    """
+    从 HexraysDecompilationHook.func_results 生成每个函数的一行
+    """
+    return sort_by_cost([make_row(ea, get_name(ea), result) for ea, result in func_results.items()])
+
+
+def rows_from_report(report: dict) -> List[MetricsRow]:
+    """
+    从批量处理的报告生成每个函数的一行, 只包含经过反混淆的函数, 耗时使用反混淆本身的耗时
+    """
+    rows = []
+    for func in report.get("functions", []):
+        if func.get("level") is None:
+            continue
+        rows.append(make_row(func["ea"], func.get("name", ""), func, func.get("deflat_time", func.get("time", 0.0))))
+    return sort_by_cost(rows)
+
+
+def sort_by_cost(rows: List[MetricsRow], key: str = "time") -> List[MetricsRow]:
+    """
+    按某一列从大到小排序, 默认按耗时
+    """
+    return sorted(rows, key=lambda row: (row[key] is not None, row[key] or 0), reverse=True)
+
+
+def format_value(field: str, value) -> str:
+    if value is None:
+        return ""
+    if field == "ea":
+        return "0x{0:x}".format(value)
+    if field in ("time", "slowest_time"):
+        return "{0:.2f}".format(value * 1000)
+    if field == "cached":
+        return "是" if value else ""
+    return str(value)
+
+
+def write_csv(rows: Iterable[MetricsRow], path: str) -> int:
+    """
+    Returns:
+        写入的行数
+    """
+    nb_rows = 0
+    # utf-8-sig 让 Excel 正确识别中文标题
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([field + "_ms" if field in ("time", "slowest_time") else field for field, _ in COLUMNS])
+        for row in rows:
+            writer.writerow([format_value(field, row[field]) if field != "cached" else int(row[field])
+                             for field, _ in COLUMNS])
+            nb_rows += 1
+    return nb_rows
@@ -0,0 +1,98 @@
+"""
+反混淆统计窗口: 每个处理过的函数一行, 默认按耗时从大到小排列, 双击跳转到函数
+"""
+import logging
+from typing import Callable, Dict, List, Optional
+
+import ida_kernwin
+
+from .metrics import COLUMNS, MetricsRow, format_value, write_csv
+
+logger = logging.getLogger(__name__)
+
+_NUMERIC = ("time", "patches", "blacklisted", "replaced", "level", "dispatcher_id", "slowest_time")
+
+
+def _column_spec(field: str, title: str) -> list:
+    if field == "ea":
+        return [title, 12 | ida_kernwin.Choose.CHCOL_HEX]
+    if field == "name":
+        return [title, 32 | ida_kernwin.Choose.CHCOL_FNAME]
+    if field in _NUMERIC:
+        # 数字列按数值排序
+        return [title, 8 | ida_kernwin.Choose.CHCOL_DEC]
+    return [title, 10 | ida_kernwin.Choose.CHCOL_PLAIN]
+
+
+class DeflatMetricsChooser(ida_kernwin.Choose):
+    """
+    Args:
+        source: 刷新时重新生成所有行, 为None时(例如批量报告)行不变
+    """
+
+    def __init__(self, title: str, rows: List[MetricsRow], source: Optional[Callable[[], List[MetricsRow]]] = None):
+        ida_kernwin.Choose.__init__(
+            self, title, [_column_spec(field, name) for field, name in COLUMNS],
+            flags=ida_kernwin.Choose.CH_CAN_REFRESH)
+        self.rows = rows
+        self.source = source
+
+    def OnGetSize(self):
+        return len(self.rows)
+
+    def OnGetLine(self, n):
+        row = self.rows[n]
+        return [format_value(field, row[field]) for field, _ in COLUMNS]
+
+    def OnSelectLine(self, n):
+        ida_kernwin.jumpto(self.rows[n]["ea"])
+        return (ida_kernwin.Choose.NOTHING_CHANGED,)
+
+    def OnRefresh(self, n):
+        if self.source is not None:
+            self.rows = self.source()
+        return [ida_kernwin.Choose.ALL_CHANGED] + self.adjust_last_item(n)
+
+    def OnClose(self):
+        if metrics_choosers.get(self.title) is self:
+            del metrics_choosers[self.title]
+
+    def export_csv(self, path: str) -> int:
+        return write_csv(self.rows, path)
+
+
+metrics_choosers: Dict[str, DeflatMetricsChooser] = {}  # 窗口标题 -> 打开的统计窗口
+
+
+def show_metrics(title: str, rows: List[MetricsRow],
+                 source: Optional[Callable[[], List[MetricsRow]]] = None) -> DeflatMetricsChooser:
+    """
+    打开统计窗口, 同一标题的窗口已经打开时替换其中的行
+    """
+    chooser = metrics_choosers.get(title)
+    if chooser is None:
+        chooser = metrics_choosers[title] = DeflatMetricsChooser(title, rows, source)
+    else:
+        chooser.rows = rows
+        chooser.source = source
+        chooser.Refresh()
+    chooser.Show()
+    return chooser
+
+
+def export_metrics(title: str, path: str) -> Optional[int]:
+    """
+    把指定标题的统计窗口中的行按当前顺序导出为 CSV
+
+    Args:
+        title: 统计窗口的标题, 例如右键菜单所在窗口的 get_widget_title
+
+    Returns:
+        导出的行数, 没有打开这个统计窗口时返回None
+    """
+    chooser = metrics_choosers.get(title)
+    if chooser is None:
+        return None
+    nb_rows = chooser.export_csv(path)
+    logger.info("已导出 %d 个函数的统计: %s", nb_rows, path)
+    return nb_rows
@@ -1,31 +1,250 @@
-from ida_hexrays import *
+from .mcapi import *
+import gzip
+import io
+import json
+import logging
 import os
+import re
+from typing import Dict, Optional, TextIO
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+_NON_PRINTABLE_RE = re.compile(r"[^\x20-\x7e]+")
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# 快照格式 -> 文件扩展名
+SNAPSHOT_EXTENSIONS = {"gzip": ".mc.gz", "zstd": ".mc.zst", "text": ".mc"}
+# 可以在 IDA 外重放的模型快照(mcmodel.mba_to_dict)
+MODEL_EXTENSION = ".model.json.gz"
+
+
+def open_snapshot(filename: str) -> TextIO:
+    """
+    按扩展名打开用于写入的快照文件: .gz 使用 gzip, .zst 使用 zstd(需要 zstandard), 其他为纯文本
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "wt", encoding="utf-8", compresslevel=GZIP_LEVEL)
+    if filename.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("写入 .zst 快照需要安装 zstandard")
+        raw = open(filename, "wb")
+        return io.TextIOWrapper(zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw), encoding="utf-8")
+    return open(filename, "w", encoding="utf-8")
+
+
+def read_snapshot(filename: str) -> TextIO:
+    """
+    按扩展名打开快照文件用于读取
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt", encoding="utf-8")
+    if filename.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("读取 .zst 快照需要安装 zstandard")
+        raw = open(filename, "rb")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), encoding="utf-8")
+    return open(filename, "r", encoding="utf-8")
+
 
 class mba_printer(vd_printer_t):
-    def __init__(self):
+    """
+    打印 mba, 传入 out 时每一行直接写入文件, 否则缓存在 mc 中
+    """
+    def __init__(self, out: Optional[TextIO] = None):
         vd_printer_t.__init__(self)
+        self.out = out
         self.mc = []
+        self.nb_lines = 0
 
     def get_mc(self):
         return self.mc
 
     def _print(self, indent, line):
-        self.mc.append("".join([c if 0x20 <= ord(c) <= 0x7e else "" for c in line])+"\n")
+        line = _NON_PRINTABLE_RE.sub("", line) + "\n"
+        if self.out is not None:
+            self.out.write(line)
+        else:
+            self.mc.append(line)
+        self.nb_lines += 1
         return 1
 
+
 def write_mc_to_file(mba: mbl_array_t, filename: str, mba_flags: int = 0) -> bool:
+    """
+    把 mba 的打印结果流式写入文件, 不在内存中缓存, 压缩方式由扩展名决定
+
+    Args:
+        mba: 微代码块数组
+        filename: 输出文件, 以 .gz 或 .zst 结尾时压缩
+        mba_flags: 打印期间临时设置的 mba 标志, 打印完成后恢复
+    """
     if not mba:
         return False
 
-    vp = mba_printer()
-    mba.set_mba_flags(mba_flags)
-    mba._print(vp)
-
-    with open(filename, "w") as f:
-        f.writelines(vp.get_mc())
+    added_flags = mba_flags & ~mba.get_mba_flags()
+    with open_snapshot(filename) as f:
+        vp = mba_printer(f)
+        if added_flags:
+            mba.set_mba_flags(added_flags)
+        try:
+            mba._print(vp)
+        finally:
+            if added_flags:
+                mba.clr_mba_flags(added_flags)
     return True
 
-def dump_microcode_for_debug(mba: mbl_array_t, log_dir_path: str, name: str = ""):
-    mc_filename = os.path.join(log_dir_path, "0x{0:x}_maturity_{1}_{2}.log".format(mba.entry_ea, mba.maturity, name))
+
+def write_model_to_file(mba: mbl_array_t, filename: str):
+    """
+    把 mba 转成 mcmodel 的 dict(包括 VALRANGES)保存为 gzip 压缩的 JSON, 可以在 IDA 外重放
+    """
+    from .mcmodel import mba_to_dict
+    if HAVE_IDA:
+        from .ida_adapter import mba_from_ida
+        mba = mba_from_ida(mba)
+    with gzip.open(filename, "wt", encoding="utf-8", compresslevel=GZIP_LEVEL) as f:
+        json.dump(mba_to_dict(mba), f, separators=(",", ":"))
+
+
+def read_model_file(filename: str) -> dict:
+    """
+    读取 write_model_to_file 保存的模型, 也接受没有压缩的 .json
+    """
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def dump_microcode_for_debug(mba: mbl_array_t, log_dir_path: str, name: str = "", fmt: str = "text") -> str:
+    mc_filename = os.path.join(log_dir_path, "0x{0:x}_maturity_{1}_{2}{3}".format(
+        mba.entry_ea, mba.maturity, name, SNAPSHOT_EXTENSIONS[fmt]))
     print("保存microcode到{0}".format(mc_filename))
-    write_mc_to_file(mba, mc_filename)
\ No newline at end of file
+    write_mc_to_file(mba, mc_filename)
+    return mc_filename
+
+
+def cfg_summary(mba: mbl_array_t) -> dict:
+    """
+    记录块级别的控制流: 每个块的序号、类型、起始地址和后继
+    """
+    blocks = []
+    for serial in range(mba.qty):
+        mblock: mblock_t = mba.get_mblock(serial)
+        blocks.append([serial, mblock.type, mblock.start, [x for x in mblock.succset]])
+    return {"entry_ea": mba.entry_ea, "maturity": mba.maturity, "qty": mba.qty, "blocks": blocks}
+
+
+def _block_keys(summary: dict) -> list:
+    # 插入块会改变后续块的序号, 用 (起始地址, 同地址中的序号) 对应前后两次快照中的块
+    seen: Dict[int, int] = {}
+    keys = []
+    for _, _, start, _ in summary["blocks"]:
+        n = seen.get(start, 0)
+        seen[start] = n + 1
+        keys.append((start, n))
+    return keys
+
+
+def diff_cfg(before: dict, after: dict) -> dict:
+    """
+    比较两次 cfg_summary, 给出新增、删除和后继发生变化的块, 序号都使用 after 中的序号
+
+    Returns:
+        {"qty": [之前, 之后], "added": [...], "removed": [之前的序号...],
+         "changed": [{"block", "old_succs", "new_succs"(, "old_type", "new_type")}]},
+        old_succs 中已经被删除的块记为-1
+    """
+    before_keys = _block_keys(before)
+    after_keys = _block_keys(after)
+    before_index = {key: serial for serial, key in enumerate(before_keys)}
+    after_index = {key: serial for serial, key in enumerate(after_keys)}
+
+    added = [serial for serial, key in enumerate(after_keys) if key not in before_index]
+    removed = [serial for serial, key in enumerate(before_keys) if key not in after_index]
+    changed = []
+    for serial, key in enumerate(after_keys):
+        old_serial = before_index.get(key)
+        if old_serial is None:
+            continue
+        _, old_type, _, old_succs = before["blocks"][old_serial]
+        _, new_type, _, new_succs = after["blocks"][serial]
+        old_succs = [after_index.get(before_keys[x], -1) if 0 <= x < len(before_keys) else -1 for x in old_succs]
+        if sorted(old_succs) == sorted(new_succs) and old_type == new_type:
+            continue
+        change = {"block": serial, "old_succs": old_succs, "new_succs": list(new_succs)}
+        if old_type != new_type:
+            change["old_type"] = old_type
+            change["new_type"] = new_type
+        changed.append(change)
+    return {"qty": [before["qty"], after["qty"]], "added": added, "removed": removed, "changed": changed}
+
+
+class MicrocodeSnapshotter:
+    """
+    在每个成熟度的反混淆前后各保存一次压缩的 microcode 快照, 并输出块级别的 CFG 差异
+
+    文件名: 0x{entry_ea}_maturity_{maturity}_{轮次}_{before|after}.mc.gz 和 ..._diff.json,
+    同一成熟度因为 MERR_LOOP 多次调用时轮次递增。没有修改时只保存 before。
+    with_model 为 True 时修改前再保存一份 ..._before.model.json.gz, 可以放入 benchmarks/corpus 重放。
+    """
+
+    def __init__(self, out_dir: str, fmt: str = "gzip", with_model: bool = False):
+        if fmt == "zstd" and zstandard is None:
+            logger.warning("没有安装 zstandard, 快照改用 gzip 格式")
+            fmt = "gzip"
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.with_model = with_model
+        self.rounds: Dict[int, Dict[int, int]] = {}  # 函数入口地址 -> 成熟度 -> 已保存的轮次
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _prefix(self, mba: mbl_array_t, round_index: int) -> str:
+        return os.path.join(self.out_dir, "0x{0:x}_maturity_{1}_{2}".format(mba.entry_ea, mba.maturity, round_index))
+
+    def reset(self, entry_ea: int):
+        """
+        函数重新反编译时从第0轮开始编号
+        """
+        self.rounds.pop(entry_ea, None)
+
+    def before(self, mba: mbl_array_t) -> dict:
+        """
+        保存修改前的快照
+
+        Returns:
+            修改前的 CFG 摘要, 传给 after
+        """
+        rounds = self.rounds.setdefault(mba.entry_ea, {})
+        round_index = rounds.get(mba.maturity, -1) + 1
+        rounds[mba.maturity] = round_index
+        write_mc_to_file(mba, self._prefix(mba, round_index) + "_before" + SNAPSHOT_EXTENSIONS[self.fmt])
+        if self.with_model:
+            write_model_to_file(mba, self._prefix(mba, round_index) + "_before" + MODEL_EXTENSION)
+        summary = cfg_summary(mba)
+        summary["round"] = round_index
+        return summary
+
+    def after(self, mba: mbl_array_t, before_summary: dict, changed: bool = True) -> Optional[dict]:
+        """
+        有修改时保存修改后的快照和 CFG 差异
+
+        Returns:
+            CFG 差异, 没有修改时为None
+        """
+        if not changed:
+            return None
+        prefix = self._prefix(mba, before_summary["round"])
+        write_mc_to_file(mba, prefix + "_after" + SNAPSHOT_EXTENSIONS[self.fmt])
+        diff = diff_cfg(before_summary, cfg_summary(mba))
+        with open(prefix + "_diff.json", "w", encoding="utf-8") as f:
+            json.dump(diff, f, separators=(",", ":"))
+        logger.info("保存 0x%x 成熟度 %d 的快照: 新增 %d 个块, %d 个块的后继变化",
+                    mba.entry_ea, mba.maturity, len(diff["added"]), len(diff["changed"]))
+        return diff
@@ -1,309 +1,310 @@
 from ida_hexrays import *
 from .cfgUtil import *
 from .my_microcode_log import *
-from .instructions import Instructions
 from .remove_dead_code import RemoveDeadCode
+from .passes import MicrocodePassManager
+from .unflattener import *
+from .deflat_cache import deflat_cache, cfg_fingerprint, function_hash, CACHE_VERSION
+from .func_config import func_config, FuncSettings
+from .prefilter import FlatteningPrefilter
+import ida_funcs
+import ida_kernwin
 import logging
-from .logger_config import get_logger
-from typing import TypedDict, List
+import os
+import time
+from .logger_config import get_logger, setup_logging, shutdown_logging, LOG_DIR
+from .global_index import global_index
+from .prefetch import prefetch_scheduler
+from .trace import function_scope
+from typing import TypedDict, Dict, Optional, Set
 from . import config
 
 logger = get_logger(__name__)
 
-JMP_OPCODE_HANDLED = [m_jnz, m_jz, m_jae, m_jb, m_ja, m_jbe, m_jge, m_jg, m_jl, m_jle]
+hook_instance: Optional["HexraysDecompilationHook"] = None  # 当前会话中唯一的反混淆钩子
 
-hook_instance = None
-class StateAssignment(TypedDict):
-    mblock_id: int
-    storage: str
-    value: int
+class FuncResult(TypedDict):
+    dispatcher_id: int
+    level: int
+    patches: int
+    blacklisted: int  # 级别1跳过的双重赋值块数
+    replaced: int  # 死代码消除替换的全局变量数
+    cached: bool
+    time: float  # 这一轮 glbopt 中死代码消除和反混淆的总耗时, 秒
+    stats: Optional[dict]
 
-class PossibleState(TypedDict):
-    mblock_id: int
-    valrange_name: str
-    valrange_value: int
-
-class mblock_valranges_filter(vd_printer_t):
-    def __init__(self):
-        vd_printer_t.__init__(self)
-        self.valranges = []
-        
-    def get_valranges(self):
-        return self.valranges
-    
-    def _print(self, indent, line):
-        if "VALRANGES" in line or "BLOCK" in line:
-            self.valranges.append("".join([c if 0x20 <= ord(c) <= 0x7e else "" for c in line]))
-        return 1
+class HexraysDecompilationHook(Hexrays_Hooks):
+    def __init__(self, level: Optional[int] = None):
+        super().__init__()
+        self.pending: Set[int] = set()  # 已修改过、正在等待第二轮优化的函数入口地址
+        self.level = level  # None 表示使用函数设置中的 deflat_level
+        self.chosen_levels: Dict[int, int] = {}  # 关闭缓存时自动选择的级别只保存在内存中
+        self.verdicts: Dict[int, bool] = {}  # 关闭缓存时平坦化预判的结论只保存在内存中
+        self.func_results: Dict[int, FuncResult] = {}  # 函数入口地址 -> 最近一次反混淆的结果
+        self.snapshotter: Optional[MicrocodeSnapshotter] = None  # 开启快照时第一次使用时创建
+        self.installed = False  # 是否直接安装(main 或批量处理), 此时插件的转发钩子不再转发事件
 
-class Unflattener:
+    def hook(self) -> bool:
+        self.installed = super().hook()
+        return self.installed
 
-    def __init__(self, mba:mba_t, dispatcher_id = 0):
-        self.mba = mba
-        self.dispatcher_id = dispatcher_id
-        self.dispatcher_ea = mba.get_mblock(dispatcher_id).start
-        self.storage_carrier = None
-        self.storage_list:list[mop_t] = [] # 存储所有可能用在ollvm分发的变量
-        self.state_assignments: list[StateAssignment] = []  # 存储状态变量的赋值语句
-        self.possible_states: list[PossibleState] = []  # 存储所有可能的状态值
+    def unhook(self) -> bool:
+        self.installed = False
+        return super().unhook()
+    
+    def cache_settings(self, level: int, settings: FuncSettings) -> str:
+        return "level={0};summary={1};rdc={2};dispatcher={3};carrier={4}".format(
+            level, int(self.uses_summary(level, settings)), int(settings['enable_remove_dead_code']),
+            settings['dispatcher_id'], settings['storage_carrier'])
 
-    def find_dispatcher_id(self):
+    def uses_summary(self, level: int, settings: FuncSettings) -> bool:
         """
-        查找分发块的序号, 查找方法为找到最多入度的块, 如果OLLVM中有预处理块则会被干扰, 需要手动指定分发块序号
+        是否使用状态转移摘要: 设置为自动选择时总是使用(包括重新使用之前选择的级别), 否则只有级别2和3使用
         """
-        max_input_num = -1
-        for i in range(1, self.mba.qty - 1):
-            mblock: mblock_t = self.mba.get_mblock(i)
-            num_input = mblock.npred()
-            if num_input > max_input_num:
-                max_input_num = num_input
-                self.dispatcher_id = i
+        requested = self.level if self.level is not None else settings['deflat_level']
+        return requested == AUTO_LEVEL or level in SUMMARY_LEVELS
 
-    def calc_entroy(self, value: int) -> bool:
+    def resolve_level(self, entry_ea: int, func_hash: Optional[str], settings: FuncSettings) -> int:
         """
-        计算熵值, 计算方法:判断每个字节位上是否都有值
-        """
-        count = 0
-        for i in range(4):
-            if value >> (i * 8) & 0xff != 0:
-                count += 1
-        return count >= 4
+        获取函数使用的 deflat 级别, 自动选择时优先使用之前为该函数选择的级别
 
-    def get_dispatcher_use_compare(self):
-        """
-        找到分发块中用于比较的存储器(寄存器或者栈上变量)
+        Returns:
+            deflat 级别, 还没有选择过时为 AUTO_LEVEL
         """
-        dispatcher_mblock: mblock_t = self.mba.get_mblock(self.dispatcher_id)
-        minsn: minsn_t = dispatcher_mblock.tail
-        logger.debug("minsn: %s", minsn.dstr())
-        if minsn.opcode in JMP_OPCODE_HANDLED:
-            mop_l :mop_t= minsn.l
-            if mop_l.t == mop_S:
-                tmp = "%0x{:X}".format(mop_l.s.off)
-                logger.debug("找到栈上变量: %s", tmp)
-                self.storage_carrier = tmp
-            elif mop_l.t == mop_r:
-                logger.debug("找到寄存器: %s", get_mreg_name(mop_l.r, mop_l.size))
-                self.storage_carrier = get_mreg_name(mop_l.r, mop_l.size)
+        level = self.level if self.level is not None else settings['deflat_level']
+        if level != AUTO_LEVEL:
+            return level
+        if func_hash is None:
+            chosen = self.chosen_levels.get(entry_ea)
         else:
-            logger.debug("不是主分发块")
+            chosen = deflat_cache.lookup_level(entry_ea, func_hash)
+        return chosen if chosen is not None else AUTO_LEVEL
 
-    def find_use_compare(self):
-        class GetOpt(minsn_visitor_t):
-            def __init__(self):
-                super().__init__()
-                self.mop_list = {}
-
-            def visit_minsn(self):
-                if self.curins.opcode in JMP_OPCODE_HANDLED:
-                    mop_l :mop_t= self.curins.l
-                    if mop_l.t == mop_S:
-                        tmp = "%0x{:X}".format(mop_l.s.off)
-                        # logger.debug("找到栈上变量: %s", tmp)
-                        if tmp not in self.mop_list.keys():
-                            self.mop_list[tmp] = 1
-                        else:
-                            self.mop_list[tmp] += 1
-                    elif mop_l.t == mop_r:
-                        mreg = get_mreg_name(mop_l.r, mop_l.size)
-                        if mreg not in self.mop_list.keys():
-                            self.mop_list[mreg] = 1
-                        else:
-                            self.mop_list[mreg] += 1
-                return 0
-            
-            def get_mop_list(self):
-                return self.mop_list
+    def remember_level(self, entry_ea: int, func_hash: Optional[str], level: int):
+        if func_hash is None:
+            self.chosen_levels[entry_ea] = level
+        else:
+            deflat_cache.store_level(entry_ea, func_hash, level)
 
-        getopt = GetOpt()
-        self.mba.for_all_topinsns(getopt)
-        mop_list:dict = getopt.get_mop_list()
-        sort_mop_list = sorted(mop_list.items(), key=lambda x: x[1], reverse=True)
-        self.storage_carrier = sort_mop_list[0][0]
+    def lookup_verdict(self, entry_ea: int, func_hash: Optional[str], settings: FuncSettings) -> Optional[bool]:
+        """
+        获取函数是否像被平坦化
 
+        Returns:
+            关闭预判或者手动指定了分发块/状态变量时为True, 库函数和 thunk 为False, 还没有预判过时为None
+        """
+        if not config.enable_prefilter or settings['dispatcher_id'] or settings['storage_carrier']:
+            return True
+        func = ida_funcs.get_func(entry_ea)
+        if func is not None and func.flags & (ida_funcs.FUNC_LIB | ida_funcs.FUNC_THUNK):
+            return False
+        if func_hash is None:
+            return self.verdicts.get(entry_ea)
+        return deflat_cache.lookup_verdict(entry_ea, func_hash)
 
-    def find_mblock_valranges(self):
-        # 找到所有块的VALRANGES
-        mba = self.mba
-        vp = mblock_valranges_filter()
-        mba._print(vp)
-        # logger.info(vp.get_valranges())
-        for line in vp.get_valranges():
-            if "BLOCK" in line:
-                mblock_id = int(line.split("BLOCK ")[1].split(" ")[0])
-                continue
-            # mblock_id = int(line.split(". ")[0])
-            # logger.debug("mblock_id: %d", mblock_id)
-            valranges_value = line.split("VALRANGES: ")[1]
-            # logger.debug("valranges_value: %s", valranges_value)
-            valranges_list = valranges_value.split(", ")
-            for valrange in valranges_list:
-                if ":==" in valrange:
-                    valrange_name = valrange.split(":==")[0]
-                    # logger.debug("valrange_name: %s", valrange_name)
-                    valrange_value = valrange.split(":==")[1]
-                    # logger.debug("valrange_value: 0x%x", int(valrange_value, 16))
-                    if self.calc_entroy(int(valrange_value, 16)):
-                        logger.info("valrange_name[%s] valrange_value[0x%x] 有足够的熵", valrange_name, int(valrange_value, 16))
-                        self.possible_states.append({
-                            'mblock_id': mblock_id,
-                            'valrange_name': valrange_name.split(".")[0],
-                            'valrange_value': int(valrange_value, 16)
-                        })
-        logging.debug("找到了所有块的可能性状态")
-        if logger.level < logging.INFO:
-            for flow_state in self.possible_states:
-                logging.debug(flow_state)
+    def remember_verdict(self, entry_ea: int, func_hash: Optional[str], flattened: bool):
+        if func_hash is None:
+            self.verdicts[entry_ea] = flattened
+        else:
+            deflat_cache.store_verdict(entry_ea, func_hash, flattened)
 
-    def find_next_status_in_mblock(self):
-        """
-        找到所有块中使用到状态赋值的语句并将内容记录
+    def lookup_cache(self, mba: mbl_array_t, level: int, func_hash: Optional[str], settings: FuncSettings):
         """
-        for mblock_id in range(1, self.mba.qty - 1):
-            mblock :mblock_t = self.mba.get_mblock(mblock_id)
-            minsn :minsn_t = mblock.head
-            while minsn:
-                if (minsn.opcode == m_mov and 
-                    minsn.l.t == mop_n and
-                    self.calc_entroy(minsn.l.nnn.value)):
-                    if minsn.d.t == mop_r:
-                        self.state_assignments.append({'mblock_id': mblock_id, 
-                                                    'storage': get_mreg_name(minsn.d.r, minsn.d.size),
-                                                    'value': minsn.l.nnn.value})
-                    elif minsn.d.t == mop_S:
-                        self.state_assignments.append({'mblock_id': mblock_id, 
-                                                    'storage': "%0x{:X}".format(minsn.d.s.off),
-                                                    'value': minsn.l.nnn.value})
-                minsn = minsn.next
-        logging.debug("找到了所有块中赋值的状态值")
-        if logger.level < logging.INFO:
-            for flow_block in self.state_assignments:
-                logging.debug(flow_block)
+        查找缓存中的反混淆结果
 
-    def find_in_possible_states(self, valrange_name=None, valrange_value=None):
-        for flow_block in self.possible_states:
-            if valrange_name != None and valrange_value != None:
-                if flow_block['valrange_value'] == valrange_value and flow_block['valrange_name'] == valrange_name:
-                    return flow_block
-            elif valrange_value != None:
-                 if flow_block['valrange_value'] == valrange_value:
-                     return flow_block
-        return None
-    
-    def deflat_level_1(self):
-        """
-        剔除具有双重变量的块
-        """
-        seen = set()
-        black_list = set()
-        for state_assignment in self.state_assignments:
-            mblock_id = state_assignment['mblock_id']
-            if mblock_id in seen:
-                black_list.add(mblock_id)
-            seen.add(mblock_id)
-        for state_assignment in self.state_assignments:
-            flow_block = self.find_in_possible_states(valrange_name=state_assignment['storage'], valrange_value=state_assignment['value'])
-            if flow_block != None:
-                next_mblock_id = flow_block['mblock_id']
-                cur_mblock_id = state_assignment['mblock_id']
-                if cur_mblock_id not in black_list:
-                    cur_mblock = self.mba.get_mblock(cur_mblock_id)
-                    change_jmp_target(cur_mblock, next_mblock_id)
-                else:
-                    logging.debug(f"在同一个mblock{cur_mblock_id}里面存在两重赋值")
+        Args:
+            func_hash: function_hash 的结果, 关闭缓存时为None
+            settings: 函数实际使用的设置
 
-    def deflat_level_2(self):
-        """
-        暴力匹配
+        Returns:
+            (缓存键, 缓存条目), 关闭缓存时缓存键为None, 未命中或者还没有自动选择级别时缓存条目为None
         """
-        for state_assignment in self.state_assignments:
-            flow_block = self.find_in_possible_states(valrange_value=state_assignment['value'])
-            if flow_block != None:
-                next_mblock_id = flow_block['mblock_id']
-                cur_mblock_id = state_assignment['mblock_id']
-                cur_mblock = self.mba.get_mblock(cur_mblock_id)
-                change_jmp_target(cur_mblock, next_mblock_id)
+        if not func_hash:
+            return None, None
+        # 缓存按块序号保存, 还要求反混淆之前的块布局一致
+        key = (func_hash, self.cache_settings(level, settings), mba.qty, cfg_fingerprint(mba))
+        if level == AUTO_LEVEL:
+            return key, None
+        return key, deflat_cache.lookup(mba.entry_ea, *key)
 
-    def deflat_level_3(self):
+    def unflatten(self, unflat: Unflattener, level: int, cache_key=None, cached=None,
+                  settings: Optional[FuncSettings] = None):
         """
-        仅修改最多分支部分
-        """
-        self.find_use_compare()
-        for state_assignment in self.state_assignments:
-            if state_assignment['storage'] == self.storage_carrier:
-                flow_block = self.find_in_possible_states(valrange_value=state_assignment['value'])
-                if flow_block != None:
-                    next_mblock_id = flow_block['mblock_id']
-                    cur_mblock_id = state_assignment['mblock_id']
-                    cur_mblock = self.mba.get_mblock(cur_mblock_id)
-                    change_jmp_target(cur_mblock, next_mblock_id)
+        对函数进行反混淆, 函数字节、设置和反混淆之前的 CFG 都没有变化时直接重放缓存中的跳转修改
 
-    def deflat_level_4(self):
-        """
-        安全模式
+        Args:
+            unflat: 已经创建的 Unflattener, 可以事先把收集器注册到共用的指令遍历中
+            level: deflat 级别
+            cache_key, cached: lookup_cache 的返回值
+            settings: 函数实际使用的设置, 为None时从 func_config 读取
         """
-        for state_assignment in self.state_assignments:
-            flow_block = self.find_in_possible_states(valrange_name=state_assignment['storage'], valrange_value=state_assignment['value'])
-            if flow_block != None:
-                next_mblock_id = flow_block['mblock_id']
-                cur_mblock_id = state_assignment['mblock_id']
-                cur_mblock = self.mba.get_mblock(cur_mblock_id)
-                change_jmp_target(cur_mblock, next_mblock_id)
+        mba = unflat.mba
+        if cached is not None:
+            logger.info("使用缓存的反混淆结果: 0x%x, %d 处跳转修改", mba.entry_ea, len(cached['redirections']))
+            unflat.level = level
+            unflat.replay(cached['dispatcher_id'], cached['storage_carrier'], cached['redirections'], cached['splits'])
+            return unflat
+        if settings is None:
+            settings = func_config.resolve(mba.entry_ea)
+        unflat.deflat(level, self.uses_summary(level, settings))
+        func_hash = cache_key[0] if cache_key is not None else None
+        if level == AUTO_LEVEL:
+            self.remember_level(mba.entry_ea, func_hash, unflat.level)
+        if cache_key is not None:
+            func_hash, _, qty, cfg_hash = cache_key
+            deflat_cache.store(mba.entry_ea, {
+                'version': CACHE_VERSION,
+                'func_hash': func_hash,
+                'settings': self.cache_settings(unflat.level, settings),
+                'qty': qty,
+                'cfg_hash': cfg_hash,
+                'dispatcher_id': unflat.dispatcher_id,
+                'storage_carrier': unflat.storage_carrier,
+                'redirections': unflat.redirections,
+                'splits': unflat.splits,
+            })
+        return unflat
 
-    def deflat(self, level=1):
-        nb_patch = 0
-        if self.dispatcher_id == 0:
-           self.find_dispatcher_id()
-        self.get_dispatcher_use_compare()
-        self.find_mblock_valranges()
-        self.find_next_status_in_mblock()
-        if level == 1:
-            self.deflat_level_1()
-        if level == 2:
-            self.deflat_level_2()
-        if level == 3:
-            self.deflat_level_3()
-        if level == 4:
-            self.deflat_level_4()
-        return nb_patch
+    def microcode(self, mba: mbl_array_t):
+        # 每次反编译都会重新生成microcode, 清除上一次反编译中途中止时留下的状态
+        self.pending.discard(mba.entry_ea)
+        if self.snapshotter is not None:
+            self.snapshotter.reset(mba.entry_ea)
+        return MERR_OK
+
+    def get_snapshotter(self) -> Optional[MicrocodeSnapshotter]:
+        if not config.enable_microcode_snapshot:
+            return None
+        if (self.snapshotter is None or self.snapshotter.fmt != config.microcode_snapshot_format
+                or self.snapshotter.with_model != config.microcode_snapshot_model):
+            self.snapshotter = MicrocodeSnapshotter(os.path.join(LOG_DIR, "snapshots"), config.microcode_snapshot_format,
+                                                    config.microcode_snapshot_model)
+        return self.snapshotter
 
-class HexraysDecompilationHook(Hexrays_Hooks):
-    def __init__(self):
-        super().__init__()
-        self.deflat_list = []
-    
     def glbopt(self, mba: mbl_array_t):
-        # dump_microcode_for_debug(mba, "D:\\project\\ida_split", "before_unflatten")
+        # 这一轮产生的日志和边修改事件都归属到当前函数
+        with function_scope(mba.entry_ea):
+            return self._glbopt(mba)
+
+    def _glbopt(self, mba: mbl_array_t):
         # unflat.find_mlbock_valranges(mba)
         # if not config.enable_ollvm_unflatten:
         #     return MERR_OK
-        if mba.entry_ea not in self.deflat_list:
-            if config.enable_remove_dead_code:
-                rdc = RemoveDeadCode()
-                mba.for_all_topinsns(rdc)
-                rdc.optimizer()
-            # struction = Instructions(mba)
-            # struction.instructions_fix()
-            if config.enable_ollvm_unflatten:
-                unflat = Unflattener(mba)
-                unflat.deflat(1)
-            # mba.remove_empty_and_unreachable_blocks()
-            # dump_microcode_for_debug(mba, "D:\\project\\ida_split", "after_unflatten")
-            self.deflat_list.append(mba.entry_ea)
-            return MERR_LOOP
-        else:
-            self.deflat_list.remove(mba.entry_ea)
+        if mba.entry_ea in self.pending:
+            self.pending.discard(mba.entry_ea)
+            return MERR_OK
+        start = time.perf_counter()
+        settings = func_config.resolve(mba.entry_ea)
+        nb_changes = 0
+        nb_replaced = 0
+        snapshotter = self.get_snapshotter()
+        snapshot = snapshotter.before(mba) if snapshotter is not None else None
+        # 死代码消除和反混淆共用一次指令遍历
+        manager = MicrocodePassManager(mba)
+        rdc = None
+        if settings['enable_remove_dead_code']:
+            rdc = manager.register(RemoveDeadCode())
+        unflat = None
+        prefilter = None
+        cache_key, cached = None, None
+        func_hash = None
+        flattened = None
+        if settings['enable_ollvm_unflatten']:
+            func_hash = function_hash(mba.entry_ea) if config.enable_deflat_cache else None
+            flattened = self.lookup_verdict(mba.entry_ea, func_hash, settings)
+        if flattened is False:
+            logger.debug("0x%x 没有平坦化特征, 跳过反混淆", mba.entry_ea)
+        elif settings['enable_ollvm_unflatten']:
+            stats = DeflatStats(mba.entry_ea) if config.enable_deflat_stats else None
+            dispatcher_id = settings['dispatcher_id']
+            if not 0 <= dispatcher_id < mba.qty - 1:
+                logger.warning("0x%x 指定的分发块序号 %d 超出范围, 改为自动查找", mba.entry_ea, dispatcher_id)
+                dispatcher_id = 0
+            unflat = Unflattener(mba, dispatcher_id, stats, settings['storage_carrier'])
+            level = self.resolve_level(mba.entry_ea, func_hash, settings)
+            cache_key, cached = self.lookup_cache(mba, level, func_hash, settings)
+            if cached is None:
+                unflat.register_collectors(manager)
+                if flattened is None:
+                    # 预判和状态扫描共用这一次指令遍历
+                    prefilter = manager.register(FlatteningPrefilter(mba, unflat.calc_entroy))
+        with (unflat.stats if unflat is not None else NULL_STATS).phase("state_scan"):
+            manager.run()
+        if prefilter is not None:
+            verdict = prefilter.verdict()
+            self.remember_verdict(mba.entry_ea, func_hash, verdict['flattened'])
+            if not verdict['flattened']:
+                logger.info("0x%x 没有平坦化特征, 跳过反混淆: %s", mba.entry_ea, verdict)
+                unflat = None
+        if rdc is not None:
+            nb_replaced = rdc.optimizer()
+            nb_changes += nb_replaced
+        if unflat is not None:
+            self.unflatten(unflat, level, cache_key, cached, settings)
+            nb_changes += unflat.nb_patch
+            self.func_results[mba.entry_ea] = {
+                'dispatcher_id': unflat.dispatcher_id,
+                'level': unflat.level,
+                'patches': unflat.nb_patch,
+                'blacklisted': unflat.nb_blacklisted,
+                'replaced': nb_replaced,
+                'cached': unflat.replayed,
+                'time': time.perf_counter() - start,
+                'stats': unflat.stats.as_dict(),
+            }
+            if unflat.stats.enabled:
+                # 只在日志记录时才格式化
+                logger.info("%s", unflat.stats)
+        # mba.remove_empty_and_unreachable_blocks()
+        if snapshotter is not None:
+            snapshotter.after(mba, snapshot, nb_changes > 0)
+        if nb_changes == 0:
+            # 没有任何修改, 不需要再进行一轮全局优化
             return MERR_OK
+        self.pending.add(mba.entry_ea)
+        return MERR_LOOP
 
 # testHook = HexraysDecompilationHook()
 # print(testHook.hook())
 
+def create_hook(level: Optional[int] = None) -> HexraysDecompilationHook:
+    """
+    配置日志并创建钩子(不安装), 开启后台预反编译时同时启动, 通常通过 get_hook 使用
+    """
+    setup_logging()
+    hook = HexraysDecompilationHook(level)
+    if config.enable_prefetch and ida_kernwin.is_idaq():
+        prefetch_scheduler.start()
+    return hook
+
+def get_hook() -> HexraysDecompilationHook:
+    """
+    当前会话中唯一的反混淆钩子, 第一次调用时创建(不安装)
+
+    插件的转发钩子、main 和批量处理都使用这个实例, 同一个函数只会被处理一次, 结果都在同一个 func_results 中
+    """
+    global hook_instance
+    if hook_instance is None:
+        hook_instance = create_hook()
+    return hook_instance
+
 def main():
+    hook = get_hook()
+    if not hook.installed:
+        hook.hook()
+    print("ollvm反混淆已加载")
+
+def unload():
+    """
+    卸载钩子, 写回并关闭 IDB 中的索引和设置, 停止日志线程, 用于热重载之前
+    """
     global hook_instance
 
+    prefetch_scheduler.stop()
     if hook_instance:
         hook_instance.unhook()
-
-    hook_instance = HexraysDecompilationHook()
-    hook_instance.hook()
-    print("ollvm反混淆已加载")
+        hook_instance = None
+    global_index.close()
+    deflat_cache.close()
+    func_config.close()
+    shutdown_logging()
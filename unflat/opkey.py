@@ -0,0 +1,152 @@
+"""
+寄存器/栈变量操作数的整数键
+
+键把 (种类, 寄存器编号或栈偏移, 大小) 打包为一个整数, 状态变量的比较都是整数比较和字典查找,
+只有 VALRANGES 中的名字需要通过 ValrangeKeys 转换一次。
+
+    位 56..63  种类(KIND_REG / KIND_STACK)
+    位 8..55   寄存器编号或栈偏移(补码)
+    位 0..7    大小
+"""
+from .mcapi import *
+from typing import Dict, Optional, Tuple
+
+KIND_REG = 1
+KIND_STACK = 2
+UNKNOWN_KEY = 0  # 无法转换的名字, 不等于任何操作数的键
+
+_KIND_SHIFT = 56
+_LOC_SHIFT = 8
+_LOC_BITS = _KIND_SHIFT - _LOC_SHIFT
+_LOC_MASK = (1 << _LOC_BITS) - 1
+_SIZE_MASK = 0xFF
+
+STACK_PREFIX = "%0x"
+
+
+def make_key(kind: int, loc: int, size: int) -> int:
+    return (kind << _KIND_SHIFT) | ((loc & _LOC_MASK) << _LOC_SHIFT) | (size & _SIZE_MASK)
+
+
+def operand_key(mop: mop_t) -> Optional[int]:
+    """
+    Returns:
+        寄存器和栈变量的键, 其他类型返回None
+    """
+    t = mop.t
+    if t == mop_r:
+        return (KIND_REG << _KIND_SHIFT) | ((mop.r & _LOC_MASK) << _LOC_SHIFT) | (mop.size & _SIZE_MASK)
+    if t == mop_S:
+        return (KIND_STACK << _KIND_SHIFT) | ((mop.s.off & _LOC_MASK) << _LOC_SHIFT) | (mop.size & _SIZE_MASK)
+    return None
+
+
+def key_kind(key: int) -> int:
+    return key >> _KIND_SHIFT
+
+
+def key_location(key: int) -> int:
+    loc = (key >> _LOC_SHIFT) & _LOC_MASK
+    return loc - (1 << _LOC_BITS) if loc >> (_LOC_BITS - 1) else loc
+
+
+def key_size(key: int) -> int:
+    return key & _SIZE_MASK
+
+
+def is_stack_key(key: int) -> bool:
+    return key >> _KIND_SHIFT == KIND_STACK
+
+
+def keys_overlap(a: int, b: int) -> bool:
+    """
+    两个键是否为同一种类且占用的字节范围相交, 例如 al 和 eax、%0x1C.4 和 %0x1E.2
+    """
+    if a >> _KIND_SHIFT != b >> _KIND_SHIFT:
+        return False
+    loc_a, loc_b = key_location(a), key_location(b)
+    return loc_a < loc_b + (b & _SIZE_MASK) and loc_b < loc_a + (a & _SIZE_MASK)
+
+
+def format_key(key: Optional[int]) -> str:
+    """
+    键的可读形式, 与 VALRANGES 的写法一致, 只用于日志和显示
+    """
+    if key is None:
+        return "None"
+    kind = key_kind(key)
+    if kind == KIND_STACK:
+        return "{0}{1:X}.{2}".format(STACK_PREFIX, key_location(key), key_size(key))
+    if kind == KIND_REG:
+        return "{0}.{1}".format(get_mreg_name(key_location(key), key_size(key)), key_size(key))
+    return "?"
+
+
+def _split_size(name: str) -> Tuple[str, Optional[int]]:
+    base, dot, size = name.rpartition(".")
+    if dot and size.isdigit():
+        return base, int(size)
+    return name, None
+
+
+class ValrangeKeys:
+    """
+    VALRANGES 中的名字(以及手动输入的状态变量名) -> 操作数键, 整个流程中唯一把名字转换为键的地方
+
+    带大小后缀的栈变量名直接解析; 寄存器名和没有大小的名字第一次出现时遍历一次 mba 中的操作数,
+    建立 名字 -> 键 的索引。每个名字只转换一次。
+    """
+
+    def __init__(self, mba: mba_t):
+        self.mba = mba
+        self._cache: Dict[str, int] = {}
+        self._by_name: Optional[Dict[Tuple[str, Optional[int]], int]] = None
+
+    def key(self, name: str) -> int:
+        """
+        Returns:
+            操作数键, 无法转换时返回 UNKNOWN_KEY
+        """
+        key = self._cache.get(name)
+        if key is None:
+            key = self._translate(name)
+            self._cache[name] = key
+        return key
+
+    def _translate(self, name: str) -> int:
+        base, size = _split_size(name.strip())
+        if size is not None and base.startswith(STACK_PREFIX):
+            try:
+                return make_key(KIND_STACK, int(base[len(STACK_PREFIX):], 16), size)
+            except ValueError:
+                return UNKNOWN_KEY
+        if self._by_name is None:
+            self._by_name = self._index_operands()
+        return self._by_name.get((base, size), UNKNOWN_KEY)
+
+    def _index_operands(self) -> Dict[Tuple[str, Optional[int]], int]:
+        by_name: Dict[Tuple[str, Optional[int]], int] = {}
+        seen = set()
+        mba = self.mba
+        for i in range(mba.qty):
+            minsn: minsn_t = mba.get_mblock(i).head
+            while minsn:
+                stack = [minsn]
+                while stack:
+                    cur = stack.pop()
+                    for mop in (cur.l, cur.r, cur.d):
+                        if mop.t == mop_d:
+                            stack.append(mop.d)
+                            continue
+                        key = operand_key(mop)
+                        if key is None or key in seen:
+                            continue
+                        seen.add(key)
+                        if mop.t == mop_r:
+                            base = get_mreg_name(mop.r, mop.size)
+                        else:
+                            base = "{0}{1:X}".format(STACK_PREFIX, mop.s.off)
+                        by_name.setdefault((base, mop.size), key)
+                        by_name.setdefault((base, None), key)
+                minsn = minsn.next
+        return by_name
@@ -0,0 +1,99 @@
+from .mcapi import *
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class InsnCollector:
+    """
+    指令收集器的基类, 由 MicrocodePassManager 在唯一的一次指令遍历中调用
+
+    - opcodes: 关心的操作码, None 表示所有指令; 管理器按操作码分发, 不关心的指令不会调用 visit
+    - nested: 是否还需要访问嵌套在操作数(mop_d)中的子指令
+    """
+    opcodes: Optional[Iterable[int]] = None
+    nested = False
+
+    def visit(self, mblock_id: int, minsn: minsn_t, top: bool):
+        """
+        Args:
+            mblock_id: 指令所在块的序号
+            minsn: 当前指令
+            top: 是否为顶层指令, False 表示嵌套在其他指令操作数中的子指令
+        """
+        raise NotImplementedError
+
+    def finish(self):
+        """
+        遍历结束后调用
+        """
+        pass
+
+
+class MicrocodePassManager:
+    """
+    把多个分析合并为一次微代码遍历
+
+    每条顶层指令只读取一次操作码, 再分发给关心该操作码的收集器; 嵌套的子指令用显式栈展开,
+    只交给 nested 为 True 的收集器。
+
+    用法:
+        manager = MicrocodePassManager(mba)
+        rdc = manager.register(RemoveDeadCode())
+        manager.run()
+    """
+
+    def __init__(self, mba: mba_t):
+        self.mba = mba
+        self.collectors: List[InsnCollector] = []
+
+    def register(self, collector: InsnCollector) -> InsnCollector:
+        self.collectors.append(collector)
+        return collector
+
+    def _dispatch_table(self, collectors: List[InsnCollector]):
+        """
+        Returns:
+            (所有指令都要调用的收集器, 按操作码过滤的收集器列表)
+        """
+        wildcard = tuple(c for c in collectors if c.opcodes is None)
+        keyed = [(frozenset(c.opcodes), c) for c in collectors if c.opcodes is not None]
+        return wildcard, keyed
+
+    @staticmethod
+    def _handlers(cache: Dict[int, Tuple[InsnCollector, ...]], table, opcode: int) -> Tuple[InsnCollector, ...]:
+        handlers = cache.get(opcode)
+        if handlers is None:
+            wildcard, keyed = table
+            handlers = wildcard + tuple(c for opcodes, c in keyed if opcode in opcodes)
+            cache[opcode] = handlers
+        return handlers
+
+    def run(self):
+        if not self.collectors:
+            return
+        top_table = self._dispatch_table(self.collectors)
+        nested_collectors = [c for c in self.collectors if c.nested]
+        nested_table = self._dispatch_table(nested_collectors)
+        top_cache: Dict[int, Tuple[InsnCollector, ...]] = {}
+        nested_cache: Dict[int, Tuple[InsnCollector, ...]] = {}
+        handlers_for = self._handlers
+
+        mba = self.mba
+        for mblock_id in range(mba.qty):
+            minsn: minsn_t = mba.get_mblock(mblock_id).head
+            while minsn:
+                for collector in handlers_for(top_cache, top_table, minsn.opcode):
+                    collector.visit(mblock_id, minsn, True)
+                if nested_collectors:
+                    stack = [minsn]
+                    while stack:
+                        cur = stack.pop()
+                        for mop in (cur.r, cur.l):
+                            if mop.t != mop_d:
+                                continue
+                            sub: minsn_t = mop.d
+                            for collector in handlers_for(nested_cache, nested_table, sub.opcode):
+                                collector.visit(mblock_id, sub, False)
+                            stack.append(sub)
+                minsn = minsn.next
+        for collector in self.collectors:
+            collector.finish()
@@ -0,0 +1,213 @@
+"""
+空闲时在后台预先反编译光标附近的函数
+
+- 导航到新函数时, 把它的被调用函数和调用者按优先级加入队列
+- IDA 定时器在主线程中每次只反编译一个函数, 之间把控制权交还给界面; 最近有用户操作时跳过这一轮
+- 反编译经过已经安装的钩子, 反混淆结果进入 deflat 缓存, 伪代码进入 Hex-Rays 的 cfunc 缓存,
+  之后打开这些函数时直接使用缓存
+"""
+import heapq
+import itertools
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import ida_auto
+import ida_funcs
+import ida_hexrays
+import ida_kernwin
+import idautils
+
+logger = logging.getLogger(__name__)
+
+TIMER_INTERVAL_MS = 200  # 定时器间隔
+IDLE_DELAY = 1.0  # 最近一次导航之后多少秒才开始后台反编译
+MAX_NEIGHBOURS = 32  # 每次导航最多加入队列的函数数
+MAX_QUEUE = 256  # 队列长度上限, 超过时丢弃优先级最低的函数
+
+# 优先级, 越小越先处理
+PRIORITY_CURRENT = 0
+PRIORITY_CALLEE = 1
+PRIORITY_CALLER = 2
+
+
+def _skip_function(func: ida_funcs.func_t) -> bool:
+    return bool(func.flags & (ida_funcs.FUNC_LIB | ida_funcs.FUNC_THUNK))
+
+
+def callees(func: ida_funcs.func_t, limit: int = MAX_NEIGHBOURS) -> List[int]:
+    """
+    函数中调用的其他函数的入口地址, 按第一次调用的顺序
+    """
+    result = []
+    seen = {func.start_ea}
+    for head in idautils.FuncItems(func.start_ea):
+        for to in idautils.CodeRefsFrom(head, False):
+            callee = ida_funcs.get_func(to)
+            if callee is None or callee.start_ea != to or to in seen:
+                continue
+            seen.add(to)
+            result.append(to)
+            if len(result) >= limit:
+                return result
+    return result
+
+
+def callers(func: ida_funcs.func_t, limit: int = MAX_NEIGHBOURS) -> List[int]:
+    """
+    调用该函数的函数的入口地址
+    """
+    result = []
+    seen = {func.start_ea}
+    for frm in idautils.CodeRefsTo(func.start_ea, False):
+        caller = ida_funcs.get_func(frm)
+        if caller is None or caller.start_ea in seen:
+            continue
+        seen.add(caller.start_ea)
+        result.append(caller.start_ea)
+        if len(result) >= limit:
+            break
+    return result
+
+
+class _NavigationHooks(ida_kernwin.UI_Hooks):
+    def __init__(self, scheduler: "PrefetchScheduler"):
+        ida_kernwin.UI_Hooks.__init__(self)
+        self.scheduler = scheduler
+
+    def screen_ea_changed(self, ea, prev_ea):
+        self.scheduler.on_navigate(ea)
+
+
+class PrefetchScheduler:
+    """
+    后台预反编译队列
+
+    队列是按 (优先级, 导航序号) 排序的堆, 导航到新函数时之前加入的函数优先级降低;
+    重复加入的函数只保留最新的一项, 旧的项在出堆时跳过。
+    """
+
+    def __init__(self, interval_ms: int = TIMER_INTERVAL_MS, idle_delay: float = IDLE_DELAY):
+        self.interval_ms = interval_ms
+        self.idle_delay = idle_delay
+        self.heap: List[Tuple[Tuple[int, int, int], int]] = []
+        self.queued: Dict[int, Tuple[int, int, int]] = {}  # 函数入口地址 -> 队列中有效的键
+        self.done: Set[int] = set()  # 已经预反编译过的函数
+        self._generation = 0  # 每次导航到新函数加一
+        self._order = itertools.count()
+        self._last_func: Optional[int] = None
+        self._last_input = 0.0
+        self._timer = None
+        self._hooks: Optional[_NavigationHooks] = None
+        self._busy = False
+        self.nb_decompiled = 0
+
+    @property
+    def running(self) -> bool:
+        return self._timer is not None
+
+    def start(self):
+        if self.running:
+            return
+        self._hooks = _NavigationHooks(self)
+        self._hooks.hook()
+        self._timer = ida_kernwin.register_timer(self.interval_ms, self._on_timer)
+        self.on_navigate(ida_kernwin.get_screen_ea())
+        logger.info("后台预反编译已启动")
+
+    def stop(self):
+        if self._timer is not None:
+            ida_kernwin.unregister_timer(self._timer)
+            self._timer = None
+        if self._hooks is not None:
+            self._hooks.unhook()
+            self._hooks = None
+        self.heap.clear()
+        self.queued.clear()
+
+    def forget(self, entry_ea: Optional[int] = None):
+        """
+        函数的反混淆结果失效后(例如清除缓存), 允许再次预反编译, entry_ea为None时全部允许
+        """
+        if entry_ea is None:
+            self.done.clear()
+        else:
+            self.done.discard(entry_ea)
+
+    def push(self, entry_ea: int, priority: int):
+        if entry_ea in self.done:
+            return
+        key = (priority, -self._generation, next(self._order))
+        old = self.queued.get(entry_ea)
+        if old is not None and old[:2] <= key[:2]:
+            return
+        self.queued[entry_ea] = key
+        heapq.heappush(self.heap, (key, entry_ea))
+        if len(self.queued) > MAX_QUEUE:
+            self._trim()
+
+    def _trim(self):
+        entries = sorted((key, ea) for ea, key in self.queued.items())[:MAX_QUEUE]
+        self.queued = {ea: key for key, ea in entries}
+        self.heap = list(entries)
+        heapq.heapify(self.heap)
+
+    def pop(self) -> Optional[int]:
+        while self.heap:
+            key, entry_ea = heapq.heappop(self.heap)
+            if self.queued.get(entry_ea) == key:
+                del self.queued[entry_ea]
+                return entry_ea
+        return None
+
+    def on_navigate(self, ea: int):
+        self._last_input = time.monotonic()
+        func = ida_funcs.get_func(ea)
+        if func is None or func.start_ea == self._last_func:
+            return
+        self._last_func = func.start_ea
+        self._generation += 1
+        if not _skip_function(func):
+            self.push(func.start_ea, PRIORITY_CURRENT)
+        for callee in callees(func):
+            self.push(callee, PRIORITY_CALLEE)
+        for caller in callers(func):
+            self.push(caller, PRIORITY_CALLER)
+
+    def _on_timer(self) -> int:
+        if self._timer is None:
+            return -1
+        if (self._busy or not self.queued or time.monotonic() - self._last_input < self.idle_delay
+                or not ida_auto.auto_is_ok()):
+            return self.interval_ms
+        self._busy = True
+        try:
+            self._decompile_next()
+        except Exception:
+            logger.exception("后台预反编译失败")
+        finally:
+            self._busy = False
+        return self.interval_ms
+
+    def _decompile_next(self):
+        # 每次只处理一个函数, 处理完回到界面的事件循环
+        while True:
+            entry_ea = self.pop()
+            if entry_ea is None:
+                return
+            self.done.add(entry_ea)
+            func = ida_funcs.get_func(entry_ea)
+            if func is None or _skip_function(func) or ida_hexrays.has_cached_cfunc(entry_ea):
+                continue
+            break
+        start = time.perf_counter()
+        hf = ida_hexrays.hexrays_failure_t()
+        cfunc = ida_hexrays.decompile(entry_ea, hf, ida_hexrays.DECOMP_NO_WAIT)
+        self.nb_decompiled += 1
+        if cfunc is None:
+            logger.debug("后台反编译 0x%x 失败: %s", entry_ea, hf.desc())
+        else:
+            logger.debug("后台反编译 0x%x 完成, %.3fs", entry_ea, time.perf_counter() - start)
+
+
+prefetch_scheduler = PrefetchScheduler()
@@ -0,0 +1,97 @@
+"""
+判断函数是否像被平坦化, 没有平坦化特征的函数跳过反混淆
+
+只使用线性时间的廉价特征, 不打印 VALRANGES, 不建立状态表:
+- 入度分布: 分发块(或者汇聚块)的入度远高于平均入度
+- 状态常量: calc_entroy 接受的 "mov 高熵常量, 变量" 的数量
+- 比较变量: 和高熵常量比较最多的寄存器/栈变量
+"""
+from .mcapi import *
+from .opkey import operand_key
+from .passes import InsnCollector, MicrocodePassManager
+from .dispatcher import JMP_OPCODE_HANDLED
+import logging
+from typing import Callable, Dict, Optional, TypedDict
+
+logger = logging.getLogger(__name__)
+
+MIN_DISPATCHER_PREDS = 3  # 分发块的最小入度
+INDEGREE_OUTLIER = 3  # 最大入度至少是平均入度的倍数
+MIN_STATE_CONSTANTS = 2  # 最少的高熵状态赋值数量
+MIN_CARRIER_COMPARES = 2  # 比较变量最少和高熵常量比较的次数
+
+
+class PrefilterVerdict(TypedDict):
+    flattened: bool
+    max_preds: int
+    mean_preds: float
+    state_constants: int
+    carrier: Optional[int]  # 操作数键
+    carrier_compares: int
+    compares: int  # 和高熵常量比较的条件跳转总数
+
+
+class FlatteningPrefilter(InsnCollector):
+    """
+    平坦化预判, 可以注册到共用的 MicrocodePassManager 中, 遍历结束后由 verdict 给出结论
+
+    只访问顶层的 mov 和条件跳转, 块的入度在 verdict 中遍历一次块得到。
+    """
+    opcodes = (m_mov, *JMP_OPCODE_HANDLED)
+
+    def __init__(self, mba: mba_t, calc_entroy: Callable[[int], bool]):
+        self.mba = mba
+        self.calc_entroy = calc_entroy
+        self.last_mblock_id = mba.qty - 1
+        self.state_constants = 0
+        self.compare_counts: Dict[int, int] = {}
+
+    def visit(self, mblock_id: int, minsn: minsn_t, top: bool):
+        if minsn.opcode == m_mov:
+            if (0 < mblock_id < self.last_mblock_id and minsn.l.t == mop_n
+                    and self.calc_entroy(minsn.l.nnn.value)):
+                self.state_constants += 1
+            return
+        if minsn.r.t != mop_n or not self.calc_entroy(minsn.r.nnn.value):
+            return
+        storage = operand_key(minsn.l)
+        if storage is not None:
+            self.compare_counts[storage] = self.compare_counts.get(storage, 0) + 1
+
+    def verdict(self) -> PrefilterVerdict:
+        mba = self.mba
+        max_preds = 0
+        nb_edges = 0
+        for i in range(mba.qty):
+            npred = mba.get_mblock(i).npred()
+            nb_edges += npred
+            if 0 < i < self.last_mblock_id and npred > max_preds:
+                max_preds = npred
+        mean_preds = nb_edges / mba.qty if mba.qty else 0.0
+        carrier, carrier_compares = None, 0
+        if self.compare_counts:
+            carrier, carrier_compares = max(self.compare_counts.items(), key=lambda x: x[1])
+        flattened = (max_preds >= MIN_DISPATCHER_PREDS
+                     and max_preds >= INDEGREE_OUTLIER * mean_preds
+                     and self.state_constants >= MIN_STATE_CONSTANTS
+                     and carrier_compares >= MIN_CARRIER_COMPARES)
+        return {
+            'flattened': flattened,
+            'max_preds': max_preds,
+            'mean_preds': mean_preds,
+            'state_constants': self.state_constants,
+            'carrier': carrier,
+            'carrier_compares': carrier_compares,
+            'compares': sum(self.compare_counts.values()),
+        }
+
+
+def classify(mba: mba_t, calc_entroy: Callable[[int], bool]) -> PrefilterVerdict:
+    """
+    单独遍历一次指令, 判断函数是否像被平坦化
+    """
+    prefilter = FlatteningPrefilter(mba, calc_entroy)
+    manager = MicrocodePassManager(mba)
+    manager.register(prefilter)
+    manager.run()
+    return prefilter.verdict()
@@ -1,33 +1,30 @@
 from ida_hexrays import *
-import ida_segment
 import logging
-from .logger_config import get_logger
+from .global_index import global_index
+from .passes import InsnCollector
+
+logger = logging.getLogger(__name__)
+
+class RemoveDeadCode(InsnCollector):
+    """
+    收集读取和写入的全局变量, 由 MicrocodePassManager 遍历所有指令(包括嵌套的子指令)
+    """
+    nested = True
 
-class RemoveDeadCode(minsn_visitor_t):
     def __init__(self):
         self.minsn_line = 0
         self.mop_list = []
         self.black_mop_list = []
-        super().__init__()
-
-    def visit_minsn(self):
-        minsn = self.curins
-        self._optimizer(minsn)
-        return 0
 
-    def _optimizer(self, minsn:minsn_t):
-        # mopOptimizer = MopOptimizer()
-        # minsn.for_all_ops(mopOptimizer)
-        logging.debug(f"{self.minsn_line}: {minsn.dstr()}")
+    def visit(self, mblock_id: int, minsn: minsn_t, top: bool):
+        if top:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("%d: %s", self.minsn_line, minsn.dstr())
+            self.minsn_line += 1
         self._find_ori_minsn(minsn)
-        self.minsn_line += 1
 
     def _find_ori_minsn(self, minsn:minsn_t):
-        # print(minsn.dstr())
-        if minsn.l.t == mop_d:
-            self._find_ori_minsn(minsn.l.d)
-        if minsn.r.t == mop_d:
-            self._find_ori_minsn(minsn.r.d)
+        # 嵌套在 mop_d 中的子指令由 MicrocodePassManager 单独访问
         if minsn.r.t == mop_v and minsn.r.size > -1:
             self.mop_list.append(minsn.r)
         if minsn.l.t == mop_v and minsn.l.size > -1:
@@ -35,14 +32,26 @@ class RemoveDeadCode(minsn_visitor_t):
         if minsn.d.t == mop_v and minsn.l.size > -1:
             self.black_mop_list.append(minsn.d)
 
-    def optimizer(self):
-        black_mop_addr = []
-        for mop in self.black_mop_list:
-            black_mop_addr.append(mop.g)
+    def optimizer(self) -> int:
+        """
+        把从未被写入的.bss全局变量替换为0
+
+        是否被写入同时参考当前函数中的写入和整个数据库的写引用(global_index)
+
+        Returns:
+            替换的操作数数量
+        """
+        nb_replaced = 0
+        black_mop_addr = {mop.g for mop in self.black_mop_list}
+        index = global_index.ensure()
         for mop in self.mop_list:
-            mop_str = mop.dstr()
-            seg:ida_segment.segment_t = ida_segment.getseg(mop.g)
-            if mop.g not in black_mop_addr and ida_segment.get_segm_name(seg) == ".bss":
+            if mop.g in black_mop_addr or not index.is_never_written_bss(mop.g):
+                continue
+            if logger.isEnabledFor(logging.INFO):
+                mop_str = mop.dstr()
+                mop.make_number(0, mop.size)
+                logger.info("修改%s -> %s", mop_str, mop.dstr())
+            else:
                 mop.make_number(0, mop.size)
-                mop_new_str = mop.dstr()
-                logging.info(f"修改{mop_str} -> {mop_new_str}")
\ No newline at end of file
+            nb_replaced += 1
+        return nb_replaced
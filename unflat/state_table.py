@@ -0,0 +1,186 @@
+"""
+列式状态表
+
+状态赋值和 VALRANGES 中的可能状态都保存为三列平行的 array: 块ID、状态变量的操作数键(opkey)、状态值。
+熵值过滤、重复赋值检测和两张表之间的连接都对整张表一次完成; 安装了 numpy 并且表足够大时
+用 numpy 向量化, 否则用 array/dict 的批量操作, 两种实现的结果相同。
+"""
+from array import array
+from collections import Counter
+from itertools import compress, repeat
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    np = None
+    HAVE_NUMPY = False
+
+NUMPY_MIN_ROWS = 256  # 行数少于这个值时转换为 numpy 的开销大于收益
+NO_MATCH = -1  # 连接时没有匹配的行
+
+_VALUE_MASK = (1 << 64) - 1
+_BYTE_MASKS = (0xFF, 0xFF00, 0xFF0000, 0xFF000000)
+
+
+def has_entropy(value: int) -> bool:
+    """
+    熵值判断: 低 4 个字节是否都不为 0
+    """
+    return all(value & mask for mask in _BYTE_MASKS)
+
+
+def _use_numpy(nb_rows: int) -> bool:
+    return HAVE_NUMPY and nb_rows >= NUMPY_MIN_ROWS
+
+
+class StateTable:
+    """
+    (块ID, 状态变量的操作数键, 状态值) 表, 按加入的顺序保存
+
+    状态值按 64 位无符号数保存, 负数取补码。
+    """
+    __slots__ = ("mblock_ids", "carriers", "values")
+
+    def __init__(self):
+        self.mblock_ids = array("i")
+        self.carriers = array("Q")
+        self.values = array("Q")
+
+    def append(self, mblock_id: int, carrier: int, value: int):
+        self.mblock_ids.append(mblock_id)
+        self.carriers.append(carrier)
+        self.values.append(value & _VALUE_MASK)
+
+    def __len__(self) -> int:
+        return len(self.mblock_ids)
+
+    def __iter__(self) -> Iterator[Tuple[int, int, int]]:
+        return zip(self.mblock_ids, self.carriers, self.values)
+
+    def _columns(self):
+        return (np.frombuffer(self.mblock_ids, dtype=np.int32),
+                np.frombuffer(self.carriers, dtype=np.uint64),
+                np.frombuffer(self.values, dtype=np.uint64))
+
+    def entropy_mask(self) -> Sequence[bool]:
+        """
+        每一行的状态值是否有足够的熵, 与 has_entropy 一致
+        """
+        if _use_numpy(len(self)):
+            values = np.frombuffer(self.values, dtype=np.uint64)
+            mask = np.ones(len(values), dtype=bool)
+            for byte_mask in _BYTE_MASKS:
+                mask &= (values & np.uint64(byte_mask)) != 0
+            return mask
+        m0, m1, m2, m3 = _BYTE_MASKS
+        return [bool(v & m0 and v & m1 and v & m2 and v & m3) for v in self.values]
+
+    def compress(self, mask: Sequence[bool]):
+        """
+        只保留mask为真的行
+        """
+        if HAVE_NUMPY and isinstance(mask, np.ndarray):
+            for name, column in zip(self.__slots__, self._columns()):
+                kept = array(getattr(self, name).typecode)
+                kept.frombytes(column[mask].tobytes())
+                setattr(self, name, kept)
+            return
+        for name in self.__slots__:
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, compress(column, mask)))
+
+    def filter_entropy(self):
+        self.compress(self.entropy_mask())
+
+    def block_ids(self) -> Set[int]:
+        return set(self.mblock_ids)
+
+    def duplicate_blocks(self) -> Set[int]:
+        """
+        出现在多行中的块ID(同一个块中有多次状态赋值)
+        """
+        if _use_numpy(len(self)):
+            ids, counts = np.unique(np.frombuffer(self.mblock_ids, dtype=np.int32), return_counts=True)
+            return set(ids[counts > 1].tolist())
+        return {mblock_id for mblock_id, count in Counter(self.mblock_ids).items() if count > 1}
+
+
+class StateIndex:
+    """
+    可能状态表上的连接索引, 每次deflat构建一次, 供所有deflat_level_*共享
+
+    - find: 按 (操作数键, 状态值) 或只按状态值找到第一个匹配行的块ID
+    - join: 对整张状态赋值表做同样的查找
+    - ambiguous_values: 出现在多个块中的状态值, 用于标记不唯一的匹配
+    """
+
+    def __init__(self, possible_states: StateTable):
+        self.table = possible_states
+        ids, carriers, values = possible_states.mblock_ids, possible_states.carriers, possible_states.values
+        # 反向构建字典, 相同的键保留第一行
+        self.by_storage_value: Dict[Tuple[int, int], int] = dict(
+            zip(zip(reversed(carriers), reversed(values)), reversed(ids)))
+        self.by_value: Dict[int, int] = dict(zip(reversed(values), reversed(ids)))
+        value_counts = Counter(value for value, _ in set(zip(values, ids)))
+        self.ambiguous_values: Set[int] = {value for value, count in value_counts.items() if count > 1}
+
+    def find(self, valrange_key: Optional[int] = None, valrange_value: Optional[int] = None) -> Optional[int]:
+        """
+        Returns:
+            匹配的块ID, 没有匹配时返回None
+        """
+        if valrange_value is None:
+            return None
+        valrange_value &= _VALUE_MASK
+        if valrange_key is not None:
+            return self.by_storage_value.get((valrange_key, valrange_value))
+        return self.by_value.get(valrange_value)
+
+    def is_ambiguous(self, valrange_value: int) -> bool:
+        return valrange_value & _VALUE_MASK in self.ambiguous_values
+
+    def join(self, assignments: StateTable, by_carrier: bool) -> Sequence[int]:
+        """
+        对状态赋值表的每一行查找可能状态表中第一个匹配的块
+
+        Args:
+            by_carrier: True 时状态变量和状态值都要相同, 否则只比较状态值
+
+        Returns:
+            与赋值表逐行对应的块ID, 没有匹配时为 NO_MATCH
+        """
+        if _use_numpy(len(assignments) + len(self.table)):
+            return self._join_numpy(assignments, by_carrier)
+        if by_carrier:
+            return list(map(self.by_storage_value.get, zip(assignments.carriers, assignments.values),
+                            repeat(NO_MATCH)))
+        return list(map(self.by_value.get, assignments.values, repeat(NO_MATCH)))
+
+    def _join_numpy(self, assignments: StateTable, by_carrier: bool) -> List[int]:
+        p_ids, p_carriers, p_values = self.table._columns()
+        _, a_carriers, a_values = assignments._columns()
+        result = np.full(len(assignments), NO_MATCH, dtype=np.int64)
+        if not len(p_ids) or not len(a_values):
+            return result.tolist()
+        if not by_carrier:
+            _match_values(p_ids, p_values, a_values, result, slice(None))
+            return result.tolist()
+        for carrier in np.unique(a_carriers):
+            rows = np.nonzero(a_carriers == carrier)[0]
+            candidates = p_carriers == carrier
+            if candidates.any():
+                _match_values(p_ids[candidates], p_values[candidates], a_values[rows], result, rows)
+        return result.tolist()
+
+
+def _match_values(p_ids, p_values, a_values, result, rows):
+    """
+    result[rows] = 每个 a_values 在 p_values 中第一次出现的行的块ID
+    """
+    unique_values, first = np.unique(p_values, return_index=True)
+    pos = np.searchsorted(unique_values, a_values)
+    pos[pos == len(unique_values)] = 0
+    hit = unique_values[pos] == a_values
+    result[rows] = np.where(hit, p_ids[first[pos]], NO_MATCH)
@@ -0,0 +1,122 @@
+import time
+from typing import Dict, Optional
+
+
+class _Phase:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings: Dict[str, float], name: str):
+        self.timings = timings
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class DeflatStats:
+    """
+    记录一次反混淆各阶段的耗时和计数
+
+    用法:
+        with stats.phase("valranges"):
+            ...
+        stats.count("patched")
+    """
+    __slots__ = ("entry_ea", "timings", "counters")
+
+    enabled = True
+
+    def __init__(self, entry_ea: int = 0):
+        self.entry_ea = entry_ea
+        self.timings: Dict[str, float] = {}  # 阶段名 -> 秒, 按阶段开始的顺序
+        self.counters: Dict[str, int] = {}
+
+    def phase(self, name: str) -> _Phase:
+        return _Phase(self.timings, name)
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name: str, value: int):
+        self.counters[name] = value
+
+    def merge(self, other: "DeflatStats"):
+        for name, value in other.timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + value
+        for name, value in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @property
+    def total_time(self) -> float:
+        return sum(self.timings.values())
+
+    def as_dict(self) -> dict:
+        return {
+            "entry_ea": self.entry_ea,
+            "total_time": self.total_time,
+            "timings": dict(self.timings),
+            "counters": dict(self.counters),
+        }
+
+    def summary(self) -> str:
+        timings = ", ".join("{0} {1:.1f}ms".format(name, value * 1000) for name, value in self.timings.items())
+        counters = " ".join("{0}={1}".format(name, value) for name, value in self.counters.items())
+        return "0x{0:x} 反混淆耗时 {1:.1f}ms ({2}) {3}".format(
+            self.entry_ea, self.total_time * 1000, timings, counters)
+
+    def __str__(self) -> str:
+        return self.summary()
+
+
+class NullStats:
+    """
+    关闭统计时使用, 所有操作都是空操作
+    """
+    __slots__ = ()
+
+    enabled = False
+    entry_ea = 0
+    timings: Dict[str, float] = {}
+    counters: Dict[str, int] = {}
+    total_time = 0.0
+
+    def phase(self, name: str) -> _NullPhase:
+        return _NULL_PHASE
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+    def set(self, name: str, value: int):
+        pass
+
+    def merge(self, other):
+        pass
+
+    def as_dict(self) -> Optional[dict]:
+        return None
+
+    def summary(self) -> str:
+        return ""
+
+
+NULL_STATS = NullStats()
@@ -0,0 +1,160 @@
+"""
+低开销的跟踪支持
+
+- function_scope: 标记当前正在处理的函数, 日志记录会带上 entry_ea
+- RingBufferHandler: 每个函数一个内存环形缓冲区, 只保存未格式化的 LogRecord, 需要时再格式化
+- LazyQueueHandler: 不在调用线程中格式化消息, 由 QueueListener 的后台线程写文件
+- edge_event: 边修改事件, 可以由 JsonLinesFormatter 输出为 JSON lines
+"""
+import collections
+import contextlib
+import json
+import logging
+import logging.handlers
+import threading
+from typing import Deque, List, Optional
+
+DEFAULT_RING_SIZE = 4096  # 每个函数保留的记录数
+DEFAULT_MAX_FUNCTIONS = 64  # 最多保留多少个函数的缓冲区, 超过时淘汰最早的函数
+EDGE_LOGGER_NAME = __name__.rpartition(".")[0] + ".edges" if "." in __name__ else "unflat.edges"
+
+edge_logger = logging.getLogger(EDGE_LOGGER_NAME)
+
+_state = threading.local()
+
+# 可以安全地延迟到其他线程格式化的参数类型, 其他类型(例如 SWIG 对象)在调用线程中立即格式化
+_LAZY_SAFE_TYPES = (int, float, str, bytes, bool, type(None))
+
+
+def current_function() -> int:
+    return getattr(_state, "entry_ea", 0)
+
+
+@contextlib.contextmanager
+def function_scope(entry_ea: int):
+    """
+    在 with 块中产生的日志记录都归属到 entry_ea 对应的函数
+    """
+    prev = current_function()
+    _state.entry_ea = entry_ea
+    try:
+        yield
+    finally:
+        _state.entry_ea = prev
+
+
+def edge_event(event: str, block: int, old: int, new: int):
+    """
+    记录一次边修改, 只在开启 JSON lines 跟踪时产生记录
+    """
+    if edge_logger.isEnabledFor(logging.DEBUG):
+        edge_logger.debug(event, extra={"edge": {"block": block, "old": old, "new": new}})
+
+
+def is_edge_record(record: logging.LogRecord) -> bool:
+    return hasattr(record, "edge")
+
+
+def is_text_record(record: logging.LogRecord) -> bool:
+    return not hasattr(record, "edge")
+
+
+def _freeze(record: logging.LogRecord) -> logging.LogRecord:
+    """
+    参数都是简单类型时保持消息未格式化, 否则立即格式化, 避免在其他线程中访问已经释放的对象
+    """
+    args = record.args
+    if args:
+        items = args.values() if isinstance(args, dict) else args if isinstance(args, tuple) else (args,)
+        if not all(type(arg) in _LAZY_SAFE_TYPES for arg in items):
+            record.msg = record.getMessage()
+            record.args = None
+    return record
+
+
+class FunctionContextFilter(logging.Filter):
+    """
+    在调用线程中给记录加上当前函数的 entry_ea
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "entry_ea"):
+            record.entry_ea = current_function()
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    与 QueueHandler 相同, 但不在调用线程中格式化消息
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return _freeze(record)
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    每个函数一个固定长度的环形缓冲区, 保存最近的日志记录
+
+    记录不做格式化, 只有在 dump/get_lines 时才格式化。
+    """
+    def __init__(self, size: int = DEFAULT_RING_SIZE, max_functions: int = DEFAULT_MAX_FUNCTIONS):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.size = size
+        self.max_functions = max_functions
+        self.function_records: "collections.OrderedDict[int, Deque[logging.LogRecord]]" = collections.OrderedDict()
+        self.addFilter(FunctionContextFilter())
+
+    def emit(self, record: logging.LogRecord):
+        entry_ea = record.entry_ea
+        records = self.function_records.get(entry_ea)
+        if records is None:
+            records = collections.deque(maxlen=self.size)
+            self.function_records[entry_ea] = records
+            while len(self.function_records) > self.max_functions:
+                self.function_records.popitem(last=False)
+        records.append(_freeze(record))
+
+    def get_lines(self, entry_ea: int) -> List[str]:
+        records = self.function_records.get(entry_ea, ())
+        return [self.format(record) for record in records]
+
+    def clear(self, entry_ea: Optional[int] = None):
+        if entry_ea is None:
+            self.function_records.clear()
+        else:
+            self.function_records.pop(entry_ea, None)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    把边修改事件格式化为一行紧凑的 JSON
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        event = {"t": round(record.created, 6), "func": getattr(record, "entry_ea", 0), "event": record.getMessage()}
+        event.update(record.edge)
+        return json.dumps(event, separators=(",", ":"))
+
+
+def find_ring_buffer(logger: logging.Logger) -> Optional[RingBufferHandler]:
+    # 热重载后类对象会变化, 按属性而不是类型查找
+    for handler in logger.handlers:
+        if hasattr(handler, "function_records"):
+            return handler
+    return None
+
+
+def dump_function(logger: logging.Logger, entry_ea: int, path: Optional[str] = None) -> List[str]:
+    """
+    格式化指定函数环形缓冲区中的记录, 传入path时同时写入文件
+
+    Returns:
+        格式化后的日志行, 没有开启跟踪时为空列表
+    """
+    ring = find_ring_buffer(logger)
+    if ring is None:
+        return []
+    lines = ring.get_lines(entry_ea)
+    if path is not None:
+        with open(path, "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(line + "\n")
+    return lines
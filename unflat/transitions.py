@@ -0,0 +1,237 @@
+from .mcapi import *
+from .opkey import KIND_REG, KIND_STACK, key_kind, keys_overlap, operand_key
+from typing import Dict, Optional, Set, Tuple
+
+# setcc -> 条件相同的条件跳转, 用于把 "状态 = f(条件)" 拆成条件跳转
+SETCC_TO_JCC = {
+    m_setz: m_jz, m_setnz: m_jnz, m_setae: m_jae, m_setb: m_jb, m_seta: m_ja,
+    m_setbe: m_jbe, m_setg: m_jg, m_setge: m_jge, m_setl: m_jl, m_setle: m_jle,
+}
+
+_BINARY_OPS = {
+    m_add: lambda a, b: a + b,
+    m_sub: lambda a, b: a - b,
+    m_mul: lambda a, b: a * b,
+    m_and: lambda a, b: a & b,
+    m_or: lambda a, b: a | b,
+    m_xor: lambda a, b: a ^ b,
+    m_shl: lambda a, b: a << b if b < 64 else 0,
+    m_shr: lambda a, b: a >> b if b < 64 else 0,
+}
+_UNARY_OPS = {
+    m_neg: lambda a: -a,
+    m_bnot: lambda a: ~a,
+    m_lnot: lambda a: int(a == 0),
+}
+_COPY_OPS = (m_mov, m_xdu, m_low)
+# 可能写入任意寄存器和内存的指令
+_CLOBBER_OPS = (m_call, m_icall, m_ext)
+# d 不是被写入的目的操作数(stx/ijmp 的 d 是地址), 调用的返回值由 clobber 处理
+_NO_DEST_OPS = (m_stx, m_ijmp, m_call, m_icall)
+
+# 值表示为 (条件为假时的值, 条件为真时的值), 与条件无关时两个值相同; None 表示未知
+Value = Optional[Tuple[int, int]]
+
+
+def _mask(size: int) -> int:
+    return (1 << (8 * size)) - 1 if size > 0 else 0xFFFFFFFFFFFFFFFF
+
+
+class BlockTransition:
+    """
+    块的状态转移摘要: 块结束时每个被写入的寄存器/栈变量的值
+
+    values 以操作数键(opkey)为键, 值为 (条件为假时的值, 条件为真时的值), 条件是块中唯一的 setcc 指令(condition);
+    值为 None 的变量被写入了无法计算的值(包括被部分写入、被调用或间接写入覆盖)。clobbered 是整类被覆盖的
+    种类(KIND_REG/KIND_STACK), 其中的变量即使不在 values 中也视为被写入。
+    """
+    __slots__ = ("mblock_id", "values", "condition", "clobbered")
+
+    def __init__(self, mblock_id: int, values: Dict[int, Value], condition: Optional[minsn_t],
+                 clobbered: Set[int] = frozenset()):
+        self.mblock_id = mblock_id
+        self.values = values
+        self.condition = condition
+        self.clobbered = clobbered
+
+    def writes(self, storage: int) -> bool:
+        if storage in self.values or key_kind(storage) in self.clobbered:
+            return True
+        return any(keys_overlap(storage, key) for key in self.values)
+
+    def outgoing(self, storage: int) -> Value:
+        return self.values.get(storage)
+
+    def is_conditional(self, storage: int) -> bool:
+        value = self.values.get(storage)
+        return value is not None and value[0] != value[1]
+
+
+class _BlockEvaluator:
+    """
+    在一个块内对常量做符号执行, 最多允许一个 setcc 作为条件
+    """
+
+    def __init__(self, stack_escapes: bool = True):
+        self.env: Dict[int, Value] = {}
+        self.condition: Optional[minsn_t] = None
+        self.condition_reads: Set[int] = set()
+        self.condition_valid = True
+        self.stack_escapes = stack_escapes  # 栈变量的地址是否可能被间接写入
+        self.clobbered: Set[int] = set()
+
+    def operand(self, mop: mop_t) -> Value:
+        t = mop.t
+        if t == mop_n:
+            value = mop.nnn.value & _mask(mop.size)
+            return value, value
+        if t == mop_r or t == mop_S:
+            return self.env.get(operand_key(mop))
+        if t == mop_d:
+            return self.insn(mop.d)
+        return None
+
+    def _setcc(self, minsn: minsn_t) -> Value:
+        if self.condition is not None:
+            return None
+        reads = set()
+        for mop in (minsn.l, minsn.r):
+            if mop.t == mop_r or mop.t == mop_S:
+                reads.add(operand_key(mop))
+            elif mop.t != mop_n:
+                return None
+        self.condition = minsn
+        self.condition_reads = reads
+        return 0, 1
+
+    def insn(self, minsn: minsn_t) -> Value:
+        opcode = minsn.opcode
+        if opcode in SETCC_TO_JCC:
+            return self._setcc(minsn)
+        size = minsn.d.size if minsn.d.size > 0 else minsn.l.size
+        mask = _mask(size)
+        if opcode in _COPY_OPS:
+            value = self.operand(minsn.l)
+        elif opcode == m_xds:
+            value = self.operand(minsn.l)
+            if value is not None:
+                sign = 1 << (8 * minsn.l.size - 1)
+                value = tuple((x ^ sign) - sign for x in value)
+        elif opcode in _BINARY_OPS:
+            left = self.operand(minsn.l)
+            right = self.operand(minsn.r)
+            if left is None or right is None:
+                return None
+            op = _BINARY_OPS[opcode]
+            value = (op(left[0], right[0]), op(left[1], right[1]))
+        elif opcode in _UNARY_OPS:
+            value = self.operand(minsn.l)
+            if value is not None:
+                op = _UNARY_OPS[opcode]
+                value = (op(value[0]), op(value[1]))
+        else:
+            return None
+        if value is None:
+            return None
+        return value[0] & mask, value[1] & mask
+
+    def write(self, key: int, value: Value):
+        # 部分重叠的变量(例如写 al 之后的 eax)不再是已知的值
+        for other in self.env:
+            if other != key and keys_overlap(other, key):
+                self.env[other] = None
+        if any(keys_overlap(read, key) for read in self.condition_reads):
+            self.condition_valid = False
+        self.env[key] = value
+
+    def clobber(self, kind: int):
+        """
+        某一类变量全部变为未知: 调用覆盖寄存器, 调用和间接写入(stx)覆盖地址可能被取走的栈变量
+        """
+        self.clobbered.add(kind)
+        for key in self.env:
+            if key_kind(key) == kind:
+                self.env[key] = None
+        if any(key_kind(key) == kind for key in self.condition_reads):
+            self.condition_valid = False
+
+    def side_effects(self, minsn: minsn_t):
+        if minsn.opcode == m_stx:
+            if self.stack_escapes:
+                self.clobber(KIND_STACK)
+        elif _contains_opcode(minsn, _CLOBBER_OPS):
+            self.clobber(KIND_REG)
+            if self.stack_escapes:
+                self.clobber(KIND_STACK)
+
+
+def _contains_opcode(minsn: minsn_t, opcodes) -> bool:
+    """
+    指令本身或者嵌套在操作数中的子指令是否为opcodes之一
+    """
+    stack = [minsn]
+    while stack:
+        cur = stack.pop()
+        if cur.opcode in opcodes:
+            return True
+        for mop in (cur.l, cur.r, cur.d):
+            if mop.t == mop_d:
+                stack.append(mop.d)
+    return False
+
+
+def _operand_takes_stack_address(mop: mop_t) -> bool:
+    if mop.t == mop_a:
+        inner = getattr(mop, "a", None)
+        return inner is None or inner.t == mop_S
+    if mop.t == mop_f:
+        f = getattr(mop, "f", None)
+        return f is None or any(_operand_takes_stack_address(arg) for arg in f.args)
+    return False
+
+
+def stack_escapes(mba: mba_t) -> bool:
+    """
+    函数中是否取了某个栈变量的地址(包括作为调用参数), 取了地址的栈变量可能被 stx 或被调用函数写入
+
+    无法确定的操作数(例如模型中没有展开的参数列表)按取了地址处理。
+    """
+    for i in range(mba.qty):
+        minsn: minsn_t = mba.get_mblock(i).head
+        while minsn:
+            stack = [minsn]
+            while stack:
+                cur = stack.pop()
+                for mop in (cur.l, cur.r, cur.d):
+                    if mop.t == mop_d:
+                        stack.append(mop.d)
+                    elif _operand_takes_stack_address(mop):
+                        return True
+            minsn = minsn.next
+    return False
+
+
+def summarize_block(mblock: mblock_t, stack_escapes: bool = True) -> BlockTransition:
+    """
+    计算块的状态转移摘要
+
+    setcc 的操作数在块结束前被重新写入时条件失效, 依赖条件的值都变为未知。
+
+    Args:
+        stack_escapes: 函数是否取了栈变量的地址, 为 True 时 stx 和调用使所有栈变量变为未知
+    """
+    evaluator = _BlockEvaluator(stack_escapes)
+    minsn: minsn_t = mblock.head
+    while minsn:
+        evaluator.side_effects(minsn)
+        if minsn.opcode not in _NO_DEST_OPS:
+            key = operand_key(minsn.d)
+            if key is not None:
+                evaluator.write(key, evaluator.insn(minsn))
+        minsn = minsn.next
+    values = evaluator.env
+    condition = evaluator.condition if evaluator.condition_valid else None
+    if condition is None:
+        values = {key: (None if value is not None and value[0] != value[1] else value)
+                  for key, value in values.items()}
+    return BlockTransition(mblock.serial, values, condition, evaluator.clobbered)
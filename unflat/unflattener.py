@@ -0,0 +1,671 @@
+from .mcapi import *
+from .cfgUtil import *
+from .valranges import ValrangesParser
+from .opkey import ValrangeKeys, format_key, operand_key
+from .state_table import NO_MATCH, StateIndex, StateTable, has_entropy
+from .stats import DeflatStats, NULL_STATS
+from .passes import InsnCollector, MicrocodePassManager
+from .dispatcher import JMP_OPCODE_HANDLED, CfgAnalysis, DispatcherCandidate, find_dispatchers as find_dispatcher_candidates
+from .transitions import SETCC_TO_JCC, BlockTransition, stack_escapes, summarize_block
+from contextlib import contextmanager
+import logging
+from .logger_config import get_logger
+from typing import TypedDict, Iterable, Iterator, List, Dict, Tuple, Set, Optional
+
+logger = get_logger(__name__)
+
+class ConditionalSplit(TypedDict):
+    mblock_id: int
+    false_mblock_id: int
+    true_mblock_id: int
+
+class LevelScore(TypedDict):
+    level: int
+    resolved: int
+    conflicts: int
+    unreachable: int
+
+# deflat 级别, AUTO_LEVEL 表示自动选择
+AUTO_LEVEL = 0
+DEFLAT_LEVELS = (1, 2, 3, 4)
+# 默认使用状态转移摘要(修改跳转目标和拆分块)的级别, 自动选择时总是使用; 级别1和4只做简单赋值的匹配
+SUMMARY_LEVELS = (2, 3)
+
+# 只包含这些指令的块是分发器的一部分, 反混淆之后不可达是正常的
+JUMP_ONLY_OPCODES = frozenset(JMP_OPCODE_HANDLED) | {m_goto, m_nop}
+
+def _reachable(succs: List[List[int]]) -> List[bool]:
+    seen = [False] * len(succs)
+    if not succs:
+        return seen
+    seen[0] = True
+    stack = [0]
+    while stack:
+        for succ in succs[stack.pop()]:
+            if not seen[succ]:
+                seen[succ] = True
+                stack.append(succ)
+    return seen
+
+class mblock_valranges_filter(vd_printer_t):
+    """
+    在 mba 打印时直接解析 VALRANGES, 不缓存打印出的行
+    """
+    def __init__(self, on_state):
+        vd_printer_t.__init__(self)
+        self.feed = ValrangesParser(on_state).feed
+
+    def _print(self, indent, line):
+        self.feed(line)
+        return 1
+
+class StateAssignmentCollector(InsnCollector):
+    """
+    收集 "mov 高熵常量, 寄存器/栈变量" 形式的状态赋值, 跳过入口块和出口块
+
+    遍历时记录所有常量赋值, 遍历结束后对整张表做一次熵值过滤
+    """
+    opcodes = (m_mov,)
+
+    def __init__(self, unflat: "Unflattener"):
+        self.table = unflat.state_assignments
+        self.last_mblock_id = unflat.mba.qty - 1
+
+    def visit(self, mblock_id: int, minsn: minsn_t, top: bool):
+        if mblock_id == 0 or mblock_id >= self.last_mblock_id or minsn.l.t != mop_n:
+            return
+        storage = operand_key(minsn.d)
+        if storage is not None:
+            self.table.append(mblock_id, storage, minsn.l.nnn.value)
+
+    def finish(self):
+        self.table.filter_entropy()
+
+class CompareCarrierCollector(InsnCollector):
+    """
+    统计条件跳转中用于比较的寄存器/栈变量出现的次数
+    """
+    opcodes = JMP_OPCODE_HANDLED
+
+    def __init__(self, counts: Dict[int, int]):
+        self.counts = counts
+
+    def visit(self, mblock_id: int, minsn: minsn_t, top: bool):
+        storage = operand_key(minsn.l)
+        if storage is not None:
+            self.counts[storage] = self.counts.get(storage, 0) + 1
+
+class Unflattener:
+
+    def __init__(self, mba:mba_t, dispatcher_id = 0, stats: DeflatStats = None, storage_carrier: Optional[str] = None):
+        self.mba = mba
+        self.dispatcher_id = dispatcher_id
+        self.dispatcher_ea = mba.get_mblock(dispatcher_id).start
+        self.valrange_keys = ValrangeKeys(mba)  # VALRANGES 名字 -> 操作数键
+        self.storage_carrier: Optional[int] = None  # 状态变量的操作数键
+        self.forced_carrier: Optional[int] = None  # 手动指定的状态变量, 不会被分发块分析覆盖
+        if storage_carrier:
+            self.forced_carrier = self.valrange_keys.key(storage_carrier) or None
+            if self.forced_carrier is None:
+                logger.warning("0x%x 找不到指定的状态变量 %s, 改为自动查找", mba.entry_ea, storage_carrier)
+            self.storage_carrier = self.forced_carrier
+        self.cfg_analysis: Optional[CfgAnalysis] = None  # 控制流分析结果, 所有分发块共享
+        self.dispatchers: List[DispatcherCandidate] = []  # 结构检测到的分发块, 按分数从高到低
+        self.state_assignments = StateTable()  # 状态变量的赋值语句: (块ID, 被赋值的变量, 状态值)
+        self.possible_states = StateTable()  # 所有可能的状态值: (块ID, VALRANGES 中的变量, 状态值)
+        self.state_index: Optional[StateIndex] = None  # possible_states的连接索引
+        self.redirections: Dict[int, int] = {}  # 块ID -> 新的跳转目标块ID, 按修改顺序记录
+        self.splits: List[ConditionalSplit] = []  # 拆分为条件跳转的块, 序号都是修改前的序号
+        self.transitions: Dict[int, BlockTransition] = {}  # 块ID -> 状态转移摘要, 块被修改时失效
+        self.stack_escapes: Optional[bool] = None  # 函数是否取了栈变量的地址, 第一次计算摘要时检查
+        self.replayed = False  # 结果是否来自缓存重放
+        self.nb_patch = 0  # 实际修改的边数
+        self.nb_blacklisted = 0  # 级别1因为双重赋值跳过、也没有被状态转移摘要处理的块数
+        self.summarized_doubles: Set[int] = set()  # 由状态转移摘要处理的多重赋值块, 各级别的匹配跳过这些块
+        self.compare_counts: Optional[Dict[int, int]] = None  # 比较用的存储器的操作数键 -> 出现次数
+        self.scan_registered = False  # 指令扫描的收集器是否已经注册到某个遍历中
+        self.stats = stats if stats is not None else NULL_STATS  # 各阶段耗时和计数, 默认不统计
+        self.level = None  # 实际使用的 deflat 级别
+        self.level_scores: List[LevelScore] = []  # 自动选择级别时每个级别的评分
+        self._reachable_before: Optional[List[bool]] = None
+
+    def find_dispatcher_id(self):
+        """
+        查找分发块的序号, 查找方法为找到最多入度的块, 如果OLLVM中有预处理块则会被干扰, 需要手动指定分发块序号
+        """
+        max_input_num = -1
+        for i in range(1, self.mba.qty - 1):
+            mblock: mblock_t = self.mba.get_mblock(i)
+            num_input = mblock.npred()
+            if num_input > max_input_num:
+                max_input_num = num_input
+                self.dispatcher_id = i
+
+    def find_dispatchers(self):
+        """
+        通过支配树和回边查找所有分发块, 分数最高的作为dispatcher_id, 没有找到时退回到find_dispatcher_id
+        """
+        if self.cfg_analysis is None:
+            self.cfg_analysis = CfgAnalysis(self.mba)
+        self.dispatchers = find_dispatcher_candidates(self.mba, self.calc_entroy, self.cfg_analysis)
+        if self.dispatchers:
+            self.dispatcher_id = self.dispatchers[0].mblock_id
+            self.storage_carrier = self.dispatchers[0].carrier
+            logger.debug("找到 %d 个分发块, 主分发块: %d", len(self.dispatchers), self.dispatcher_id)
+        else:
+            logger.debug("没有找到符合结构特征的分发块, 使用入度最大的块")
+            self.find_dispatcher_id()
+            self.get_dispatcher_use_compare()
+
+    def calc_entroy(self, value: int) -> bool:
+        """
+        计算熵值, 计算方法:判断每个字节位上是否都有值, 与状态表的整表过滤一致
+        """
+        return has_entropy(value)
+
+    def get_dispatcher_use_compare(self):
+        """
+        找到分发块中用于比较的存储器(寄存器或者栈上变量)
+        """
+        dispatcher_mblock: mblock_t = self.mba.get_mblock(self.dispatcher_id)
+        minsn: minsn_t = dispatcher_mblock.tail
+        logger.debug("minsn: %s", minsn.dstr())
+        if minsn.opcode in JMP_OPCODE_HANDLED:
+            storage = operand_key(minsn.l)
+            if storage is not None:
+                logger.debug("找到状态变量: %s", format_key(storage))
+                self.storage_carrier = storage
+        else:
+            logger.debug("不是主分发块")
+
+    def find_use_compare(self):
+        """
+        找到条件跳转中比较次数最多的存储器, 没有经过指令扫描时单独遍历一次
+        """
+        if self.compare_counts is None:
+            self.compare_counts = {}
+            manager = MicrocodePassManager(self.mba)
+            manager.register(CompareCarrierCollector(self.compare_counts))
+            manager.run()
+        if self.compare_counts:
+            self.storage_carrier = max(self.compare_counts.items(), key=lambda x: x[1])[0]
+
+    def register_collectors(self, manager: MicrocodePassManager):
+        """
+        把状态赋值和比较变量的收集器注册到manager, 和其他分析(例如RemoveDeadCode)共用一次指令遍历
+        """
+        self.state_assignments = StateTable()
+        self.compare_counts = {}
+        manager.register(StateAssignmentCollector(self))
+        manager.register(CompareCarrierCollector(self.compare_counts))
+        self.scan_registered = True
+
+    def scan_instructions(self):
+        """
+        单独遍历一次指令, 收集状态赋值和比较变量
+        """
+        manager = MicrocodePassManager(self.mba)
+        self.register_collectors(manager)
+        manager.run()
+
+    def find_mblock_valranges(self):
+        """
+        找到所有块的VALRANGES, 打印mba的同时流式解析
+        """
+        vp = mblock_valranges_filter(self._add_possible_state)
+        self.mba._print(vp)
+        self.possible_states.filter_entropy()
+        logger.debug("找到了所有块的可能性状态")
+        if logger.isEnabledFor(logging.DEBUG):
+            for mblock_id, carrier, value in self.possible_states:
+                logger.debug("块%d: %s == 0x%x", mblock_id, format_key(carrier), value)
+
+    def _add_possible_state(self, mblock_id: int, valrange_name: str, valrange_value: int):
+        # 先全部记录, 打印结束后对整张表做熵值过滤
+        self.possible_states.append(mblock_id, self.valrange_keys.key(valrange_name), valrange_value)
+
+    def find_next_status_in_mblock(self):
+        """
+        找到所有块中使用到状态赋值的语句并将内容记录
+        """
+        manager = MicrocodePassManager(self.mba)
+        manager.register(StateAssignmentCollector(self))
+        manager.run()
+        logger.debug("找到了所有块中赋值的状态值")
+        if logger.isEnabledFor(logging.DEBUG):
+            for mblock_id, storage, value in self.state_assignments:
+                logger.debug("块%d: %s = 0x%x", mblock_id, format_key(storage), value)
+
+    def build_state_index(self):
+        """
+        为possible_states建立连接索引, 需要在find_mblock_valranges之后调用
+        """
+        self.state_index = StateIndex(self.possible_states)
+        logger.debug("状态索引: %d 个状态值, %d 个状态值对应多个块",
+                     len(self.state_index.by_value), len(self.state_index.ambiguous_values))
+
+    def find_in_possible_states(self, valrange_key=None, valrange_value=None):
+        if self.state_index is None:
+            self.build_state_index()
+        return self.state_index.find(valrange_key, valrange_value)
+    
+    def block_transition(self, mblock_id: int) -> BlockTransition:
+        """
+        获取块的状态转移摘要, 同一个块只计算一次
+        """
+        transition = self.transitions.get(mblock_id)
+        if transition is None:
+            if self.stack_escapes is None:
+                self.stack_escapes = stack_escapes(self.mba)
+            transition = summarize_block(self.mba.get_mblock(mblock_id), self.stack_escapes)
+            self.transitions[mblock_id] = transition
+        return transition
+
+    def invalidate_transitions(self, mblock_ids: Optional[Iterable[int]] = None):
+        """
+        块的指令被修改后使摘要失效, mblock_ids为None时(例如插入块改变了序号)全部失效
+        """
+        if mblock_ids is None:
+            self.transitions.clear()
+            return
+        for mblock_id in mblock_ids:
+            self.transitions.pop(mblock_id, None)
+
+    def _dispatcher_carriers(self) -> Dict[int, int]:
+        """
+        Returns:
+            分发块ID -> 比较的状态变量的操作数键
+        """
+        carriers = {}
+        for dispatcher in self.dispatchers:
+            carriers[dispatcher.header] = dispatcher.carrier
+            carriers[dispatcher.mblock_id] = dispatcher.carrier
+        if self.storage_carrier is not None:
+            carriers.setdefault(self.dispatcher_id, self.storage_carrier)
+        return carriers
+
+    def _returns_to_dispatcher(self) -> Dict[int, int]:
+        """
+        找到直接回到分发块的块: 分发块本身, 以及只有一条goto、最终跳到分发块的中转块
+
+        Returns:
+            块ID -> 回到的分发块比较的状态变量
+        """
+        mba = self.mba
+        returns = self._dispatcher_carriers()
+        work = list(returns)
+        while work:
+            mblock_id = work.pop()
+            carrier = returns[mblock_id]
+            for pred_id in mba.get_mblock(mblock_id).predset:
+                if pred_id in returns:
+                    continue
+                pred: mblock_t = mba.get_mblock(pred_id)
+                head: minsn_t = pred.head
+                if head is not None and head.opcode == m_goto and head.next is None:
+                    returns[pred_id] = carrier
+                    work.append(pred_id)
+        return returns
+
+    def plan_transitions(self) -> Dict[int, int]:
+        """
+        用块的状态转移摘要处理简单赋值匹配不到的块, 需要在build_state_index之后、修改控制流之前调用;
+        只在自动选择级别或者级别2、3时使用(见 SUMMARY_LEVELS)
+
+        - 状态值由多条指令计算得到的常量: 返回新的跳转目标
+        - 状态值由 setcc 决定(x = cond ? a : b): 记录到splits, 由apply_splits拆成条件跳转
+        - 有多次状态赋值的块(级别1的黑名单)同样计算摘要, 以块结束时的值为准, 记录到summarized_doubles;
+          只有一次简单赋值的块由各级别的匹配处理
+
+        Returns:
+            块ID -> 新的跳转目标块ID
+        """
+        mba = self.mba
+        returns = self._returns_to_dispatcher()
+        doubles = self._double_assignment_blocks()
+        single = self.state_assignments.block_ids() - doubles
+        last_mblock_id = mba.qty - 1
+        planned = set()
+        summarized: Dict[int, int] = {}
+        self.splits = []
+        for mblock_id, carrier in returns.items():
+            for pred_id in mba.get_mblock(mblock_id).predset:
+                if (pred_id in returns or pred_id in planned or pred_id in single
+                        or pred_id == 0 or pred_id >= last_mblock_id):
+                    continue
+                pred: mblock_t = mba.get_mblock(pred_id)
+                if pred.nsucc() != 1:
+                    continue
+                value = self.block_transition(pred_id).outgoing(carrier)
+                if value is None:
+                    continue
+                false_mblock_id, true_mblock_id = (self.find_in_possible_states(carrier, x) for x in value)
+                if false_mblock_id is None or true_mblock_id is None:
+                    continue
+                planned.add(pred_id)
+                if false_mblock_id == true_mblock_id:
+                    summarized[pred_id] = false_mblock_id
+                else:
+                    self.splits.append({'mblock_id': pred_id,
+                                        'false_mblock_id': false_mblock_id,
+                                        'true_mblock_id': true_mblock_id})
+        self.summarized_doubles = planned & doubles
+        logger.debug("状态转移摘要: %d 个块(其中 %d 个多重赋值块), %d 个块需要拆分",
+                     len(planned), len(self.summarized_doubles), len(self.splits))
+        return summarized
+
+    def apply_splits(self, splits: List[ConditionalSplit]) -> int:
+        """
+        在块之后插入 "jcc 条件, @真目标" 和 "goto @假目标" 两个新块, 条件来自块中的 setcc
+
+        所有新块由 BlockInsertionPlan 一次插入, 拆分记录中的序号都是插入前的序号。
+
+        Returns:
+            实际拆分的块数
+        """
+        mba = self.mba
+        plan = BlockInsertionPlan(mba)
+        entries = []
+        for split in splits:
+            mblock_id = split['mblock_id']
+            condition = self.block_transition(mblock_id).condition
+            if condition is None or condition.opcode not in SETCC_TO_JCC:
+                logger.debug("块%d没有可用的条件, 不拆分", mblock_id)
+                continue
+            jcc_block = plan.add_jcc_block(mblock_id, split['true_mblock_id'], SETCC_TO_JCC[condition.opcode],
+                                           condition.l, condition.r)
+            plan.add_goto_block(mblock_id, split['false_mblock_id'])
+            entries.append((mblock_id, jcc_block))
+        if not entries:
+            return 0
+        with EdgeTransaction(mba) as txn:
+            plan.commit(txn)
+            for mblock_id, jcc_block in entries:
+                change_jmp_target(mba.get_mblock(plan.remap(mblock_id)), jcc_block.serial, txn)
+        self.nb_patch += len(entries)
+        self.invalidate_transitions()
+        return len(entries)
+
+    def redirect(self, cur_mblock_id: int, next_mblock_id: int, txn: EdgeTransaction):
+        """
+        把块的跳转目标改为next_mblock_id并记录, 记录的结果可以通过replay重放
+        """
+        self.redirections.pop(cur_mblock_id, None)
+        self.redirections[cur_mblock_id] = next_mblock_id
+        if change_jmp_target(self.mba.get_mblock(cur_mblock_id), next_mblock_id, txn):
+            self.nb_patch += 1
+
+    @contextmanager
+    def _edge_transaction(self, txn: EdgeTransaction = None):
+        """
+        传入txn时直接使用(由调用者提交), 否则创建新的事务并在结束时提交
+        """
+        if txn is not None:
+            yield txn
+        else:
+            with EdgeTransaction(self.mba) as txn:
+                yield txn
+
+    def replay(self, dispatcher_id: int, storage_carrier, redirections: Dict[int, int],
+               splits: Optional[List[ConditionalSplit]] = None) -> int:
+        """
+        直接重放之前deflat得到的跳转修改和块拆分, 不再进行分析
+
+        Returns:
+            实际修改的边数
+        """
+        self.dispatcher_id = dispatcher_id
+        self.storage_carrier = storage_carrier
+        self.replayed = True
+        with self.stats.phase("replay"):
+            with EdgeTransaction(self.mba) as txn:
+                for cur_mblock_id, next_mblock_id in redirections.items():
+                    self.redirect(cur_mblock_id, next_mblock_id, txn)
+            # 插入块会改变序号, 在跳转修改提交之后再拆分
+            if splits:
+                self.splits = list(splits)
+                self.apply_splits(self.splits)
+        self.stats.set("patched", self.nb_patch)
+        return self.nb_patch
+
+    def _double_assignment_blocks(self) -> Set[int]:
+        return self.state_assignments.duplicate_blocks()
+
+    def _level_carriers(self) -> Set[int]:
+        if self.forced_carrier is not None:
+            return {self.forced_carrier}
+        if self.dispatchers:
+            return {dispatcher.carrier for dispatcher in self.dispatchers}
+        self.find_use_compare()
+        return {self.storage_carrier}
+
+    def level_matches(self, level: int) -> Iterator[Tuple[int, int, int, int]]:
+        """
+        按修改顺序给出某个级别匹配到的跳转修改, 不修改 mba
+
+        Returns:
+            (块ID, 新的跳转目标块ID, 状态变量的操作数键, 状态值) 的迭代器, 同一个块可能出现多次, 以最后一次为准
+        """
+        if self.state_index is None:
+            self.build_state_index()
+        black_list = self._double_assignment_blocks() if level == 1 else ()
+        summarized_doubles = self.summarized_doubles
+        carriers = self._level_carriers() if level == 3 else None
+        # 整张赋值表一次连接到可能状态表, 级别1和4要求状态变量相同, 级别2和3只比较状态值
+        targets = self.state_index.join(self.state_assignments, by_carrier=level in (1, 4))
+        for (cur_mblock_id, storage, value), next_mblock_id in zip(self.state_assignments, targets):
+            if next_mblock_id == NO_MATCH or (carriers is not None and storage not in carriers):
+                continue
+            if cur_mblock_id in black_list:
+                logger.debug("在同一个mblock%d里面存在两重赋值", cur_mblock_id)
+                continue
+            if cur_mblock_id in summarized_doubles:
+                # 多重赋值块以状态转移摘要为准, 不使用最后一次匹配
+                continue
+            yield cur_mblock_id, next_mblock_id, storage, value
+
+    def _apply_level(self, level: int, txn: EdgeTransaction = None):
+        with self._edge_transaction(txn) as txn:
+            for cur_mblock_id, next_mblock_id, _, _ in self.level_matches(level):
+                self.redirect(cur_mblock_id, next_mblock_id, txn)
+
+    def deflat_level_1(self, txn: EdgeTransaction = None):
+        """
+        剔除具有双重变量的块, 单独使用时不处理这些块; 只有自动选择了级别1时其中由状态转移摘要处理的块不再剔除
+        """
+        self.nb_blacklisted = len(self._double_assignment_blocks() - self.summarized_doubles)
+        self.stats.set("blacklisted", self.nb_blacklisted)
+        self._apply_level(1, txn)
+
+    def deflat_level_2(self, txn: EdgeTransaction = None):
+        """
+        暴力匹配
+        """
+        self._apply_level(2, txn)
+
+    def deflat_level_3(self, txn: EdgeTransaction = None):
+        """
+        仅修改分发块比较的状态变量, 检测到多个分发块时处理所有分发块的状态变量,
+        否则使用比较次数最多的变量
+        """
+        self._apply_level(3, txn)
+
+    def deflat_level_4(self, txn: EdgeTransaction = None):
+        """
+        安全模式, 单独使用时只修改简单赋值匹配到的跳转, 不使用状态转移摘要, 也不拆分块
+        """
+        self._apply_level(4, txn)
+
+    def _redirected_succs(self, redirections: Dict[int, int], splits: List[ConditionalSplit]) -> List[List[int]]:
+        """
+        计算应用跳转修改和块拆分之后每个块的后继, 与 change_jmp_target 的修改方式一致, 不修改 mba
+        """
+        mba = self.mba
+        succs = [[x for x in mba.get_mblock(i).succset] for i in range(mba.qty)]
+        for cur_mblock_id, next_mblock_id in redirections.items():
+            mblock: mblock_t = mba.get_mblock(cur_mblock_id)
+            tail: minsn_t = mblock.tail
+            if tail is None:
+                continue
+            if tail.opcode == m_goto:
+                old = tail.l.b
+            elif tail.opcode in CONDITIONAL_JUMP_LIST:
+                old = tail.d.b
+            else:
+                old = cur_mblock_id + 1
+            succ = succs[cur_mblock_id]
+            succ[:] = [next_mblock_id if x == old else x for x in succ] if old in succ else succ + [next_mblock_id]
+        for split in splits:
+            succs[split['mblock_id']] = [split['false_mblock_id'], split['true_mblock_id']]
+        return succs
+
+    def _is_jump_only(self, mblock_id: int) -> bool:
+        minsn: minsn_t = self.mba.get_mblock(mblock_id).head
+        while minsn:
+            if minsn.opcode not in JUMP_ONLY_OPCODES:
+                return False
+            minsn = minsn.next
+        return True
+
+    def score_level(self, level: int, summarized: Optional[Dict[int, int]] = None) -> LevelScore:
+        """
+        在已经建立的状态表上评估某个级别的跳转修改, 不修改 mba
+
+        - resolved: 被修改跳转目标的块数(包括状态转移摘要得到的修改和拆分)
+        - conflicts: 同一个块匹配到多个不同目标且最后一次匹配与块的状态转移摘要不一致,
+          或者只按状态值匹配到不唯一的块
+        - unreachable: 修改前可达、修改后不可达的块数, 只包含跳转以外还有其他指令的块
+        """
+        redirections: Dict[int, int] = {}
+        targets: Dict[int, Set[int]] = {}
+        last_match: Dict[int, Tuple[int, int]] = {}
+        conflicts = 0
+        by_name = level in (1, 4)
+        for cur_mblock_id, next_mblock_id, storage, value in self.level_matches(level):
+            redirections.pop(cur_mblock_id, None)
+            redirections[cur_mblock_id] = next_mblock_id
+            targets.setdefault(cur_mblock_id, set()).add(next_mblock_id)
+            last_match[cur_mblock_id] = (storage, value)
+            if not by_name and self.state_index.is_ambiguous(value):
+                conflicts += 1
+        for cur_mblock_id, next_mblock_ids in targets.items():
+            if len(next_mblock_ids) > 1:
+                storage, value = last_match[cur_mblock_id]
+                if self.block_transition(cur_mblock_id).outgoing(storage) != (value, value):
+                    conflicts += 1
+        for cur_mblock_id, next_mblock_id in (summarized or {}).items():
+            redirections.setdefault(cur_mblock_id, next_mblock_id)
+
+        if self._reachable_before is None:
+            self._reachable_before = _reachable([[x for x in self.mba.get_mblock(i).succset]
+                                                 for i in range(self.mba.qty)])
+        reachable_after = _reachable(self._redirected_succs(redirections, self.splits))
+        unreachable = sum(1 for i in range(self.mba.qty)
+                          if self._reachable_before[i] and not reachable_after[i] and not self._is_jump_only(i))
+        return {'level': level, 'resolved': len(redirections) + len(self.splits),
+                'conflicts': conflicts, 'unreachable': unreachable}
+
+    def choose_level(self, summarized: Optional[Dict[int, int]] = None, levels=DEFLAT_LEVELS) -> int:
+        """
+        评估所有级别并选择最好的: 优先没有冲突和不可达块的级别, 其次修改的块最多, 最后选择较小的级别
+        """
+        storage_carrier = self.storage_carrier  # 级别3的评估可能会改变状态变量
+        self.level_scores = [self.score_level(level, summarized) for level in levels]
+        self.storage_carrier = storage_carrier
+        best = max(self.level_scores, key=lambda x: (x['conflicts'] + x['unreachable'] == 0,
+                                                      x['resolved'] - x['conflicts'] - x['unreachable'],
+                                                      -x['level']))
+        if logger.isEnabledFor(logging.DEBUG):
+            for score in self.level_scores:
+                logger.debug("级别评分: %s", score)
+        logger.info("0x%x 自动选择级别 %d", self.mba.entry_ea, best['level'])
+        return best['level']
+
+    def deflat(self, level=1, summarize: Optional[bool] = None) -> int:
+        """
+        Args:
+            level: deflat 级别, AUTO_LEVEL 表示在状态表上评估所有级别后自动选择, 选择的级别保存在 self.level
+            summarize: 是否使用状态转移摘要修改跳转目标和拆分块, None 表示自动选择或级别在 SUMMARY_LEVELS 中时使用;
+                重新使用之前自动选择的级别时传入True, 结果与自动选择时一致
+
+        Returns:
+            实际修改的边数
+        """
+        stats = self.stats
+        with stats.phase("dispatcher"):
+            if self.dispatcher_id == 0:
+                self.find_dispatchers()
+            else:
+                self.get_dispatcher_use_compare()
+            if self.forced_carrier is not None:
+                self.storage_carrier = self.forced_carrier
+        stats.set("dispatchers", len(self.dispatchers))
+        with stats.phase("valranges"):
+            self.find_mblock_valranges()
+        with stats.phase("state_index"):
+            self.build_state_index()
+        if not self.scan_registered:
+            with stats.phase("state_scan"):
+                self.scan_instructions()
+        stats.set("possible_states", len(self.possible_states))
+        stats.set("assignments", len(self.state_assignments))
+        if summarize is None:
+            summarize = level == AUTO_LEVEL or level in SUMMARY_LEVELS
+        summarized: Dict[int, int] = {}
+        if summarize:
+            with stats.phase("transitions"):
+                summarized = self.plan_transitions()
+        if level == AUTO_LEVEL:
+            with stats.phase("select_level"):
+                level = self.choose_level(summarized)
+        self.level = level
+        stats.set("level", level)
+        txn = EdgeTransaction(self.mba)
+        with stats.phase("match"):
+            if level == 1:
+                self.deflat_level_1(txn)
+            if level == 2:
+                self.deflat_level_2(txn)
+            if level == 3:
+                self.deflat_level_3(txn)
+            if level == 4:
+                self.deflat_level_4(txn)
+            # 摘要得到的跳转修改在各级别的匹配之后执行, 不覆盖匹配的结果
+            for cur_mblock_id, next_mblock_id in summarized.items():
+                if cur_mblock_id not in self.redirections:
+                    self.redirect(cur_mblock_id, next_mblock_id, txn)
+        with stats.phase("patch"):
+            txn.commit()
+            nb_split = self.apply_splits(self.splits)
+        stats.set("summarized", len(summarized))
+        stats.set("split", nb_split)
+        stats.set("patched", self.nb_patch)
+        return self.nb_patch
+
+def deflat_model(data: dict, level: int = 1, summarize: Optional[bool] = None) -> dict:
+    """
+    在纯 Python 模型上运行 Unflattener, 参数和返回值都可以序列化, 可以交给 IDA 外的进程池
+
+    只能在 IDA 外运行: IDA 中引擎绑定的是 ida_hexrays, 与模型对象不能混用
+
+    Args:
+        data: mcmodel.mba_to_dict 的结果
+        level: deflat 级别, AUTO_LEVEL 表示自动选择
+        summarize: 是否使用状态转移摘要, 与 Unflattener.deflat 相同
+
+    Returns:
+        分发块、状态变量和跳转修改, 可以通过 ida_adapter.apply_redirections 应用到 IDA
+    """
+    if HAVE_IDA:
+        raise RuntimeError("deflat_model 只能在 IDA 外运行, IDA 中请直接对 mba 使用 Unflattener")
+    from .mcmodel import mba_from_dict
+    unflat = Unflattener(mba_from_dict(data))
+    unflat.deflat(level, summarize)
+    return {
+        'entry_ea': unflat.mba.entry_ea,
+        'dispatcher_id': unflat.dispatcher_id,
+        'storage_carrier': unflat.storage_carrier,
+        'level': unflat.level,
+        'redirections': list(unflat.redirections.items()),
+        'splits': unflat.splits,
+    }
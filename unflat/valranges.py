@@ -0,0 +1,65 @@
+import re
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+# 块头, 例如 "1. 0 ; 1WAY-BLOCK 1 INBOUNDS: 0 OUTBOUNDS: 2 ..."
+_BLOCK_RE = re.compile(r"BLOCK (\d+)")
+# VALRANGES 中的单个等值项, 例如 "%0x1C.4:==0x7A1B2C3D", 捕获带大小后缀的名字和值
+_VALRANGE_RE = re.compile(r"(?:^|, )([^ ,.:][^,.:]*(?:\.\d+)?)[^,:]*:==(-?(?:0x)?[0-9A-Fa-f]+)\s*(?=,|$)")
+# 和原先逐字符过滤一致: 只保留 0x20-0x7e 的字符
+_NON_PRINTABLE_RE = re.compile(r"[^\x20-\x7e]+")
+
+VALRANGES_MARKER = "VALRANGES: "
+
+
+class ValrangesParser:
+    """
+    流式解析 mba._print 输出的 VALRANGES, 每收到一行就立即解析, 不保存中间行
+
+    只处理包含 "BLOCK" 或 "VALRANGES" 的行, 其余行在一次子串查找后直接丢弃。
+    每个等值项 (name:==value) 通过 on_state(mblock_id, name, value) 回调交给调用者,
+    name 保留大小后缀(例如 "%0x1C.4"), 由 opkey.ValrangeKeys 转换为操作数键。
+    """
+
+    __slots__ = ("mblock_id", "on_state")
+
+    def __init__(self, on_state: Callable[[int, str, int], None]):
+        self.mblock_id = 0
+        self.on_state = on_state
+
+    def feed(self, line: str):
+        if "VALRANGES" in line:
+            line = _NON_PRINTABLE_RE.sub("", line)
+            pos = line.find(VALRANGES_MARKER)
+            if pos < 0:
+                return
+            mblock_id = self.mblock_id
+            on_state = self.on_state
+            for match in _VALRANGE_RE.finditer(line[pos + len(VALRANGES_MARKER):]):
+                on_state(mblock_id, match.group(1), int(match.group(2), 16))
+        elif "BLOCK" in line:
+            match = _BLOCK_RE.search(_NON_PRINTABLE_RE.sub("", line))
+            if match:
+                self.mblock_id = int(match.group(1))
+
+
+def parse_valranges(lines: Iterable[str],
+                    accept: Optional[Callable[[int], bool]] = None) -> Iterator[Tuple[int, str, int]]:
+    """
+    从已经录制的 microcode 文本中解析 VALRANGES
+
+    Args:
+        lines: microcode 文本行
+        accept: 可选的状态值过滤函数, 例如熵值判断
+
+    Returns:
+        (mblock_id, valrange_name, valrange_value) 迭代器
+    """
+    pending = []
+    parser = ValrangesParser(lambda mblock_id, name, value: pending.append((mblock_id, name, value)))
+    for line in lines:
+        parser.feed(line)
+        if pending:
+            for entry in pending:
+                if accept is None or accept(entry[2]):
+                    yield entry
+            pending.clear()